@@ -0,0 +1,241 @@
+from typing import Any, Callable, Dict, List, Tuple
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import sqlalchemy
+
+from benchmarks.harness import Timer
+
+# Repository root, tables.json and all modules are taken from there
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG_PATH = os.path.join(ROOT, "tables.json")
+
+# Modules that are slow to import, they may be imported only once a rule or a snapshot format needs them
+LAZY_MODULES = ("faker", "scipy", "pandas", "pyarrow")
+# Statements measured by startup cases, each in a fresh interpreter started in the root of the repository
+STARTUP_STATEMENTS = {
+    "import_generator": "import generator",
+    "cli_help": "import contextlib, io, runpy\n"
+                "sys.argv = ['generator.py', '--help']\n"
+                "with contextlib.suppress(SystemExit), contextlib.redirect_stdout(io.StringIO()):\n"
+                "    runpy.run_path('generator.py', run_name='__main__')",
+}
+STARTUP_SCRIPT = """import sys, time
+start = time.perf_counter()
+{statement}
+print(time.perf_counter() - start, *[module for module in {lazy_modules} if module in sys.modules])
+"""
+
+
+def load_config() -> Dict[str, Any]:
+    with open(CONFIG_PATH, "r") as file:
+        return json.load(file)
+
+
+def create_sqlite_storage(folder: str, snapshot_format: str = "csv") -> Dict[str, Any]:
+    """Creates DAOs of tables.json backed by a fresh SQLite database inside folder
+    """
+    from dao_models.factory import create_data_storage
+    engine = sqlalchemy.create_engine(f"sqlite:///{os.path.join(folder, 'benchmark.db')}")
+    metadata = sqlalchemy.MetaData()
+    data_storage = create_data_storage(load_config(), engine, metadata, os.path.join(folder, "snapshot"),
+                                       snapshot_format=snapshot_format, seed=0)
+    metadata.create_all(engine)
+    return data_storage
+
+
+def generate_dependencies(data_storage: Dict[str, Any], name: str, number_of_entries: int) -> None:
+    """Generates (not measured) every data storage that name depends on, directly or not
+    """
+    for dep in data_storage[name].dependency:
+        generate_dependencies(data_storage, dep, number_of_entries)
+        if not data_storage[dep].has_been_generated():
+            data_storage[dep].generate(number_of_entries)
+
+
+def startup_case(statement: str, budget: float, repeats: int = 5) -> Tuple[int, float]:
+    """Measures import latency: best time of statement run in a fresh interpreter (1 row = 1 start)
+
+    Raises:
+        AssertionError: When the best time exceeds budget (seconds) or statement imports any of LAZY_MODULES
+    """
+    script = STARTUP_SCRIPT.format(statement=STARTUP_STATEMENTS[statement], lazy_modules=LAZY_MODULES)
+    times = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, "-c", script], cwd=ROOT, capture_output=True, text=True, check=True).stdout
+        seconds, *imported = output.split()
+        assert not imported, f"{statement} imports {', '.join(imported)} on startup"
+        times.append(float(seconds))
+    assert min(times) <= budget, f"{statement} takes {min(times):.3f} s, budget {budget:.3f} s"
+    return 1, min(times)
+
+
+def rule_case(column: str, n: int) -> Tuple[int, float]:
+    from rule_book import BasicRuleBook
+    # Faker and scipy are created / imported by the first value, which is not measured
+    BasicRuleBook.generate_column_batch(column, 1)
+    BasicRuleBook.seed(0)
+    with Timer() as timer:
+        BasicRuleBook.generate_column_batch(column, n)
+    return n, timer.seconds
+
+
+def date_sampling_case(n: int) -> Tuple[int, float]:
+    from rule_book import BasicRuleBook
+    BasicRuleBook.seed(0)
+    with Timer() as timer:
+        BasicRuleBook.date_generator.sample(n)
+    return n, timer.seconds
+
+
+def hour_sampling_case(n: int) -> Tuple[int, float]:
+    from rule_book import BasicRuleBook
+    BasicRuleBook.hour_generator.sample(1)
+    BasicRuleBook.seed(0)
+    with Timer() as timer:
+        BasicRuleBook.hour_generator.sample(n)
+    return n, timer.seconds
+
+
+def sqldao_generate_case(table: str, n: int) -> Tuple[int, float]:
+    with tempfile.TemporaryDirectory() as folder:
+        data_storage = create_sqlite_storage(folder)
+        generate_dependencies(data_storage, table, min(n, 1000))
+        with Timer() as timer:
+            data_storage[table].generate(n)
+        data_storage[table].engine.dispose()
+    return n, timer.seconds
+
+
+def sqldao_save_case(table: str, n: int, snapshot_format: str = "csv") -> Tuple[int, float]:
+    with tempfile.TemporaryDirectory() as folder:
+        data_storage = create_sqlite_storage(folder, snapshot_format)
+        generate_dependencies(data_storage, table, min(n, 1000))
+        data_storage[table].generate(n)
+        with Timer() as timer:
+            data_storage[table].save(folder)
+        data_storage[table].engine.dispose()
+    return n, timer.seconds
+
+
+def sqldao_load_case(table: str, n: int, snapshot_format: str = "csv") -> Tuple[int, float]:
+    from dao_models.snapshot_io import snapshot_path
+    with tempfile.TemporaryDirectory() as source, tempfile.TemporaryDirectory() as target:
+        data_storage = create_sqlite_storage(source, snapshot_format)
+        generate_dependencies(data_storage, table, min(n, 1000))
+        data_storage[table].generate(n)
+        data_storage[table].save(source)
+        data_storage[table].engine.dispose()
+        # Loaded into an empty database
+        data_storage = create_sqlite_storage(target, snapshot_format)
+        with Timer() as timer:
+            data_storage[table].load(snapshot_path(os.path.join(source, f"{table}_insert"), snapshot_format))
+        data_storage[table].engine.dispose()
+    return n, timer.seconds
+
+
+def rowwise_load_case(table: str, n: int) -> Tuple[int, float]:
+    """Reference for sqldao.load.csv: loads the same file the way SQLDAO.load did before columns were coerced by the schema
+    (csv.DictReader, booleans converted value by value, sqlalchemy insert of dicts), so that the speed-up can be read from results
+    """
+    import csv
+    from dao_models.snapshot_io import snapshot_path
+    with tempfile.TemporaryDirectory() as source, tempfile.TemporaryDirectory() as target:
+        data_storage = create_sqlite_storage(source)
+        generate_dependencies(data_storage, table, min(n, 1000))
+        data_storage[table].generate(n)
+        data_storage[table].save(source)
+        data_storage[table].engine.dispose()
+        data_storage = create_sqlite_storage(target)
+        data_access = data_storage[table]
+        booleans = [column.name for column in data_access.data_object.columns if isinstance(column.type, sqlalchemy.Boolean)]
+        with Timer() as timer, data_access.engine.connect() as conn, \
+                open(snapshot_path(os.path.join(source, f"{table}_insert"), "csv"), newline="") as file:
+            batch = []
+            for row in csv.DictReader(file):
+                for column in booleans:
+                    row[column] = row[column] in ("True", "1")
+                batch.append(row)
+                if len(batch) >= 5000:
+                    conn.execute(sqlalchemy.insert(data_access.data_object), batch)
+                    conn.commit()
+                    batch = []
+            if batch:
+                conn.execute(sqlalchemy.insert(data_access.data_object), batch)
+                conn.commit()
+        data_access.engine.dispose()
+    return n, timer.seconds
+
+
+def csvdao_generate_case(sheet: str, n: int, snapshot_format: str = "csv") -> Tuple[int, float]:
+    with tempfile.TemporaryDirectory() as folder:
+        data_storage = create_sqlite_storage(folder, snapshot_format)
+        # Every row of the sheet pulls one row of each dependency
+        generate_dependencies(data_storage, sheet, n)
+        with Timer() as timer:
+            data_storage[sheet].generate(n)
+        data_storage[sheet].engine.dispose()
+    return n, timer.seconds
+
+
+def end_to_end_case(scale_factor: int, max_workers: int = 1) -> Tuple[int, float]:
+    """Runs DataGenerator.generate_data on tables.json with ratios of its data storages multiplied by scale_factor
+    """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as folder:
+        # DataGenerator keeps snapshots relative to the working directory and takes the database from SQL_URL
+        os.makedirs(os.path.join(folder, "data", "snapshots"))
+        os.environ["SQL_URL"] = f"sqlite:///{os.path.join(folder, 'benchmark.db')}"
+        os.chdir(folder)
+        try:
+            from generator import DataGenerator
+            from generation_spec import resolve_counts
+            entries = resolve_counts(load_config(), scale_factor)
+            data_generator = DataGenerator(CONFIG_PATH, seed=0)
+            with Timer() as timer:
+                data_generator.generate_data(entries, max_workers)
+            data_generator.engine.dispose()
+        finally:
+            os.chdir(cwd)
+    return sum(entries.values()), timer.seconds
+
+
+def collect_cases(rows: int, scale_factors: List[int], snapshot_formats: List[str],
+                  startup_budget: float = 1.0) -> List[Tuple[str, Callable[..., Tuple[int, float]], Tuple[Any, ...]]]:
+    """Lists all benchmark cases as (name, function, arguments)
+
+    Args:
+        rows (int): Amount of rows of rule, sampling and DAO cases
+        scale_factors (List[int]): Scale factors of end to end cases
+        snapshot_formats (List[str]): Snapshot formats of save / load / sheet cases
+        startup_budget (float, optional): Seconds that startup cases may take. Defaults to 1.0.
+
+    Returns:
+        List[Tuple[str, Callable[..., Tuple[int, float]], Tuple[Any, ...]]]: Cases in the order they are run
+    """
+    from rule_book import BasicRuleBook
+    config = load_config()
+    cases = [(f"startup.{statement}", startup_case, (statement, startup_budget)) for statement in STARTUP_STATEMENTS]
+    cases += [(f"rule.{column}", rule_case, (column, rows)) for column in BasicRuleBook.rules]
+    cases.append(("sampling.date_generator", date_sampling_case, (rows, )))
+    cases.append(("sampling.hour_generator", hour_sampling_case, (rows, )))
+    for table in config["Tables"]:
+        cases.append((f"sqldao.generate.{table}", sqldao_generate_case, (table, rows)))
+    for snapshot_format in snapshot_formats:
+        for table in config["Tables"]:
+            cases.append((f"sqldao.save.{snapshot_format}.{table}", sqldao_save_case, (table, rows, snapshot_format)))
+            cases.append((f"sqldao.load.{snapshot_format}.{table}", sqldao_load_case, (table, rows, snapshot_format)))
+        if snapshot_format == "csv":
+            # Tables without dates / times, the loader before coercion sent them to SQLite as strings, which it rejects
+            for table, table_config in config["Tables"].items():
+                if not {"Date", "Time", "DateTime"} & set(table_config["attr"].values()):
+                    cases.append((f"reference.rowwise_load.csv.{table}", rowwise_load_case, (table, rows)))
+        for sheet in config["Sheets"]:
+            cases.append((f"csvdao.generate.{snapshot_format}.{sheet}", csvdao_generate_case, (sheet, rows, snapshot_format)))
+    for scale_factor in scale_factors:
+        cases.append((f"end_to_end.sf{scale_factor}", end_to_end_case, (scale_factor, )))
+    return cases
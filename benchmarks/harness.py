@@ -0,0 +1,133 @@
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from dataclasses import dataclass, asdict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+
+
+@dataclass
+class BenchmarkResult:
+    """Measurement of one benchmark case
+    """
+    name: str
+    rows: int
+    seconds: float
+    rows_per_second: float
+    # Peak resident set size of the process running the case
+    peak_rss_mb: float
+    error: Optional[str] = None
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is given in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_case(name: str, case: Callable[..., Tuple[int, float]], args: Tuple[Any, ...]) -> BenchmarkResult:
+    """Runs one case inside the current process, progress printed by DAOs is silenced
+
+    Case returns the amount of processed rows and the time spent on the measured part only
+    (setup like creating tables or generating dependencies is not measured)
+    """
+    try:
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            rows, seconds = case(*args)
+    except Exception as error:
+        return BenchmarkResult(name, 0, 0.0, 0.0, peak_rss_mb(), f"{type(error).__name__}: {error}")
+    return BenchmarkResult(name, rows, seconds, rows / seconds if seconds > 0 else 0.0, peak_rss_mb())
+
+
+def run_isolated(name: str, case: Callable[..., Tuple[int, float]], args: Tuple[Any, ...] = ()) -> BenchmarkResult:
+    """Runs one case in a fresh (spawned) process, so that its peak RSS and imports are not shared with other cases
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(run_case, name, case, args).result()
+
+
+class Timer:
+    """Context manager measuring wall time of the block it wraps
+    """
+    def __enter__(self) -> "Timer":
+        self.start = time.perf_counter()
+        self.seconds = 0.0
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.seconds = time.perf_counter() - self.start
+
+
+def save_results(results: List[BenchmarkResult], path: str, meta: Optional[Dict[str, Any]] = None) -> None:
+    content = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            **(meta or {}),
+        },
+        "results": {result.name: asdict(result) for result in results},
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as file:
+        json.dump(content, file, indent=2)
+
+
+def load_results(path: str) -> Dict[str, Dict[str, Any]]:
+    with open(path, "r") as file:
+        return json.load(file)["results"]
+
+
+def compare(results: List[BenchmarkResult], baseline: Dict[str, Dict[str, Any]], tolerance: float = 0.2) -> List[str]:
+    """Compares results with a saved baseline
+
+    Failed cases are regressions whatever the baseline holds, cases without a measurement
+    in the baseline are not compared (see missing_from_baseline)
+
+    Args:
+        results (List[BenchmarkResult]): Current measurements
+        baseline (Dict[str, Dict[str, Any]]): Measurements saved earlier (as read by load_results)
+        tolerance (float, optional): Allowed relative drop of rows/s and rise of peak RSS. Defaults to 0.2.
+
+    Returns:
+        List[str]: Description of every regression, empty if there are none
+    """
+    regressions = []
+    for result in results:
+        if result.error:
+            regressions.append(f"{result.name}: fails with {result.error}")
+            continue
+        before = baseline.get(result.name)
+        if before is None or before.get("error"):
+            continue
+        if before["rows_per_second"] and result.rows_per_second < before["rows_per_second"] * (1 - tolerance):
+            regressions.append(f"{result.name}: {result.rows_per_second:,.0f} rows/s, baseline {before['rows_per_second']:,.0f} rows/s")
+        if before["peak_rss_mb"] and result.peak_rss_mb > before["peak_rss_mb"] * (1 + tolerance):
+            regressions.append(f"{result.name}: peak RSS {result.peak_rss_mb:,.1f} MB, baseline {before['peak_rss_mb']:,.1f} MB")
+    return regressions
+
+
+def missing_from_baseline(results: List[BenchmarkResult], baseline: Dict[str, Dict[str, Any]]) -> List[str]:
+    """Names of cases that succeeded but have no measurement in the baseline to be compared with
+    (new cases, or ones that failed when the baseline was saved)
+    """
+    return [result.name for result in results if not result.error and (result.name not in baseline or baseline[result.name].get("error"))]
+
+
+def format_table(results: List[BenchmarkResult], baseline: Optional[Dict[str, Dict[str, Any]]] = None) -> str:
+    baseline = baseline or {}
+    lines = [f"{'case':<40} {'rows':>10} {'seconds':>9} {'rows/s':>12} {'peak RSS MB':>12} {'vs baseline':>12}"]
+    for result in results:
+        if result.error:
+            lines.append(f"{result.name:<40} ERROR {result.error}")
+            continue
+        before = baseline.get(result.name, {}).get("rows_per_second")
+        change = f"{(result.rows_per_second / before - 1) * 100:+.1f}%" if before else "-"
+        lines.append(f"{result.name:<40} {result.rows:>10} {result.seconds:>9.3f} {result.rows_per_second:>12,.0f} {result.peak_rss_mb:>12.1f} {change:>12}")
+    return "\n".join(lines)
@@ -0,0 +1,69 @@
+"""Benchmarks of generation and load paths, run offline against SQLite in temporary directories
+
+Run from the root of the repository:
+
+    python -m benchmarks.run --save-baseline            # measure and store benchmarks/baseline.json
+    python -m benchmarks.run                            # measure and compare with the baseline
+
+Every case runs in its own process, results (rows/s and peak RSS) are stored as JSON and the run
+fails (exit code 1) if any case fails or got slower or hungrier than the baseline by more than the tolerance.
+Cases with no measurement in the baseline are listed, they are compared once it is saved again.
+Startup cases (import latency) fail on their own, whenever they exceed --startup-budget
+"""
+import argparse
+import os
+import shutil
+import sys
+
+from benchmarks.cases import collect_cases
+from benchmarks.harness import run_isolated, save_results, load_results, compare, missing_from_baseline, format_table
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks of rules, samplers, DAOs and whole generation")
+    parser.add_argument("--rows", type=int, default=20000, help="Amount of rows of rule, sampling and DAO cases")
+    parser.add_argument("--scale-factors", type=int, nargs="+", default=[1, 5], help="Scale factors of end to end cases")
+    parser.add_argument("--snapshot-formats", type=str, nargs="+", default=["csv"], help="Snapshot formats of save / load / sheet cases")
+    parser.add_argument("--only", type=str, default=None, help="Run only cases whose name contains this text")
+    parser.add_argument("--output", type=str, default=os.path.join(BENCHMARKS_DIR, "results.json"), help="Where to store results")
+    parser.add_argument("--baseline", type=str, default=os.path.join(BENCHMARKS_DIR, "baseline.json"), help="Results to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative drop of rows/s and rise of peak RSS")
+    parser.add_argument("--startup-budget", type=float, default=1.0, help="Seconds that importing generator / printing --help may take")
+    parser.add_argument("--save-baseline", action="store_true", help="Store results as the new baseline instead of comparing")
+    args = parser.parse_args()
+
+    cases = [case for case in collect_cases(args.rows, args.scale_factors, args.snapshot_formats, args.startup_budget) if args.only is None or args.only in case[0]]
+    results = []
+    for name, case, case_args in cases:
+        print(f"Running {name}", flush=True)
+        results.append(run_isolated(name, case, case_args))
+    save_results(results, args.output, {"rows": args.rows, "scale_factors": args.scale_factors})
+
+    baseline = load_results(args.baseline) if os.path.exists(args.baseline) and not args.save_baseline else None
+    print(format_table(results, baseline))
+    print(f"Results saved to {args.output}")
+    if args.save_baseline:
+        shutil.copyfile(args.output, args.baseline)
+        print(f"Baseline saved to {args.baseline}")
+    elif baseline is None:
+        print("No baseline to compare with, run with --save-baseline first")
+    else:
+        for name in missing_from_baseline(results, baseline):
+            print(f"NO BASELINE {name}: not compared, run with --save-baseline to measure it")
+    # Failed cases (also ones asserting on their own budget) are regressions regardless of the baseline
+    regressions = compare(results, baseline or {}, args.tolerance)
+    if regressions:
+        against = f" against {args.baseline}" if baseline is not None else ""
+        print(f"\n{len(regressions)} REGRESSION(S){against} (tolerance {args.tolerance:.0%}):", file=sys.stderr)
+        for regression in regressions:
+            print(f"  {regression}", file=sys.stderr)
+        return 1
+    if baseline is not None:
+        print("No regressions against the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
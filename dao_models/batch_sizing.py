@@ -0,0 +1,136 @@
+from typing import Any, Callable, List, Optional, Sequence
+
+import sys
+import time
+
+from instrumentation import METRICS
+
+
+def estimate_row_bytes(rows: List[Any], sample_size: int = 100) -> int:
+    """Estimates bytes one row (tuple or dict of python objects) takes in memory, from the first rows
+    """
+    sample = rows[:sample_size]
+    if not sample:
+        return 0
+    values = [row.values() if isinstance(row, dict) else row for row in sample]
+    return max(1, sum(sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row_values)
+                      for row, row_values in zip(sample, values)) // len(sample))
+
+
+class AdaptiveBatchSize:
+    """Amount of rows moved at once (inserted into the database, fetched from it), tuned while it runs by measured latency and rows/s
+
+    The size grows as long as bigger batches give more rows/s, goes back to the previous size once they stop paying off
+    and is halved whenever one batch takes longer than the target latency. It never gets bigger than the memory budget
+    allows (bytes of a row are estimated from the first rows seen). After each change back the size is held for a while,
+    so that noise of single measurements does not make it swing
+
+    Only batches that do not decide about generated values are tuned: batches of generation stay fixed, because their sizes decide about seeds
+    """
+    # Bounds of the size, how much it grows at once and how much better (relatively) rows/s has to get for it to keep growing
+    minimum = 100
+    maximum = 200000
+    growth = 1.5
+    tolerance = 0.05
+    # Measurements the size is held for after it was changed back
+    hold = 10
+
+    def __init__(self, initial: int, stage: str, target_seconds: float = 1.0, memory_budget: Optional[int] = None,
+                 maximum: Optional[int] = None):
+        """
+        Args:
+            initial (int): Size to start with
+            stage (str): What is measured (insert, fetch), resizes are counted as {stage}_resizes
+            target_seconds (float, optional): Longest time one batch should take. Defaults to 1.0.
+            memory_budget (Optional[int], optional): Bytes rows of one batch may take. Defaults to None (no limit).
+            maximum (Optional[int], optional): Largest size (e.g. rows committed at once). Defaults to None (maximum of the class).
+        """
+        if maximum is not None:
+            self.maximum = max(self.minimum, maximum)
+        self.stage = stage
+        self.target_seconds = target_seconds
+        self.memory_budget = memory_budget
+        self.row_bytes = None
+        self.size = self.bounded(initial)
+        # Size and rows/s measured before the last growth, None when the size did not grow
+        self.previous = None
+        self.held = 0
+
+    def bounded(self, size: float) -> int:
+        limit = self.maximum
+        if self.memory_budget is not None and self.row_bytes:
+            limit = min(limit, self.memory_budget // self.row_bytes)
+        return int(max(self.minimum, min(size, limit)))
+
+    def measure_rows(self, rows: List[Any]) -> None:
+        """Estimates bytes of one row from the first rows (python objects, so that the budget bounds memory of the process)
+        """
+        if self.row_bytes is not None or not rows:
+            return
+        self.row_bytes = estimate_row_bytes(rows)
+        self.size = self.bounded(self.size)
+
+    def resize(self, size: float) -> None:
+        size = self.bounded(size)
+        if size != self.size:
+            METRICS.count(f"{self.stage}_resizes")
+            self.size = size
+
+    def observe(self, rows: int, seconds: float) -> None:
+        """Tunes the size by a batch of rows that took seconds
+        """
+        # Last batches are smaller, they tell nothing about the size
+        if rows < self.size:
+            return
+        rate = rows / max(seconds, 1e-6)
+        if seconds > self.target_seconds:
+            self.previous, self.held = None, self.hold
+            self.resize(self.size / 2)
+        elif self.previous is not None and rate < self.previous[1] * (1 + self.tolerance):
+            # Bigger batches did not pay off
+            self.held = self.hold
+            self.resize(self.previous[0])
+            self.previous = None
+        elif self.held > 0:
+            self.held -= 1
+        else:
+            self.previous = (self.size, rate)
+            self.resize(self.size * self.growth)
+
+
+class RowChunker:
+    """Regroups rows given in batches of any size into chunks of the size chosen by AdaptiveBatchSize, every chunk is written
+    by write and measured (without sizing rows are written in the batches they are given in)
+
+    Usage:
+        chunks = RowChunker(write, sizing)
+        for rows in batches:
+            chunks.put(rows)
+        chunks.flush()
+    """
+    def __init__(self, write: Callable[[List[Sequence[Any]]], None], sizing: Optional[AdaptiveBatchSize] = None):
+        self.write = write
+        self.sizing = sizing
+        self.pending = []
+
+    def put(self, rows: List[Sequence[Any]]) -> None:
+        if self.sizing is None:
+            self.write(rows)
+            return
+        self.sizing.measure_rows(rows)
+        self.pending.extend(rows)
+        while len(self.pending) >= self.sizing.size:
+            chunk, self.pending = self.pending[:self.sizing.size], self.pending[self.sizing.size:]
+            self.write_chunk(chunk)
+
+    def flush(self) -> None:
+        """Writes rows still waiting for a full chunk (before a commit, at the end)
+        """
+        if self.pending:
+            chunk, self.pending = self.pending, []
+            self.write_chunk(chunk)
+
+    def write_chunk(self, rows: List[Sequence[Any]]) -> None:
+        start = time.perf_counter()
+        self.write(rows)
+        self.sizing.observe(len(rows), time.perf_counter() - start)
@@ -0,0 +1,159 @@
+from datetime import date, datetime, time
+from typing import Any, Dict, List, Optional, Sequence
+
+import csv
+import io
+import sqlalchemy
+
+
+class BulkLoader:
+    """Default way of inserting batches: executemany of sqlalchemy insert
+
+    Used for every dialect (and driver) that has no faster loader. Loaders only insert, DAOs commit (see commit) after every batch
+    of generation / chunk of loading, so that no transaction is kept open for a whole table (other workers writing into
+    the same database, e.g. one SQLite file, would wait for it) and tables end at a batch of generation if the run crashes
+
+    Rows of a batch are sequences (e.g. tuples) of values in the order of columns
+    """
+    # Converts dates / times into the text they are stored as, None if the driver takes python objects
+    temporal_to_text = None
+
+    def __init__(self, batch_size: Optional[int] = None):
+        # Amount of rows inserted at once, None means the default of the DAO
+        self.batch_size = batch_size
+
+    def prepare(self, connector: sqlalchemy.Connection) -> None:
+        """Called once per connection, before the first batch
+        """
+        pass
+
+    def insert(self, connector: sqlalchemy.Connection, table: sqlalchemy.Table, columns: List[str], rows: List[Sequence[Any]]) -> None:
+        connector.execute(sqlalchemy.insert(table), [dict(zip(columns, row)) for row in rows])
+
+    def commit(self, connector: sqlalchemy.Connection) -> None:
+        """Commits rows inserted so far
+        """
+        connector.commit()
+
+    def finish(self, connector: sqlalchemy.Connection) -> None:
+        """Called once per connection, after the last batch
+        """
+        connector.commit()
+
+
+class SQLiteBulkLoader(BulkLoader):
+    """Loader for SQLite: rows passed straight to the driver, with journaling relaxed by pragmas
+
+    Rows are passed straight to the driver, so strings are stored as they are (SQLite has no strict Date / Time types)
+    and dates / times (read from typed snapshots) are stored as iso strings, the same way sqlalchemy stores them
+    """
+    pragmas = ["PRAGMA journal_mode=WAL", "PRAGMA synchronous=OFF", "PRAGMA busy_timeout=60000"]
+
+    def prepare(self, connector: sqlalchemy.Connection) -> None:
+        for pragma in self.pragmas:
+            connector.exec_driver_sql(pragma)
+        connector.commit()
+
+    @staticmethod
+    def to_iso(value: Any) -> Any:
+        if isinstance(value, datetime):
+            return value.isoformat(" ")
+        return value.isoformat() if isinstance(value, (date, time)) else value
+
+    # Dates / times read from csv snapshots are stored in the same text form as values of typed snapshots
+    temporal_to_text = to_iso
+
+    def insert(self, connector: sqlalchemy.Connection, table: sqlalchemy.Table, columns: List[str], rows: List[Sequence[Any]]) -> None:
+        if not rows:
+            return
+        preparer = connector.dialect.identifier_preparer
+        stmt = (f"INSERT INTO {preparer.format_table(table)} ({', '.join(preparer.quote(column) for column in columns)}) "
+                f"VALUES ({', '.join('?' for _ in columns)})")
+        # Columns holding dates / times are recognized by the first row
+        temporal = [isinstance(value, (date, time)) for value in rows[0]]
+        if any(temporal):
+            rows = [tuple(SQLiteBulkLoader.to_iso(value) if is_temporal else value for value, is_temporal in zip(row, temporal)) for row in rows]
+        connector.exec_driver_sql(stmt, rows)
+
+
+class PostgresCopyLoader(BulkLoader):
+    """Loader for PostgreSQL (psycopg2 / psycopg): every batch is streamed with COPY FROM STDIN as csv
+    """
+    null = "\\N"
+
+    def insert(self, connector: sqlalchemy.Connection, table: sqlalchemy.Table, columns: List[str], rows: List[Sequence[Any]]) -> None:
+        if not rows:
+            return
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerows([self.null if value is None else value for value in row] for row in rows)
+        preparer = connector.dialect.identifier_preparer
+        stmt = (f"COPY {preparer.format_table(table)} ({', '.join(preparer.quote(column) for column in columns)}) "
+                f"FROM STDIN WITH (FORMAT csv, NULL '{self.null}')")
+        cursor = connector.connection.dbapi_connection.cursor()
+        try:
+            if hasattr(cursor, "copy_expert"):
+                # psycopg2
+                buffer.seek(0)
+                cursor.copy_expert(stmt, buffer)
+            else:
+                # psycopg (3)
+                with cursor.copy(stmt) as copy:
+                    copy.write(buffer.getvalue())
+        finally:
+            cursor.close()
+
+
+# Options of create_engine making executemany faster, by (dialect, driver), overridden by options given to create_sql_engine
+DIALECT_ENGINE_OPTIONS = {
+    # Whole batch is sent in one round trip (the default BulkLoader is used, the option is set only on engines created for it)
+    ("mssql", "pyodbc"): {"fast_executemany": True},
+    # Updates / deletes of many rows are batched too (inserts already use multi-row VALUES)
+    ("postgresql", "psycopg2"): {"executemany_mode": "values_plus_batch"},
+    # Bigger multi-row INSERT statements than the default 1000 rows of sqlalchemy
+    ("mysql", "mysqldb"): {"insertmanyvalues_page_size": 5000},
+    ("mysql", "pymysql"): {"insertmanyvalues_page_size": 5000},
+}
+
+
+def create_sql_engine(url: str, pool_size: Optional[int] = None, max_overflow: Optional[int] = None,
+                      pool_pre_ping: bool = False, pool_timeout: Optional[float] = None, **options: Any) -> sqlalchemy.Engine:
+    """Creates engine of the database with pool settings and executemany options of its dialect (see DIALECT_ENGINE_OPTIONS)
+
+    DAOs generated at the same time use connections of one pool (each one its own, sheets one more per dependency they read),
+    so the pool should hold at least as many connections as there are DAO workers, or they wait for each other
+
+    Args:
+        url (str): Url of the database
+        pool_size (Optional[int], optional): Connections kept open by the pool. Defaults to None (default of sqlalchemy, 5).
+        max_overflow (Optional[int], optional): Connections opened over pool_size when all are used. Defaults to None (default of sqlalchemy, 10).
+        pool_pre_ping (bool, optional): Connections are checked before use (servers closing idle connections). Defaults to False.
+        pool_timeout (Optional[float], optional): Seconds to wait for a free connection. Defaults to None (default of sqlalchemy, 30).
+        options (Any): Other keyword arguments of sqlalchemy.create_engine
+
+    Returns:
+        sqlalchemy.Engine: Engine of the database
+    """
+    url = sqlalchemy.engine.make_url(url)
+    pool_options = {"pool_size": pool_size, "max_overflow": max_overflow, "pool_timeout": pool_timeout}
+    options = {**DIALECT_ENGINE_OPTIONS.get((url.get_backend_name(), url.get_driver_name()), {}),
+               **{key: value for key, value in pool_options.items() if value is not None}, **options}
+    return sqlalchemy.create_engine(url, pool_pre_ping=pool_pre_ping, **options)
+
+
+def create_bulk_loader(engine: sqlalchemy.Engine, batch_size: Optional[int] = None) -> BulkLoader:
+    """Chooses the fastest loader available for the dialect (and driver) of the engine
+
+    Args:
+        engine (sqlalchemy.Engine): Engine of the database
+        batch_size (Optional[int], optional): Amount of rows inserted at once. Defaults to None (the default of the DAO).
+
+    Returns:
+        BulkLoader: Loader for the engine
+    """
+    dialect, driver = engine.dialect.name, engine.dialect.driver
+    if dialect == "sqlite" and driver == "pysqlite":
+        return SQLiteBulkLoader(batch_size)
+    if dialect == "postgresql" and driver in ("psycopg2", "psycopg"):
+        return PostgresCopyLoader(batch_size)
+    return BulkLoader(batch_size)
@@ -0,0 +1,73 @@
+from datetime import date, datetime, time
+from typing import Any, Callable, List, Optional
+
+import sqlalchemy
+
+# Strings read as true values of boolean columns (csv holds True / False, rules generate 1 / 0)
+TRUE_VALUES = frozenset(("True", "true", "1"))
+
+
+def parse_distinct(strings: List[str], parse: Callable[[str], Any]) -> List[Any]:
+    """Parses every distinct string once (dates and times repeat a lot) and maps the column through parsed values
+    """
+    parsed = {string: None if string == "" else parse(string) for string in set(strings)}
+    return list(map(parsed.__getitem__, strings))
+
+
+def column_coercion(datatype: sqlalchemy.types.TypeEngine, nullable: bool = True,
+                    temporal_to_text: Optional[Callable[[Any], str]] = None) -> Optional[Callable[[List[Any]], List[Any]]]:
+    """Returns function converting a whole column of strings (read from csv) into values of the sqlalchemy type at once
+
+    Columns are converted with map over builtin parsers (or over distinct values), which is faster than converting
+    value by value and than parsing strings with NumPy. Columns that already hold typed values (read from parquet / arrow)
+    are returned as they are, empty strings become None
+
+    Args:
+        datatype (sqlalchemy.types.TypeEngine): Datatype of the column
+        nullable (bool, optional): Whether empty strings of string columns are None. Defaults to True.
+        temporal_to_text (Optional[Callable[[Any], str]], optional): Converts parsed dates / times into the text they are stored as
+        (by loaders that pass them as text), None keeps python objects. Defaults to None.
+
+    Returns:
+        Optional[Callable[[List[Any]], List[Any]]]: Function taking values of the column and returning converted ones, None if nothing has to be converted.
+        It raises ValueError on strings that are not valid values of the type
+    """
+    # Order matters, Boolean has to be checked before Integer and DateTime before Date
+    if isinstance(datatype, sqlalchemy.Boolean):
+        convert = lambda strings: list(map(TRUE_VALUES.__contains__, strings))
+    elif isinstance(datatype, (sqlalchemy.Integer, sqlalchemy.Float)):
+        number = int if isinstance(datatype, sqlalchemy.Integer) else float
+        convert = lambda strings: list(map(number, strings))
+    elif isinstance(datatype, (sqlalchemy.DateTime, sqlalchemy.Date, sqlalchemy.Time)):
+        parse = datetime.fromisoformat if isinstance(datatype, sqlalchemy.DateTime) else \
+            date.fromisoformat if isinstance(datatype, sqlalchemy.Date) else time.fromisoformat
+        if temporal_to_text is not None:
+            # Values are still validated, but stored in one canonical text form
+            parse = lambda string, parse=parse: temporal_to_text(parse(string))
+        return lambda values: parse_distinct(values, parse) if values and isinstance(values[0], str) else values
+    elif nullable:
+        convert = lambda strings: strings
+    else:
+        return None
+
+    def coerce(values: List[Any]) -> List[Any]:
+        if not values or not isinstance(values[0], str):
+            return values
+        if "" not in values:
+            return convert(values)
+        # Empty values are left out of conversion
+        converted = iter(convert([value for value in values if value != ""]))
+        return [None if value == "" else next(converted) for value in values]
+    return coerce
+
+
+def stored_form(datatype: sqlalchemy.types.TypeEngine) -> Optional[Callable[[List[Any]], List[Any]]]:
+    """Returns function converting generated values of a column into values the storage gives back once they are stored,
+    None if they are the same
+
+    Only booleans differ: rules generate 0 / 1, while databases (and Arrow) give back False / True. Generated dates and times
+    are strings in iso format, the same text as the one of values read back
+    """
+    if not isinstance(datatype, sqlalchemy.Boolean):
+        return None
+    return lambda values: [value if value is None else value in TRUE_VALUES if isinstance(value, str) else bool(value) for value in values]
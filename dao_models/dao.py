@@ -1,22 +1,133 @@
 import sqlalchemy
 import random
-import pandas as pd
-from typing import List, Dict, Self, Any, Union, Optional
+from typing import List, Dict, Self, Any, Union, Optional, Iterator, Tuple
 from abc import ABC, abstractmethod
 
-import sqlalchemy.dialects
-import sqlalchemy.dialects.mssql
-
-from rule_book import BasicRuleBook
+from rule_book import RuleBook, derive_seed, get_rule_book
+from .row_plan import RowPlan
+from .snapshot_io import write_checkpoint
+from .batch_sizing import AdaptiveBatchSize
 
 
 class DAO(ABC):
-    def __init__(self, name: str, data_object: Any, dependency: List[str] = []):
+    # Amount of rows generated at once, if not given otherwise
+    default_batch_size = 5000
+
+    def __init__(self, name: str, data_object: Any, dependency: List[str] = [],
+                 rule_book: Optional[RuleBook] = None, seed: Optional[int] = None, pipeline_depth: int = 2):
         self.name = name
         self.data_object = data_object
         self.dependency = dependency
         self.generated = False
         self.loaded = False
+        # Own RuleBook keeps generation of this DAO independent of DAOs generated at the same time
+        # (None -> RuleBook shared by the process, created only once the DAO generates something)
+        self._rule_book = rule_book
+        # How rows are built, compiled on first use (see get_row_plan)
+        self.row_plan = None
+        # Seed of the run, every batch is generated from its own sub-seed (None -> not reproducible)
+        self.seed = seed
+        # How many generated batches may wait for being written (inserted) in the writer thread, 0 -> no writer thread
+        self.pipeline_depth = pipeline_depth
+        # Snapshot folder that checkpoints of generation are written into and after how many batches, None -> no checkpoints
+        self.checkpoint_folder = None
+        self.checkpoint_every = 0
+        # Where the interrupted generation started and ends, set when it is resumed (see resume)
+        self.resumed = None
+        # Bytes rows of one insert / fetch may take when their sizes are tuned while they run, None -> fixed sizes
+        self.batch_memory_budget = None
+
+    @property
+    def rule_book(self) -> RuleBook:
+        if self._rule_book is None:
+            self._rule_book = get_rule_book()
+        return self._rule_book
+
+    @rule_book.setter
+    def rule_book(self, rule_book: RuleBook) -> None:
+        self._rule_book = rule_book
+        # Plan holds rules resolved by the previous RuleBook
+        self.row_plan = None
+
+    def get_row_plan(self) -> RowPlan:
+        if self.row_plan is None:
+            self.row_plan = self.compile_row_plan()
+        return self.row_plan
+
+    def seed_batch(self, batch_start: int) -> None:
+        """Reseeds RuleBook for the batch starting at row batch_start, so that the batch can be regenerated on its own
+
+        Batch gives the same values as long as it starts at the same row and has the same size
+        """
+        if self.seed is not None:
+            self.rule_book.seed(derive_seed(self.seed, self.name, batch_start))
+
+    def get_batch_size(self) -> int:
+        return self.default_batch_size
+
+    def enable_checkpoints(self, folder: str, every: int = 10) -> None:
+        """Writes progress of generation into the snapshot folder every given amount of batches, so that a crashed generation can be resumed
+
+        Args:
+            folder (str): Snapshot folder of the run
+            every (int, optional): Amount of batches between checkpoints, 0 disables them. Defaults to 10.
+        """
+        self.checkpoint_folder = folder if every > 0 else None
+        self.checkpoint_every = every
+
+    def should_checkpoint(self, batches: int) -> bool:
+        return self.checkpoint_folder is not None and batches % self.checkpoint_every == 0
+
+    def write_checkpoint(self, origin: Dict[str, Any], next_row: int, finished: bool = False, **state: Any) -> None:
+        """Saves that rows of the generation up to next_row are stored (rows are regenerated from the seed, so no random state is saved:
+        every batch is reseeded from the seed of the run and its first row)
+
+        Args:
+            origin (Dict[str, Any]): Where the generation started, where it ends and its batch size
+            next_row (int): First row that is not stored yet
+            finished (bool, optional): Whether the generation has finished. Defaults to False.
+            state (Any): Other values needed to resume the generation
+        """
+        if self.checkpoint_folder is None:
+            return
+        write_checkpoint(self.checkpoint_folder, self.name, {"seed": self.seed, **origin, "next_row": next_row, "finished": finished, **state})
+
+    def resume(self, checkpoint: Dict[str, Any]) -> None:
+        """Continues generation interrupted after the checkpoint, without generating stored rows again
+
+        Raises:
+            ValueError: When the data storage cannot resume generation
+        """
+        raise ValueError(f"{self.name} cannot resume generation")
+
+    def enable_adaptive_batches(self, memory_budget_mb: int = 64) -> None:
+        """Tunes amounts of rows inserted / fetched at once by measured latency and rows/s (see AdaptiveBatchSize)
+
+        Args:
+            memory_budget_mb (int, optional): Megabytes rows of one insert / fetch may take, 0 keeps fixed sizes. Defaults to 64.
+        """
+        self.batch_memory_budget = memory_budget_mb * 2 ** 20 if memory_budget_mb > 0 else None
+
+    def create_batch_sizing(self, initial: int, stage: str, target_seconds: float = 1.0, maximum: Optional[int] = None) -> Optional[AdaptiveBatchSize]:
+        """Size of inserts / fetches starting at initial rows (and at most maximum rows), None if sizes are fixed
+        """
+        if self.batch_memory_budget is None:
+            return None
+        return AdaptiveBatchSize(initial, stage, target_seconds, self.batch_memory_budget, maximum)
+
+    @staticmethod
+    def batch_ranges(start: int, number_of_entries: int, batch_size: int) -> Iterator[Tuple[int, int]]:
+        """Splits rows <start;start+number_of_entries) into batches whose boundaries are multiples of batch_size,
+        so that every batch (and its seed) is the same whichever row the generation started at
+
+        Yields:
+            Iterator[Tuple[int, int]]: First row of the batch and its size
+        """
+        end = start + number_of_entries
+        while start < end:
+            batch_end = min((start // batch_size + 1) * batch_size, end)
+            yield start, batch_end - start
+            start = batch_end
 
     def unload(self) -> None:
         """Function sets data storage as not loaded so that multiple files can be inserted
@@ -67,6 +178,12 @@ class DAO(ABC):
         """
         pass
 
+    @abstractmethod
+    def compile_row_plan(self) -> RowPlan:
+        """Resolves once what fills every column of a row (rules, dependencies, post rules, coercions)
+        """
+        pass
+
     @abstractmethod
     def generate_entry(self) -> None:
         pass
@@ -76,6 +193,11 @@ class DAO(ABC):
         pass
     
     @abstractmethod
-    def save(self, path: Optional[str] = None) -> None:
+    def save(self, path: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Saves the data storage into the snapshot folder path
+
+        Returns:
+            Optional[Dict[str, Any]]: Entry of the data storage in the manifest of the snapshot, None if nothing was saved
+        """
         pass
             
\ No newline at end of file
@@ -1,30 +1,60 @@
 from .dao import DAO
+from .row_plan import RowPlan
+from .pipeline import BatchWriter, prefetch
+from .batch_sizing import AdaptiveBatchSize
+from .snapshot_io import SnapshotWriter, snapshot_path, merge_snapshots, read_snapshot_store, count_snapshot_rows, describe_parts
+from .dao_memory import ColumnStore
+from .coercion import stored_form
 
-from rule_book import BasicRuleBook
+from rule_book import RuleBook
+from instrumentation import METRICS
+from db_model import return_arrow_type, return_pandas_dtype
 
-from typing import Dict, Any, Optional
+from itertools import islice
+from typing import Dict, Any, Optional, List, Iterator, Tuple
 
 import sqlalchemy
-import pandas as pd
-import csv
 import os
+import time
 
 class CSVDAO(DAO):
     def __init__(self, name, data_object, dependency = ..., mapping_dict: Dict[str, str] = None, 
                  /, engine: Optional[sqlalchemy.Engine] = None, metadata: Optional[sqlalchemy.MetaData] = None,
-                 keep_object: Optional[bool] = False, snapshot: Optional[str] = "T1"):
-        super().__init__(name, data_object, dependency)
+                 keep_object: Optional[bool] = False, snapshot: Optional[str] = "T1", fetch_size: Optional[int] = 1000,
+                 snapshot_format: Optional[str] = "csv", compression: Optional[str] = "zstd",
+                 rule_book: Optional[RuleBook] = None, seed: Optional[int] = None, columns: Optional[List[str]] = None,
+                 pipeline_depth: int = 2, store: Optional[str] = "pandas", chunk_size: Optional[int] = 100000,
+                 csv_compression: Optional[str] = None, stores: Optional[Dict[str, ColumnStore]] = None):
+        super().__init__(name, data_object, dependency, rule_book, seed, pipeline_depth)
+        # Columns of the sheet, so that data_object (pandas DataFrame) is needed only once the sheet is read
+        self.columns = columns if columns is not None else list(data_object.columns)
         self.mapping = mapping_dict
         self.engine = engine
         self.metadata = metadata
+        # Whether rows of the sheet are kept in memory (as pandas DataFrame or, with store "arrow", pyarrow Table)
         self.keep = keep_object
+        self.store = store
+        # How many rows of the sheet file are read at once
+        self.chunk_size = chunk_size
         self.snapshot = snapshot
+        # How many rows of a dependency are fetched at once
+        self.fetch_size = fetch_size
+        # Dependency tables reflected once per run {"table_name": sqlalchemy.Table}
+        self.dependency_tables = {}
+        # Format of the generated sheet file (csv, parquet or arrow) and compression of parquet / arrow files
+        self.snapshot_format = snapshot_format
+        self.compression = compression
+        # Compression of csv files (gzip, zstd), None -> plain csv
+        self.csv_compression = csv_compression
+        # Tables kept in memory instead of in the database {"table_name": ColumnStore}, their rows are read straight from their batches
+        self.stores = stores if stores is not None else {}
     
     def get_column_names(self) -> Dict[str, None]:
-        return {col: None for col in self.data_object.columns}
+        return {col: None for col in self.columns}
     
-    def generate_entry(self, dependency_dict: Dict[str, Any] = None, index: Optional[int] = -1) -> Dict[str, Any]:
-        """Function generating one entry in storage
+    def generate_entry(self, dependency_dict: Dict[str, Any] = None, index: Optional[int] = -1,
+                       generated_values: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Function generating one entry in storage (generate builds whole batches with the row plan instead)
 
         To correctly assign database columns to csv file, one must change mapping dictionary
         
@@ -35,86 +65,302 @@ class CSVDAO(DAO):
         but also Examiner_licence from Examiner DB. Notice that Examiner DB also has 
 
         Args:
-            dependency_dict (Dict[str, Any], optional): Dictionary containing all dependencies. Defaults to None.
+            dependency_dict (Dict[str, Any], optional): Dictionary containing iterators over rows of all dependencies. Defaults to None.
             index (int, optional): Index of the entry. Defaults to -1.
+            generated_values (Dict[str, Any], optional): Values of columns generated beforehand for a whole batch. Defaults to None.
 
         Returns:
-            Dict[str, Any]: _description_
+            Dict[str, Any]: Column name and its value
         """
-        entry = self.get_column_names()
-        # Go through all dependencies and pull necessary info from db
+        plan = self.get_row_plan()
+        values = {column: [value] for column, value in generated_values.items()} if generated_values else plan.generate(1)
+        self.fill_dependencies(values, dependency_dict or {}, 1)
+        return dict(zip(plan.columns, plan.rows(values)[0]))
+
+    def compile_row_plan(self) -> RowPlan:
+        """Generated columns take rules of RuleBook, mapped columns are filled from rows of dependencies
+        (or by their own rule if the dependency gives no value, converted into the form values of the dependency have)
+        """
+        generated = self.get_generated_columns()
+        dependencies = {dep: list(self.mapping[dep].items()) for dep in self.dependency}
+        fallbacks = {}
         for dep in self.dependency:
-            result = next(dependency_dict[dep]["data"], None)
-            dependency_dict[dep]["remaining"] -= 1
-            if result is None:
-                continue
-            # Set wanted info from pulled values onto the entry dictionary
-            for (csv, db) in self.mapping[dep].items():
-                entry[csv] = result[db]
-        # Fill other None values keys with generated values
-        for column in entry.keys():
-            if not entry[column]:
-                entry[column] = BasicRuleBook.generate_column_value(column)
-        return entry
+            table = self.metadata.tables.get(dep) if self.metadata is not None else None
+            for column, source in self.mapping[dep].items():
+                if (rule := self.rule_book.resolve_value_rule(column)) is None:
+                    rule = lambda column=column: self.rule_book.generate_column_value(column)
+                # E.g. booleans of the database (True / False) instead of 1 / 0 of rules
+                if table is not None and source in table.c and (convert := stored_form(table.c[source].type)) is not None:
+                    rule = lambda rule=rule, convert=convert: convert([rule()])[0]
+                fallbacks[column] = rule
+        return RowPlan(list(self.columns), generated, self.rule_book.compile_batch(generated), dependencies, fallbacks=fallbacks)
+
+    def fill_dependencies(self, values: Dict[str, List[Any]], pulled_dependencies: Dict[str, Iterator[sqlalchemy.RowMapping]], size: int) -> None:
+        """Fills mapped columns of a batch with the next size rows of every dependency
+
+        Args:
+            values (Dict[str, List[Any]]): Values of the batch, filled in place
+            pulled_dependencies (Dict[str, Iterator[sqlalchemy.RowMapping]]): Streams of rows of dependencies
+            size (int): Amount of rows in the batch
+        """
+        plan = self.get_row_plan()
+        for dep, slots in plan.dependencies.items():
+            rows = list(islice(pulled_dependencies[dep], size)) if dep in pulled_dependencies else []
+            # Rows missing when the dependency has fewer rows than the sheet
+            missing = [None] * (size - len(rows))
+            for column, source in slots:
+                values[column] = [row[source] for row in rows] + missing
+        plan.fill_fallbacks(values)
+
+    def get_generated_columns(self) -> List[str]:
+        """Columns that are not mapped from any dependency, so they are always generated by RuleBook
+        """
+        mapped = {csv for dep in self.dependency for csv in self.mapping[dep].keys()}
+        return [column for column in self.get_column_names().keys() if column not in mapped]
+
+    def get_dependency_table(self, table_name: str) -> sqlalchemy.Table:
+        """Returns dependency table, reflecting it from the database only once per run
+        """
+        if table_name not in self.dependency_tables:
+            if table_name in self.metadata.tables:
+                self.dependency_tables[table_name] = self.metadata.tables[table_name]
+            else:
+                self.dependency_tables[table_name] = sqlalchemy.Table(table_name, self.metadata, autoload_with=self.engine)
+        return self.dependency_tables[table_name]
+
+    @staticmethod
+    def keyset_condition(columns: List[sqlalchemy.Column], last: List[Any]) -> sqlalchemy.ColumnElement:
+        """Condition selecting rows placed after last in the order of columns ((a, b) > (x, y) written out for every dialect)
+        """
+        condition = columns[-1] > last[-1]
+        for column, value in zip(reversed(columns[:-1]), reversed(last[:-1])):
+            condition = sqlalchemy.or_(column > value, sqlalchemy.and_(column == value, condition))
+        return condition
 
     # TODO jezeli chce podtrzymac losowanie wierszy to musi to byc tutaj, jedna opcja to po prostu select druga to select z newid
-    def refill_query(self, table_name: str, connector, pull_size: int, current_place: int) -> Dict[str, Any]:
-        # Reflect dependency table
-        table = sqlalchemy.Table(table_name, self.metadata, autoload_with=self.engine)
-        # Check amount of rows
-        max_index = sqlalchemy.select(sqlalchemy.func.count()).select_from(table)
-        max_index = connector.execute(max_index).scalar()
-        # Set pulling size to be either the wanted size or the amount of rows in the table
-        pulling_size = pull_size if max_index > (pull_size + current_place) else (max_index - current_place)
-        # If there is no more rows to pull return a "dummy" object
-        if pulling_size <= 0:
-            return {
-                "data": iter([]),
-                "remaining": 0
-            }
-        # Assign random order to each row in pulled data, and pull only primary keys
-        stmt = table.select().order_by(table.primary_key.columns).offset(current_place).limit(pulling_size).with_only_columns(*[table.c[key] for key in self.mapping[table_name].values()])
-        ret = connector.execute(stmt).mappings().fetchall()
-        return {
-            "data": iter(ret),
-            "remaining": pulling_size
-        }
-
-    def generate(self, number_of_entries, batch_size: int = 5000):
+    def stream_dependency(self, table_name: str, connector, fetch_size: int, start: int = 0) -> Iterator[sqlalchemy.RowMapping]:
+        """Streams rows of a dependency in the order of its primary key, page by page with keyset pagination,
+        so that reading the whole table costs O(n)
+
+        Args:
+            table_name (str): Name of the dependency table
+            connector: Connection to the database
+            fetch_size (int): How many rows are fetched at once
+            start (int, optional): How many first rows to skip (only the first page uses OFFSET). Defaults to 0.
+
+        Yields:
+            Iterator[sqlalchemy.RowMapping]: Rows with mapped columns of the dependency
+        """
+        for rows in self.fetch_dependency_pages(table_name, connector, fetch_size, start):
+            yield from rows
+
+    @staticmethod
+    def stream_rows(batches: Iterator[Dict[str, List[Any]]]) -> Iterator[Dict[str, Any]]:
+        """Rows of a dependency given as its batches, column by column ({"column": [values]})
+        """
+        for values in batches:
+            columns = list(values)
+            yield from (dict(zip(columns, row)) for row in zip(*values.values()))
+
+    def pull_dependency(self, table_name: str, start: int = 0) -> Iterator[sqlalchemy.RowMapping]:
+        """Streams rows of a dependency like stream_dependency, pages are read ahead in their own thread with their own connection
+        (or from the batches of the dependency, if it is kept in memory)
+        """
+        def pages() -> Iterator[List[sqlalchemy.RowMapping]]:
+            if table_name in self.stores:
+                yield from self.stores[table_name].pages_in_key_order(list(self.mapping[table_name].values()), self.fetch_size, start)
+                return
+            with self.engine.connect() as conn:
+                # Pages are read ahead, so they may take up to the time of a few batches
+                yield from self.fetch_dependency_pages(table_name, conn, self.fetch_size, start,
+                                                       self.create_batch_sizing(self.fetch_size, "fetch", target_seconds=0.5))
+        pulled = prefetch(pages, self.pipeline_depth, f"{self.name}-{table_name}")
+        try:
+            for rows in pulled:
+                yield from rows
+        finally:
+            pulled.close()
+
+    def fetch_dependency_pages(self, table_name: str, connector, fetch_size: int, start: int = 0,
+                               sizing: Optional[AdaptiveBatchSize] = None) -> Iterator[List[sqlalchemy.RowMapping]]:
+        """Pages of rows of a dependency (see stream_dependency), of fetch_size rows or of the size tuned by sizing
+        """
+        table = self.get_dependency_table(table_name)
+        primary_key = list(table.primary_key.columns)
+        columns = [table.c[key] for key in dict.fromkeys(self.mapping[table_name].values())]
+        columns += [column for column in primary_key if column not in columns]
+        last = None
+        while True:
+            fetch_size = sizing.size if sizing is not None else fetch_size
+            stmt = sqlalchemy.select(*columns).order_by(*primary_key).limit(fetch_size)
+            if last is not None:
+                stmt = stmt.where(CSVDAO.keyset_condition(primary_key, last))
+            elif start:
+                stmt = stmt.offset(start)
+            fetch_start = time.perf_counter()
+            with METRICS.timer("fetch_dependencies"):
+                rows = connector.execute(stmt).mappings().fetchall()
+            if sizing is not None:
+                sizing.measure_rows(rows)
+                sizing.observe(len(rows), time.perf_counter() - fetch_start)
+            yield rows
+            if len(rows) < fetch_size:
+                return
+            last = [rows[-1][column.name] for column in primary_key]
+
+    def output_path(self, part: Optional[int] = None) -> str:
+        """Path of the generated sheet, or of one of its parts when generated in shards
+        """
+        path = f"{self.snapshot}/{self.name}_" if part is None else f"{self.snapshot}/{self.name}_.part{part}"
+        return snapshot_path(path, self.snapshot_format, self.csv_compression)
+
+    def get_dtypes(self) -> Dict[str, str]:
+        """pandas dtypes of columns: mapped columns take the type of their dependency column, the rest are strings
+        """
+        dtypes = {column: "string" for column in self.columns}
+        dtypes.update({csv: return_pandas_dtype(self.get_dependency_table(dep).c[db].type)
+                       for dep in self.dependency for (csv, db) in self.mapping[dep].items()})
+        return dtypes
+
+    def read_sheet(self, path: str) -> Any:
+        """Reads the sheet file chunk by chunk with types of its columns into the store of the sheet
+        """
+        return read_snapshot_store(path, self.chunk_size, self.get_dtypes(), self.store)
+
+    def get_column_types(self) -> Dict[str, Any]:
+        """Arrow types of columns for typed snapshots: mapped columns take the type of their dependency column, the rest are strings
+        """
+        if self.snapshot_format == "csv":
+            return {}
+        return {csv: return_arrow_type(self.get_dependency_table(dep).c[db].type)
+                for dep in self.dependency for (csv, db) in self.mapping[dep].items()}
+
+    def merge_parts(self, parts: List[str]) -> None:
+        """Concatenates sheet parts generated in shards (in the given order) into one sheet and removes them
+        """
+        merge_snapshots(parts, self.output_path(), self.columns, self.snapshot_format,
+                        self.get_column_types(), self.compression)
+        if self.keep:
+            self.data_object = self.read_sheet(self.output_path())
+
+    def generate(self, number_of_entries, batch_size: Optional[int] = None, start: int = 0, part: Optional[int] = None,
+                 streams: Optional[Dict[str, Iterator[Dict[str, List[Any]]]]] = None):
+        """Generates entries into the sheet
+
+        Args:
+            number_of_entries (int): Amount of entries to generate
+            batch_size (Optional[int], optional): Amount of entries written to the file at once. Defaults to None (5000).
+            start (int, optional): Index of the first entry, dependencies are read starting from this row (it also decides about seeds of batches). Defaults to 0.
+            part (Optional[int], optional): Number of the part file to write into (when generated in shards). Defaults to None.
+            streams (Optional[Dict[str, Iterator[Dict[str, List[Any]]]]], optional): Batches of dependencies ({"column": [values]})
+            passed while the dependencies are generated (see SQLDAO.fuse), instead of rows read from storage. Defaults to None.
+        """
+        streams = streams or {}
         self.generated = True
-        batch = []
-        pulled_dependencies = {}
-        pull_size = 1000
+        batch_size = batch_size or self.get_batch_size()
+        plan = self.get_row_plan()
         os.makedirs(self.snapshot, exist_ok=True)
-        with self.engine.connect() as conn:
-            with open(f"{self.snapshot}/{self.name}_.csv", "w") as file:
-                writer = csv.DictWriter(file, fieldnames=self.get_column_names().keys())
-                writer.writeheader()
-                for dep in self.dependency:
-                        if dep not in pulled_dependencies:
-                            pulled_dependencies[dep] = self.refill_query(dep, conn, pull_size, 0)
-                for idx in range(number_of_entries):
-                    for dep in self.dependency:
-                        if pulled_dependencies[dep]["remaining"] == 0:
-                            pulled_dependencies[dep] = self.refill_query(dep, conn, pull_size, idx)
-                    contents = self.generate_entry(pulled_dependencies, idx)
-                    batch.append(contents)
-                    if len(batch) >= batch_size:
-                        writer.writerows(batch)
-                        print(self.name, " is saving to file ", idx)
-                        batch = []
-                if batch:
-                    writer.writerows(batch)
-        if self.keep:
-            self.data_object = pd.read_csv(f"{self.snapshot}/{self.name}.csv")
+        # Dependency tables are reflected before their rows are pulled in other threads
+        [self.get_dependency_table(dep) for dep in self.dependency]
+        # Rows of the whole generation (kept when it is resumed)
+        origin = self.resumed or {"start": start, "end": start + number_of_entries, "batch_size": batch_size}
+        with METRICS.scope(self.name, "generate"):
+            # Resumed generation appends rows to the file written before the crash
+            with SnapshotWriter(self.output_path(part), plan.columns, self.snapshot_format,
+                                self.get_column_types(), self.compression, append=self.resumed is not None) as file_writer:
+                if file_writer.resumable:
+                    self.write_checkpoint(origin, start, file_size=file_writer.sync())
+                written = 0
+                def write(batch: Tuple[int, List[Tuple[Any, ...]]]) -> None:
+                    nonlocal written
+                    batch_end, rows = batch
+                    with METRICS.timer("write"):
+                        file_writer.write(rows)
+                    METRICS.batch_done(len(rows), batch_end - start)
+                    written += 1
+                    # Other formats cannot be appended to, their generation starts over when it is resumed
+                    if file_writer.resumable and self.should_checkpoint(written):
+                        with METRICS.timer("checkpoint"):
+                            self.write_checkpoint(origin, batch_end, file_size=file_writer.sync())
+                # One stream of rows per dependency, read once for the whole generation (ahead of the batches that need them)
+                pulled_dependencies = {dep: CSVDAO.stream_rows(streams[dep]) if dep in streams else self.pull_dependency(dep, start)
+                                       for dep in self.dependency}
+                try:
+                    # Batches are written into the file while next ones are generated
+                    with BatchWriter(write, self.pipeline_depth, f"{self.name}-writer") as writer:
+                        for batch_start, size in DAO.batch_ranges(start, number_of_entries, batch_size):
+                            self.seed_batch(batch_start)
+                            # Generate values of the whole batch column by column
+                            values = plan.generate(size)
+                            # Includes pulling rows of dependencies (measured on its own as fetch_dependencies)
+                            with METRICS.timer("entries"):
+                                self.fill_dependencies(values, pulled_dependencies, size)
+                                batch = plan.rows(values)
+                            writer.put((batch_start + size, batch))
+                finally:
+                    [pulled.close() for pulled in pulled_dependencies.values()]
+                with METRICS.timer("write"):
+                    file_writer.flush()
+        self.write_checkpoint(origin, start + number_of_entries, True)
+        self.resumed = None
+        # Parts of sharded sheets are kept only once they are merged
+        if self.keep and part is None:
+            self.data_object = self.read_sheet(self.output_path())
+
+    def sample(self, number_of_entries: int, dependencies: Dict[str, Dict[str, List[Any]]]) -> Dict[str, List[Any]]:
+        """Generates values of rows the way generate does (seeded like its first batch), without writing them,
+        mapped columns are filled from sampled values of dependencies (see SQLDAO.sample)
+        """
+        plan = self.get_row_plan()
+        self.seed_batch(0)
+        values = plan.generate(number_of_entries)
+        self.fill_dependencies(values, {dep: CSVDAO.stream_rows(iter([dependencies[dep]])) for dep in self.dependency if dep in dependencies},
+                               number_of_entries)
+        plan.apply_post_rules(values)
+        return {column: values[column] for column in plan.columns}
+
+    def resume(self, checkpoint: Dict[str, Any]) -> None:
+        """Continues generation of the sheet: rows written after the checkpoint are cut off the file and the rest of them are appended to it
+        """
+        if checkpoint["finished"]:
+            self.generated = True
+            if self.keep:
+                self.data_object = self.read_sheet(self.output_path())
+            METRICS.progress(self.name, "already generated")
+            return
+        with open(self.output_path(), "r+b") as file:
+            file.truncate(checkpoint["file_size"])
+        self.resumed = {key: checkpoint[key] for key in ("start", "end", "batch_size")}
+        METRICS.progress(self.name, "resumed", entry=checkpoint["next_row"] - checkpoint["start"])
+        self.generate(checkpoint["end"] - checkpoint["next_row"], checkpoint["batch_size"], start=checkpoint["next_row"])
 
     def load(self, path: str) -> None:
-        self.data_object = pd.read_csv(path)
+        # Format is recognized by the extension of the file
+        with METRICS.scope(self.name, "load"):
+            if self.keep:
+                self.data_object = self.read_sheet(path)
+                METRICS.count("rows", len(self.data_object))
+            else:
+                # Nothing generated later reads rows of sheets, so they are only counted
+                METRICS.count("rows", count_snapshot_rows(path))
         self.loaded = True
-        print(self.name, " loaded from file")
+        METRICS.progress(self.name, "loaded from file")
     
-    def save(self, path: Optional[str] = None) -> None:
-        # Generation is saved during generate() method
-        pass
-        # filepath = f"{path}/{self.name}_sheet.csv" if path else f"{self.name}_sheet.csv"
-        # self.data_object.to_csv(filepath, index=False)
+    def restore(self) -> None:
+        """Marks sheet of a snapshot as loaded without reading it (nothing generated later depends on rows of sheets)
+        """
+        self.loaded = True
+        METRICS.progress(self.name, "already in the snapshot")
+
+    def save(self, path: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Generation is saved during generate() method, only entry of the sheet in the manifest of the snapshot is returned
+
+        Returns:
+            Optional[Dict[str, Any]]: Entry of the sheet in the manifest, None if the sheet was not generated in this run
+        """
+        filepath = self.output_path()
+        if not self.has_been_generated() or not os.path.exists(filepath):
+            return None
+        rows = count_snapshot_rows(filepath)
+        # Sheet is written while it is generated, so it is always one file
+        return {"parts": describe_parts([(filepath, rows)]), "rows": rows, "delta_rows": rows}
@@ -0,0 +1,209 @@
+from .dao_sql import SQLDAO
+from .key_pool import KeyPool
+from .bulk_loader import BulkLoader
+from .snapshot_io import import_pyarrow, value_converter
+from db_model import return_arrow_type
+from instrumentation import METRICS
+from typing import Optional, List, Any, Dict, Tuple, Iterator, Sequence
+
+import contextlib
+import itertools
+import sqlalchemy
+import numpy as np
+import os
+
+
+class ColumnStore:
+    """Rows of one table kept as Arrow record batches (typed by the schema of the table) instead of in a database
+
+    With a spill folder batches are written into Arrow IPC files as they come and read back memory-mapped,
+    so that tables bigger than memory are paged in by the operating system only when they are read
+    """
+    def __init__(self, table: sqlalchemy.Table, spill_path: Optional[str] = None):
+        """
+        Args:
+            table (sqlalchemy.Table): Table whose rows are stored
+            spill_path (Optional[str], optional): Folder of spilled files. Defaults to None (batches are kept in memory).
+        """
+        pa = import_pyarrow()
+        self.name = table.name
+        self.schema = pa.schema([(column.name, return_arrow_type(column.type)) for column in table.columns])
+        self.converters = [value_converter(field.type) for field in self.schema]
+        self.primary_key = table.primary_key.columns[0].name
+        # Column numbered by the store when rows do not give it, the way a database fills autoincrement (Identity) primary keys
+        self.identity = [table.autoincrement_column.name] if table.autoincrement_column is not None else []
+        self.next_identity = 1
+        self.spill_path = spill_path
+        # Tables read back from spilled files and batches that are kept in memory
+        self.segments = []
+        self.batches = []
+        # Spilled file being written, its path and its writer
+        self.file = None
+        self.file_path = None
+        self.writer = None
+        self.rows = 0
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def append(self, columns: List[str], rows: List[Sequence[Any]]) -> None:
+        """Adds rows (values in the order of columns), columns missing in rows are empty (or numbered if they are autoincrement,
+        as are None values of autoincrement columns)
+        """
+        if not rows:
+            return
+        pa = import_pyarrow()
+        values = dict(zip(columns, zip(*rows)))
+        for column in self.identity:
+            # Values that are not given (or are None) are numbered, like a database fills them
+            given = values.get(column, [None] * len(rows))
+            numbers = itertools.count(max([self.next_identity] + [value + 1 for value in given if value is not None]))
+            values[column] = [next(numbers) if value is None else value for value in given]
+            self.next_identity = next(numbers)
+        arrays = [pa.array([convert(value) for value in values[field.name]] if field.name in values else [None] * len(rows), type=field.type)
+                  for field, convert in zip(self.schema, self.converters)]
+        batch = pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+        self.rows += len(rows)
+        if self.spill_path is None:
+            self.batches.append(batch)
+            return
+        if self.writer is None:
+            os.makedirs(self.spill_path, exist_ok=True)
+            self.file_path = os.path.join(self.spill_path, f"{self.name}.{len(self.segments)}.arrow")
+            self.file = pa.OSFile(self.file_path, "wb")
+            self.writer = pa.ipc.new_file(self.file, self.schema)
+        self.writer.write_batch(batch)
+
+    def finish(self) -> None:
+        """Closes the spilled file being written and maps it into memory (nothing to do for batches kept in memory)
+        """
+        if self.writer is None:
+            return
+        pa = import_pyarrow()
+        self.writer.close()
+        self.file.close()
+        self.writer, self.file = None, None
+        self.segments.append(pa.ipc.open_file(pa.memory_map(self.file_path, "r")).read_all())
+
+    def table(self):
+        """All rows as one pyarrow Table (spilled rows are not copied, they stay memory-mapped)
+        """
+        pa = import_pyarrow()
+        self.finish()
+        tables = self.segments + ([pa.Table.from_batches(self.batches, self.schema)] if self.batches else [])
+        return pa.concat_tables(tables) if tables else self.schema.empty_table()
+
+    def keys(self) -> np.ndarray:
+        """Primary keys of all rows in the order they were added
+        """
+        # Same array as the one built from keys read from a database, so that checksums of keys match
+        return np.asarray(self.table().column(self.primary_key).to_pylist())
+
+    def iter_rows(self, batch_size: int = 10000) -> Iterator[List[Tuple[Any, ...]]]:
+        """Rows in the order they were added, batch_size rows at a time, values in the order of columns of the table
+        """
+        for batch in self.table().to_batches(max_chunksize=batch_size):
+            yield list(zip(*[column.to_pylist() for column in batch.columns]))
+
+    def pages_in_key_order(self, columns: List[str], page_size: int, start: int = 0) -> Iterator[List[Dict[str, Any]]]:
+        """Rows with given columns in the order of the primary key (like pages of a dependency read from a database)
+
+        Args:
+            columns (List[str]): Columns of rows
+            page_size (int): Amount of rows of a page
+            start (int, optional): How many first rows to skip. Defaults to 0.
+
+        Yields:
+            Iterator[List[Dict[str, Any]]]: Pages of rows
+        """
+        import pyarrow.compute as pc
+        table = self.table()
+        order = pc.sort_indices(table, sort_keys=[(self.primary_key, "ascending")])
+        selected = table.select(list(dict.fromkeys(columns)))
+        for offset in range(start, len(order), page_size):
+            yield selected.take(order[offset:offset + page_size]).to_pylist()
+
+
+class MemoryLoader(BulkLoader):
+    """Loader of tables kept in memory: batches are appended to the ColumnStore of the table, connections are not used
+    """
+    def __init__(self, store: ColumnStore, batch_size: Optional[int] = None):
+        super().__init__(batch_size)
+        self.store = store
+
+    def insert(self, connector: Any, table: sqlalchemy.Table, columns: List[str], rows: List[Sequence[Any]]) -> None:
+        self.store.append(columns, rows)
+
+    def commit(self, connector: Any) -> None:
+        # Rows are in the store as soon as they are appended
+        pass
+
+    def finish(self, connector: Any) -> None:
+        self.store.finish()
+
+
+class MemoryDAO(SQLDAO):
+    """Table generated without a database: rows are kept as Arrow column batches (see ColumnStore),
+    foreign keys of children are drawn from key pools of parents and snapshot files are written straight from the batches
+
+    Generation, loading and saving are the ones of SQLDAO, only the database is replaced by the ColumnStore of the table
+    """
+    def __init__(self, name: str, data_object: sqlalchemy.Table, dependency: ...,
+                 /, stores: Optional[Dict[str, ColumnStore]] = None, spill_path: Optional[str] = None,
+                 batch_size: Optional[int] = None, **options):
+        """
+        Args:
+            stores (Optional[Dict[str, ColumnStore]], optional): Stores of all tables of the run {"table_name": ColumnStore},
+            the store of this table is added. Defaults to None (new, empty one).
+            spill_path (Optional[str], optional): Folder that rows are spilled into. Defaults to None (rows are kept in memory).
+            batch_size (Optional[int], optional): Amount of rows added at once. Defaults to None (default of SQLDAO).
+            options: Keyword arguments of SQLDAO (metadata, key_pools, snapshot_format, ...)
+        """
+        self.stores = stores if stores is not None else {}
+        self.stores[name] = ColumnStore(data_object, spill_path)
+        super().__init__(name, data_object, dependency, loader=MemoryLoader(self.stores[name], batch_size), **options)
+
+    @property
+    def store(self) -> ColumnStore:
+        return self.stores[self.name]
+
+    def connect(self) -> contextlib.nullcontext:
+        # There is no connection, the loader writes into the store
+        return contextlib.nullcontext()
+
+    def count_entries(self, connector) -> int:
+        return len(self.store)
+
+    def load_primary_keys(self) -> None:
+        self.prim_keys.update(self.store.keys().tolist())
+
+    def get_key_pool(self, table_name: str, connector) -> KeyPool:
+        """Returns primary keys of a table, taken from its store if the table has no key pool yet
+
+        Raises:
+            ValueError: When the table is not kept in memory
+        """
+        if table_name not in self.key_pools:
+            if table_name not in self.stores:
+                raise ValueError(f"{table_name} is not kept in memory, foreign keys of {self.name} cannot be drawn from it")
+            self.key_pools[table_name] = KeyPool(self.stores[table_name].keys())
+        return self.key_pools[table_name]
+
+    def get_own_key_pool(self, connector) -> Optional[KeyPool]:
+        if not self.is_primary_key_generated():
+            return None
+        if self.name not in self.key_pools:
+            self.key_pools[self.name] = KeyPool(self.store.keys())
+        return self.key_pools[self.name]
+
+    def get_table_keys(self, connector=None) -> np.ndarray:
+        return np.sort(self.store.keys())
+
+    def read_partitions(self, batch_size: int = 10000) -> Iterator[List[Tuple[Any, ...]]]:
+        batches = self.store.iter_rows(batch_size)
+        while True:
+            with METRICS.timer("read"):
+                partition = next(batches, None)
+            if partition is None:
+                return
+            yield partition
@@ -1,161 +1,523 @@
 from .dao import DAO
-from rule_book import BasicRuleBook
-from typing import Optional, List, Any, Dict
+from .key_pool import KeyPool, KeySet
+from .bulk_loader import BulkLoader, create_bulk_loader
+from .snapshot_io import SnapshotPartsWriter, read_snapshot_columns, describe_parts, keys_checksum
+from .row_plan import RowPlan
+from .coercion import column_coercion, stored_form
+from .pipeline import BatchWriter, StreamTee
+from .batch_sizing import RowChunker
+from rule_book import RuleBook
+from instrumentation import METRICS
+from db_model import return_arrow_type
+from key_generators import UniqueKeyGenerator
+from typing import Optional, List, Any, Dict, Tuple, Callable, Iterator, Sequence
 
 from sqlalchemy import create_engine, Table, Column, Integer, String, MetaData
-from sqlalchemy.dialects.mssql import INTEGER
 from sqlalchemy import Identity
 
 import sqlalchemy
-import pandas as pd
-import csv
+import numpy as np
+import os
 import random
 
 class SQLDAO(DAO):
+    default_batch_size = 2000
+
     def __init__(self, name: str, data_object: sqlalchemy.Table, dependency: ..., 
-                 /, engine: Optional[sqlalchemy.Engine] = None, metadata: Optional[sqlalchemy.MetaData] = None):
-        super().__init__(name, data_object, dependency)
+                 /, engine: Optional[sqlalchemy.Engine] = None, metadata: Optional[sqlalchemy.MetaData] = None,
+                 key_pools: Optional[Dict[str, KeyPool]] = None, loader: Optional[BulkLoader] = None,
+                 snapshot_format: Optional[str] = "csv", compression: Optional[str] = "zstd",
+                 rule_book: Optional[RuleBook] = None, seed: Optional[int] = None, pipeline_depth: int = 2,
+                 csv_compression: Optional[str] = None):
+        super().__init__(name, data_object, dependency, rule_book, seed, pipeline_depth)
         self.engine = engine
         self.metadata = metadata
+        # Way of inserting batches, chosen by the dialect of the engine if not provided
+        self.loader = loader if loader is not None or engine is None else create_bulk_loader(engine)
+        # Primary keys of tables shared between DAOs of one run {"table_name": KeyPool}
+        self.key_pools = key_pools if key_pools is not None else {}
+        # Format of the saved insert file (csv, parquet or arrow) and compression of parquet / arrow files
+        self.snapshot_format = snapshot_format
+        self.compression = compression
+        # Compression of csv files (gzip, zstd), None -> plain csv
+        self.csv_compression = csv_compression
+        # Rules computing values of a column from the whole batch {"column": function of {"column": [values]}}
         self.additional_rules_columns = {
-            # If exam type is generated to be 0 (theoretical exam) then we dont need a vehicle so set it to Null 
-            # (can't be None because all such values identicate that it needs to be generated)
-            "Vehicle": lambda content: None if content["Type"] is False else content["Vehicle"]
-        }
-        self.type_changer = {
-            "Gearbox": lambda content: True if content["Gearbox"] == "True" else False,
-            "Result": lambda content: True if content["Result"] == "True" else False,
-            "Type": lambda content: True if content["Type"] == "True" else False,
+            # If exam type is generated to be 0 (theoretical exam) then we dont need a vehicle so set it to Null
+            # (rules generate Type as 0 / 1, values loaded from snapshots are booleans)
+            "Vehicle": lambda values: [None if exam_type is not None and not exam_type else vehicle for exam_type, vehicle in zip(values["Type"], values["Vehicle"])]
         }
         self.additional_rules_tables = {
             # Database hard coded behaviour (like using Identity for primary key)
             "Exam": lambda content: content.pop("Exam_ID")
         }
-        self.prim_keys = set()
+        # Keys loaded from files and keys generated by rules that are not unique by construction
+        self.prim_keys = KeySet()
+        # First counter of unique key rule (amount of rows in the table before generation)
+        self.key_offset = None
+        # First counter of unique key rule not used by this DAO yet
+        self.key_high_water = None
+        # Sheets generated from batches of this table while it is generated, with amounts of their entries [(CSVDAO, int)]
+        self.fused_sheets = []
     
     def get_column_names(self) -> Dict[str, None]:
-        return {col.name: "None" for col in self.data_object.columns}
+        return {col.name: None for col in self.data_object.columns}
+
+    def connect(self) -> sqlalchemy.Connection:
+        """Connection used by generate / load / save (and passed to the loader)
+        """
+        return self.engine.connect()
     
     def is_primary_key_used(self, new_primary) -> bool:
         return new_primary in self.prim_keys
 
-    def generate_entry(self, dependency_contents: Dict[str, Any]) -> Dict[str, Any]:
+    def load_primary_keys(self) -> None:
+        """Adds primary keys already present in the database to used primary keys
+        """
+        primary_key = self.data_object.primary_key.columns[0]
+        with self.connect() as conn:
+            stmt = sqlalchemy.select(primary_key)
+            for (key, ) in conn.execution_options(stream_results=True, yield_per=10000).execute(stmt):
+                self.prim_keys.add(key)
+
+    def count_entries(self, connector) -> int:
+        return connector.execute(sqlalchemy.select(sqlalchemy.func.count()).select_from(self.data_object)).scalar()
+
+    def get_unique_key_rule(self) -> Optional[UniqueKeyGenerator]:
+        """Returns generator of primary keys that are unique by construction, None if there is no such rule for the primary key
+        """
+        if not self.is_primary_key_generated():
+            return None
+        return self.rule_book.resolve_unique_rule(self.data_object.primary_key.columns[0].name)
+
+    def generate_unique_keys(self, unique_rule: UniqueKeyGenerator, rows: np.ndarray) -> List[Any]:
+        """Generates primary keys of given rows (counted from the first row generated in this run), one counter per row
+
+        Args:
+            unique_rule (UniqueKeyGenerator): Generator of keys of the primary key column
+            rows (np.ndarray): Indexes of rows
+
+        Raises:
+            ValueError: When a key of a row and its replacement are both already used
+
+        Returns:
+            List[Any]: Unique primary keys
+        """
+        counters = self.key_offset + rows
+        keys = unique_rule.generate(counters)
+        # Keys loaded from files (generated by other rules) can still collide with generated ones,
+        # such keys are replaced by counters mirrored from the end of the key space (still one per row)
+        used = self.prim_keys.contains(keys)
+        if used.any():
+            replacements = unique_rule.generate(unique_rule.size - 1 - counters[used])
+            if self.prim_keys.contains(replacements).any():
+                raise ValueError(f"Primary keys of {self.name} collide with keys loaded from files")
+            for idx, key in zip(np.flatnonzero(used), replacements):
+                keys[idx] = key
+        return keys
+
+    def generate_entry(self, dependency_contents: Dict[str, Any], generated_values: Optional[Dict[str, Any]] = None,
+                       unique_key: Optional[bool] = False) -> Dict[str, Any]:
+        """Generates one entry (generate builds whole batches with the row plan instead)
+
+        Args:
+            dependency_contents (Dict[str, Any]): Key pools of dependencies
+            generated_values (Optional[Dict[str, Any]], optional): Values of columns generated beforehand. Defaults to None.
+            unique_key (Optional[bool], optional): Primary key is unique by construction. Defaults to False.
+
+        Returns:
+            Dict[str, Any]: Column name and its value
+        """
+        plan = self.get_row_plan()
+        values = {column: [value] for column, value in generated_values.items()} if generated_values else plan.generate(1)
+        for dep in self.dependency:
+            if dep not in values:
+                values[dep] = dependency_contents[dep].sample(1, self.rule_book.rng)
+        if not unique_key:
+            self.ensure_unique_keys(values)
+        return dict(zip(plan.columns, plan.rows(values)[0]))
+
+    def compile_row_plan(self) -> RowPlan:
+        """Columns of the table (without columns removed by table rules), foreign keys are slots of dependencies
+        """
         entry = self.get_column_names()
         if self.data_object.name in self.additional_rules_tables.keys():
             self.additional_rules_tables[self.data_object.name](entry)
-        for column in entry.keys():
-            # Check for any additional rules
-            if column in self.additional_rules_columns.keys():
-                entry[column] = self.additional_rules_columns[column](entry)
-            # Check if column has been already filled
-            if entry[column] == "None":
-                # If column is not a foreign key
-                if column not in self.dependency:
-                    # Generate random value
-                    entry[column] = BasicRuleBook.generate_column_value(column)
-                else:
-                    # Take random value from database
-                    entry[column] = next(dependency_contents[column]["data"], [None])[0]
-                    dependency_contents[column]["remaining"] -= 1
-        primary_key = self.data_object.primary_key.columns[0]
-        # TODO zrobic inaczej
-        if (primary_key.name != "Exam_ID"):
+        columns = list(entry.keys())
+        generated = self.get_generated_columns()
+        if self.get_unique_key_rule() is not None:
+            # Unique keys are generated from counters of rows
+            generated.remove(self.data_object.primary_key.columns[0].name)
+        return RowPlan(columns, generated, self.rule_book.compile_batch(generated), {dep: [(dep, None)] for dep in self.dependency},
+                       {column: rule for column, rule in self.additional_rules_columns.items() if column in columns},
+                       self.get_coercions())
+
+    def get_coercions(self) -> Dict[str, Callable[[List[Any]], List[Any]]]:
+        """Converters of columns read from csv snapshots, derived from sqlalchemy types of the table (see coercion.column_coercion)
+        """
+        temporal_to_text = self.loader.temporal_to_text if self.loader is not None else None
+        coercions = {column.name: column_coercion(column.type, column.nullable, temporal_to_text) for column in self.data_object.columns}
+        return {column: coerce for column, coerce in coercions.items() if coerce is not None}
+
+    def ensure_unique_keys(self, values: Dict[str, List[Any]]) -> None:
+        """Regenerates primary keys (generated by rules that are not unique by construction) that are already used,
+        row by row, and marks them as used
+
+        Args:
+            values (Dict[str, List[Any]]): Values of the batch, keys are replaced in place
+        """
+        primary_key = self.data_object.primary_key.columns[0].name
+        if primary_key not in self.get_row_plan().generated:
+            return
+        keys = values[primary_key]
+        for idx, key in enumerate(keys):
             # Check if primary key is unique
-            while (self.is_primary_key_used(entry[primary_key.name])):
+            while self.is_primary_key_used(key):
                 # If it is not unique, generate new one
-                entry[primary_key.name] = BasicRuleBook.generate_column_value(primary_key.name)
+                key = self.rule_book.generate_column_value(primary_key)
+            keys[idx] = key
             # Add primary key to the set of already generated primary keys
-            self.prim_keys.add(entry[primary_key.name])
-        return entry
-
-    def refill_query(self, table_name: str, connector, pull_size) -> Dict[str, Any]:
-        # Reflect dependency table
-        table = sqlalchemy.Table(table_name, self.metadata, autoload_with=self.engine)
-        # Check amount of rows
-        max_index = sqlalchemy.select(sqlalchemy.func.count()).select_from(table)
-        max_index = connector.execute(max_index).scalar()
-        # Set pulling size to be either the wanted size or the amount of rows in the table
-        pulling_size = pull_size if max_index > pull_size else max_index
-        # Get all primary keys from the table
-        table_primary_key = [col.name for col in table.primary_key.columns]
-        # Assign random order to each row in pulled data, and pull only primary keys
-        stmt = table.select().order_by(sqlalchemy.func.newid()).limit(pulling_size).with_only_columns(*[table.c[key] for key in table_primary_key])
-        # Fetch all rows, place them in the memory and return the iterator of it
-        ret = connector.execute(stmt).fetchall()
-        return {
-            "data": iter(ret),
-            "remaining": pulling_size
-        }
+            self.prim_keys.add(key)
+
+    def get_key_pool(self, table_name: str, connector) -> KeyPool:
+        """Returns primary keys of a table, streaming them from the database only if the table
+        has not been generated nor loaded by its DAO in this run
+
+        Args:
+            table_name (str): Name of the table
+            connector: Connection to the database
 
-    def generate(self, number_of_entries, batch_size: int = 2000):
+        Returns:
+            KeyPool: Primary keys of the table
+        """
+        if table_name not in self.key_pools:
+            # Reflect dependency table
+            table = sqlalchemy.Table(table_name, self.metadata, autoload_with=self.engine)
+            self.key_pools[table_name] = KeyPool.from_table(connector, table)
+        return self.key_pools[table_name]
+
+    def is_primary_key_generated(self) -> bool:
+        """Checks if primary key is generated by RuleBook (not assigned by the database like Identity)
+        """
+        return self.data_object.primary_key.columns[0].name in self.get_generated_columns()
+
+    def get_own_key_pool(self, connector) -> Optional[KeyPool]:
+        """Returns key pool of this table, that is extended with every inserted batch,
+        None if primary keys are assigned by the database
+
+        Args:
+            connector: Connection to the database
+        """
+        if not self.is_primary_key_generated():
+            return None
+        if self.name not in self.key_pools:
+            # Keys inserted before this run have to be drawable as well
+            self.key_pools[self.name] = KeyPool.from_table(connector, self.data_object)
+        return self.key_pools[self.name]
+
+    def get_generated_columns(self) -> List[str]:
+        """Columns whose values are generated by RuleBook (not pulled from dependencies nor removed by table rules)
+        """
+        entry = self.get_column_names()
+        if self.data_object.name in self.additional_rules_tables.keys():
+            self.additional_rules_tables[self.data_object.name](entry)
+        return [column for column in entry.keys() if column not in self.dependency]
+
+    def get_batch_size(self) -> int:
+        return self.loader.batch_size or self.default_batch_size
+
+    def fuse(self, sheet: DAO, number_of_entries: int) -> None:
+        """Generates the sheet during the next generation of this table, from its batches passed through a stream
+        (instead of rows read back from storage), so that rows of the sheet follow rows of the table as they were generated
+
+        Args:
+            sheet (DAO): Sheet whose only dependency is this table (CSVDAO)
+            number_of_entries (int): Amount of entries of the sheet
+        """
+        self.fused_sheets.append((sheet, number_of_entries))
+
+    def get_fused_columns(self) -> Dict[str, Optional[Callable[[List[Any]], List[Any]]]]:
+        """Columns passed to fused sheets, with conversions of generated values into their stored form
+        """
+        columns = {column for sheet, _ in self.fused_sheets for column in sheet.mapping[self.name].values()}
+        return {column.name: stored_form(column.type) for column in self.data_object.columns if column.name in columns}
+
+    def generate(self, number_of_entries, batch_size: Optional[int] = None, start: int = 0):
+        """Generates entries into the table
+
+        Args:
+            number_of_entries (int): Amount of entries to generate
+            batch_size (Optional[int], optional): Amount of entries inserted at once. Defaults to None (batch size of the loader or 2000).
+            start (int, optional): Index of the first entry among entries generated in this run (e.g. by all shards),
+            it decides about seeds of batches and counters of unique keys. Defaults to 0.
+        """
         self.generated = True
-        batch = []
-        # Dict with rows from database and amount of rows left to pull
-        pulled_dependencies = {}
-        # How many rows at once to pull from database
-        pull_size = 5000
-        with self.engine.connect() as conn:
-            # Go through all dependencies and pull necessary info from db
-            for dep in self.dependency:
-                pulled_dependencies[dep] = self.refill_query(dep, conn, pull_size)
-            for idx in range(number_of_entries):
-                # Check if any dependencies have been depleted
-                for dep in self.dependency:
-                    # If there are no more rows to pull
-                    if pulled_dependencies[dep]["remaining"] == 0:
-                        # Refill the query
-                        pulled_dependencies[dep] = self.refill_query(dep, conn, pull_size)
-                contents = self.generate_entry(pulled_dependencies)
-                batch.append(contents)
-                if len(batch) >= batch_size:
-                    print(self.name, " generated ", idx, " entries")
-                    conn.execute(sqlalchemy.insert(self.data_object), batch)
-                    conn.commit()
-                    batch = []
-            if batch:
-                conn.execute(sqlalchemy.insert(self.data_object), batch)
-                conn.commit()
-
-# TODO Naprawic bo czyta string, a oczekuje innych typow
-    def load(self, path: str, batch_size: int = 5000) -> None:
-        with self.engine.connect() as conn:
-            with open(path, newline="") as bulk:
-                data = csv.DictReader(bulk)
-                batch = []
-                for row in data:
-                    # Apply any necessary rules
-                    for column in row.keys():
-                        if column in self.additional_rules_columns.keys():
-                            row[column] = self.additional_rules_columns[column](row)
-                        if column in self.type_changer.keys():
-                            row[column] = self.type_changer[column](row)
-                    # Add row into batch
-                    self.prim_keys.add(row[self.data_object.primary_key.columns[0].name])
-                    batch.append(row)
-                    if len(batch) >= batch_size:
-                        # Bulk insert
-                        conn.execute(sqlalchemy.insert(self.data_object), batch)
-                        conn.commit()
-                        batch = []
-                if batch:
-                    conn.execute(sqlalchemy.insert(self.data_object), batch)
-                    conn.commit()
-        batch = None
+        batch_size = batch_size or self.get_batch_size()
+        plan = self.get_row_plan()
+        primary_key = self.data_object.primary_key.columns[0].name
+        unique_rule = self.get_unique_key_rule()
+        # Sheets consuming batches of this generation, each one in its own thread
+        fused_columns = self.get_fused_columns()
+        consumers = [lambda batches, sheet=sheet, n=n: sheet.generate(n, streams={self.name: batches}) for sheet, n in self.fused_sheets]
+        self.fused_sheets = []
+        with METRICS.scope(self.name, "generate"), self.connect() as conn:
+            self.loader.prepare(conn)
+            if unique_rule is not None and self.key_offset is None:
+                # Earlier runs used the lowest counters, one per row
+                self.key_offset = self.count_entries(conn)
+            # Rows of the whole generation (kept when it is resumed) and rows the table had before it
+            origin = self.resumed or {"start": start, "end": start + number_of_entries, "batch_size": batch_size,
+                                      "rows_before": self.count_entries(conn) if self.checkpoint_folder is not None else None}
+            self.write_checkpoint(origin, start, key_offset=self.key_offset, key_high_water=self.key_high_water)
+            # Primary keys of all dependencies, foreign keys are drawn from them
+            with METRICS.timer("key_pools"):
+                key_pools = {dep: self.get_key_pool(dep, conn) for dep in self.dependency}
+                own_key_pool = self.get_own_key_pool(conn)
+            # Generated batches are inserted in chunks of tuned size (batches of generation keep their size, it decides about seeds),
+            # every batch is committed on its own, so that the table always ends at a batch (see resume)
+            chunks = RowChunker(lambda rows: self.insert_rows(conn, plan.columns, rows), self.create_batch_sizing(batch_size, "insert", maximum=batch_size))
+            inserted = 0
+            def insert(batch: Tuple[int, List[Tuple[Any, ...]]]) -> None:
+                nonlocal inserted
+                batch_end, rows = batch
+                chunks.put(rows)
+                chunks.flush()
+                with METRICS.timer("commit"):
+                    self.loader.commit(conn)
+                METRICS.batch_done(len(rows), batch_end - start)
+                inserted += 1
+                if self.should_checkpoint(inserted):
+                    with METRICS.timer("checkpoint"):
+                        self.write_checkpoint(origin, batch_end, key_offset=self.key_offset, key_high_water=self.key_high_water)
+            # Batches are inserted while next ones are generated (the connection is used only by the writer meanwhile)
+            with BatchWriter(insert, self.pipeline_depth, f"{self.name}-writer") as writer, \
+                    StreamTee(consumers, self.pipeline_depth, f"{self.name}-tee") as tee:
+                for batch_start, size in DAO.batch_ranges(start, number_of_entries, batch_size):
+                    self.seed_batch(batch_start)
+                    # Generate values of the whole batch column by column
+                    values = plan.generate(size)
+                    if unique_rule is not None:
+                        with METRICS.timer("unique_keys"):
+                            values[primary_key] = self.generate_unique_keys(unique_rule, np.arange(batch_start, batch_start + size))
+                        self.key_high_water = max(self.key_high_water or 0, self.key_offset + batch_start + size)
+                    with METRICS.timer("foreign_keys"):
+                        for dep in plan.dependencies:
+                            values[dep] = key_pools[dep].sample(size, self.rule_book.rng)
+                    with METRICS.timer("entries"):
+                        if unique_rule is None:
+                            self.ensure_unique_keys(values)
+                        batch = plan.rows(values)
+                    writer.put((batch_start + size, batch))
+                    if consumers:
+                        tee.put({column: values[column] if convert is None else convert(values[column]) for column, convert in fused_columns.items()})
+                    if own_key_pool is not None:
+                        own_key_pool.extend(values[primary_key])
+            chunks.flush()
+            with METRICS.timer("commit"):
+                self.loader.finish(conn)
+            self.write_checkpoint(origin, start + number_of_entries, True, key_offset=self.key_offset, key_high_water=self.key_high_water)
+        self.resumed = None
+
+    def sample(self, number_of_entries: int, dependencies: Dict[str, Dict[str, List[Any]]]) -> Dict[str, List[Any]]:
+        """Generates values of rows the way generate does (seeded like its first batch), without storing them
+        (used to measure costs of rules before a run, see generation_spec.estimate_run)
+
+        Args:
+            number_of_entries (int): Amount of rows
+            dependencies (Dict[str, Dict[str, List[Any]]]): Sampled values of dependencies, foreign keys are drawn from them
+
+        Returns:
+            Dict[str, List[Any]]: Values of every column of the table (None for columns assigned by the database)
+        """
+        plan = self.get_row_plan()
+        self.seed_batch(0)
+        values = plan.generate(number_of_entries)
+        if (unique_rule := self.get_unique_key_rule()) is not None:
+            values[self.data_object.primary_key.columns[0].name] = unique_rule.generate(np.arange(number_of_entries))
+        for dep in plan.dependencies:
+            keys = dependencies.get(dep, {}).get(next(iter(self.data_object.c[dep].foreign_keys)).column.name) or [None]
+            values[dep] = [keys[idx] for idx in self.rule_book.rng.integers(0, len(keys), size=number_of_entries)]
+        plan.apply_post_rules(values)
+        return {column.name: values.get(column.name, [None] * number_of_entries) for column in self.data_object.columns}
+
+    def resume(self, checkpoint: Dict[str, Any]) -> None:
+        """Continues generation of the table from its last committed batch. Rows committed after the checkpoint was written
+        are counted in the table, so no row is inserted twice, and the rest are generated exactly as they would have been
+
+        Raises:
+            ValueError: When rows of the table do not end at a batch of the generation (the table was changed since)
+        """
+        self.key_offset = checkpoint["key_offset"]
+        self.key_high_water = checkpoint["key_high_water"]
+        if checkpoint["finished"]:
+            self.generated = True
+            METRICS.progress(self.name, "already generated")
+            return
+        start, end, batch_size = checkpoint["start"], checkpoint["end"], checkpoint["batch_size"]
+        with self.connect() as conn:
+            next_row = start + self.count_entries(conn) - checkpoint["rows_before"]
+        if not checkpoint["next_row"] <= next_row <= end or next_row not in (start, end) and next_row % batch_size:
+            raise ValueError(f"{self.name} holds rows that do not end at a batch of the interrupted generation, it cannot be resumed")
+        # Keys of committed rows are used already
+        self.load_primary_keys()
+        self.resumed = {key: checkpoint[key] for key in ("start", "end", "batch_size", "rows_before")}
+        METRICS.progress(self.name, "resumed", entry=next_row - start)
+        self.generate(end - next_row, batch_size, start=next_row)
+
+    def load(self, path: str, batch_size: Optional[int] = None, skip_existing: bool = False) -> None:
+        """Inserts rows of a snapshot file into the table
+
+        Args:
+            path (str): Path of the file (format is recognized by the extension)
+            batch_size (Optional[int], optional): Amount of rows inserted at once. Defaults to None (batch size of the loader or 5000).
+            skip_existing (bool, optional): Skip rows whose primary key is already in the table (the table holds a part of the file). Defaults to False.
+        """
+        batch_size = batch_size or self.loader.batch_size or 5000
+        primary_key = self.data_object.primary_key.columns[0].name
+        with METRICS.scope(self.name, "load"), self.connect() as conn:
+            self.loader.prepare(conn)
+            with METRICS.timer("key_pools"):
+                own_key_pool = self.get_own_key_pool(conn)
+                if skip_existing:
+                    self.prim_keys.update_array(self.get_table_keys(conn))
+            plan = self.get_row_plan()
+            # Format is recognized by the extension, csv values are strings while parquet / arrow values keep their types
+            batches, loaded, columns = read_snapshot_columns(path, batch_size), 0, None
+            # Rows are inserted in chunks of tuned size (columns are the same in every batch of a file), every chunk is committed
+            # (rows of a load stopped in the middle are skipped by the next one, see skip_existing)
+            chunks = RowChunker(lambda rows: self.insert_rows(conn, columns, rows, commit=True), self.create_batch_sizing(batch_size, "insert"))
+            while True:
+                with METRICS.timer("read"):
+                    values = next(batches, None)
+                if values is None:
+                    break
+                # Strings of csv files are converted column by column into types of the table
+                with METRICS.timer("coerce"):
+                    plan.coerce(values)
+                if skip_existing and (existing := self.prim_keys.contains(values[primary_key])).any():
+                    values = {column: [value for value, used in zip(column_values, existing) if not used] for column, column_values in values.items()}
+                    METRICS.count("skipped_rows", int(existing.sum()))
+                columns = list(values.keys())
+                batch = plan.rows(values, columns)
+                self.prim_keys.update(values[primary_key])
+                # Bulk insert
+                chunks.put(batch)
+                if own_key_pool is not None:
+                    own_key_pool.extend(values[primary_key])
+                loaded += len(batch)
+                METRICS.batch_done(len(batch), loaded)
+            chunks.flush()
+            with METRICS.timer("commit"):
+                self.loader.finish(conn)
         self.loaded = True
-        print(self.name, " loaded from file")
+        METRICS.progress(self.name, "loaded from file")
+
+    def insert_rows(self, connector: sqlalchemy.Connection, columns: List[str], rows: List[Sequence[Any]], commit: bool = False) -> None:
+        with METRICS.timer("insert"):
+            self.loader.insert(connector, self.data_object, columns, rows)
+        if commit:
+            with METRICS.timer("commit"):
+                self.loader.commit(connector)
 
+    def get_table_keys(self, connector: Optional[sqlalchemy.Connection] = None) -> np.ndarray:
+        """Sorted primary keys of all rows of the table (read over connector, or over a new connection if not given)
+        """
+        if connector is not None:
+            return KeyPool.from_table(connector, self.data_object).array()
+        with self.connect() as conn:
+            return KeyPool.from_table(conn, self.data_object).array()
+
+    def read_partitions(self, batch_size: int = 10000) -> Iterator[List[Tuple[Any, ...]]]:
+        """Streams all rows of the table, batch_size rows at a time, values in the order of columns of the table
+        """
+        with self.connect() as conn:
+            stmt = self.data_object.select()
+            with conn.execution_options(stream_results=True, yield_per=batch_size).execute(stmt) as result:
+                while True:
+                    with METRICS.timer("read"):
+                        partition = result.fetchmany(batch_size)
+                    if not partition:
+                        return
+                    yield partition
+
+    def restore(self, keys: np.ndarray, key_high_water: Optional[int] = None) -> None:
+        """Marks snapshot already present in the table as loaded without reading it, primary keys of its rows
+        are taken over as if they were loaded
+
+        Args:
+            keys (np.ndarray): Sorted primary keys of the table
+            key_high_water (Optional[int], optional): First counter of unique key rule that was not used yet. Defaults to None.
+        """
+        self.prim_keys.update_array(keys)
+        if self.is_primary_key_generated():
+            self.key_pools[self.name] = KeyPool(keys)
+        if key_high_water is not None and self.get_unique_key_rule() is not None:
+            self.key_offset = max(self.key_offset or 0, key_high_water)
+        self.loaded = True
+        METRICS.progress(self.name, "already in the database")
 
     # TODO Make 2 separate ones fow <10k rows,  >10k rows
-    def save(self, path: Optional[str] = None) -> None:
+    def save(self, path: Optional[str] = None, batch_size: int = 10000, base_keys: Optional[KeySet] = None,
+             max_part_rows: Optional[int] = None) -> Dict[str, Any]:
+        """Saves rows of the table (only the ones missing in the base snapshot) and all its primary keys
+
+        Rows are streamed batch_size at a time, the file is written while the next batch is fetched
+
+        Args:
+            path (Optional[str], optional): Folder of the snapshot. Defaults to None (working directory).
+            batch_size (int, optional): Amount of rows read at once. Defaults to 10000.
+            base_keys (Optional[KeySet], optional): Primary keys of the snapshot this one is based on,
+            their rows are not saved again. Defaults to None (all rows are saved).
+            max_part_rows (Optional[int], optional): Rows are split into part files of at most this many rows. Defaults to None (one file).
+
+        Returns:
+            Dict[str, Any]: Entry of the table in the manifest of the snapshot
+        """
         # Get header content
-        columns = self.get_column_names()
+        columns = list(self.get_column_names().keys())
+        key_index = columns.index(self.data_object.primary_key.columns[0].name)
+        # Types of typed snapshots are taken from the schema of the table
+        column_types = {} if self.snapshot_format == "csv" else {col.name: return_arrow_type(col.type) for col in self.data_object.columns}
         # Set correct path to save to
-        filepath = f"{path}/{self.name}_insert.csv" if path else f"{self.name}_insert.csv"
-        # Pull all rows from database
-        with self.engine.connect().execution_options(yield_per=True) as conn:
-            stmt = self.data_object.select()
-            with conn.execution_options(stream_results=True, max_row_buffer=100).execute(stmt).mappings() as result:
-                with open(filepath, "w", newline="") as file:
-                    writer = csv.DictWriter(file, fieldnames=columns)
-                    writer.writeheader()
-                    writer.writerows(result)
\ No newline at end of file
+        stem = f"{path}/{self.name}_insert" if path else f"{self.name}_insert"
+        keys, saved = KeyPool(), 0
+
+        def write(partition: List[Any]) -> None:
+            with METRICS.timer("write"):
+                files.write(partition)
+
+        # Pull all rows of the table (from the database, or from memory)
+        with METRICS.scope(self.name, "save"):
+            with SnapshotPartsWriter(stem, columns, self.snapshot_format, column_types, self.compression,
+                                     self.csv_compression, max_part_rows) as files, \
+                    BatchWriter(write, self.pipeline_depth, f"{self.name}-save") as writer:
+                for partition in self.read_partitions(batch_size):
+                    partition_keys = [row[key_index] for row in partition]
+                    keys.extend(partition_keys)
+                    if base_keys is not None and len(base_keys):
+                        # Rows of the base snapshot are already saved there
+                        partition = [row for row, used in zip(partition, base_keys.contains(partition_keys)) if not used]
+                    writer.put(partition)
+                    saved += len(partition)
+                    METRICS.count("saved_rows", len(partition))
+            keys = keys.array()
+            keys_path = f"{path}/{self.name}_keys.npy" if path else f"{self.name}_keys.npy"
+            np.save(keys_path, keys, allow_pickle=False)
+        return {
+            "parts": describe_parts(files.paths),
+            "rows": len(keys),
+            "delta_rows": saved,
+            "keys": os.path.basename(keys_path),
+            "keys_checksum": keys_checksum(keys),
+            "key_high_water": self.get_key_high_water(keys),
+        }
+
+    def get_key_high_water(self, keys: np.ndarray) -> Optional[int]:
+        """First counter of unique key rule not used yet (or the highest integer primary key), None for other keys
+        """
+        if self.get_unique_key_rule() is not None:
+            # Counters of a run start at the amount of rows of the table, so the mark never goes below it
+            return max(self.key_high_water or 0, len(keys))
+        if len(keys) and np.issubdtype(keys.dtype, np.integer):
+            return int(keys[-1])
+        return None
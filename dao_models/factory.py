@@ -0,0 +1,71 @@
+from .dao import DAO
+from .dao_sql import SQLDAO
+from .dao_csv import CSVDAO
+from .dao_memory import MemoryDAO
+from .key_pool import KeyPool
+from .bulk_loader import create_bulk_loader
+
+from db_model import create_table
+from rule_book import RuleBook
+from value_pools import create_value_pools
+from typing import Dict, Any, Optional
+
+import sqlalchemy
+
+
+def create_data_storage(config: Dict[str, Any], engine: Optional[sqlalchemy.Engine], metadata: sqlalchemy.MetaData, snapshot: str,
+                        key_pools: Optional[Dict[str, KeyPool]] = None, batch_size: Optional[int] = None,
+                        snapshot_format: Optional[str] = "csv", compression: Optional[str] = "zstd",
+                        seed: Optional[int] = None, locale: Optional[str] = "pl_PL", pipeline_depth: int = 2,
+                        csv_compression: Optional[str] = None, spill_path: Optional[str] = None, batch_memory_mb: int = 0) -> Dict[str, DAO]:
+    """Creates DAOs for all data structures described in the json configuration
+
+    Args:
+        config (Dict[str, Any]): Content of the json configuration file
+        engine (sqlalchemy.Engine): Engine of the database holding Tables, None keeps Tables in memory (see MemoryDAO)
+        metadata (sqlalchemy.MetaData): Metadata that Tables are created in
+        snapshot (str): Path to the folder that Sheets are generated into
+        key_pools (Optional[Dict[str, KeyPool]], optional): Key pools shared by all Tables. Defaults to None (new, empty ones).
+        batch_size (Optional[int], optional): Amount of rows inserted at once into Tables. Defaults to None (default of SQLDAO).
+        snapshot_format (Optional[str], optional): Format of snapshot files (csv, parquet or arrow). Defaults to "csv".
+        compression (Optional[str], optional): Compression of parquet / arrow snapshot files. Defaults to "zstd".
+        seed (Optional[int], optional): Seed of the run, batches of every DAO are seeded with sub-seeds of it. Defaults to None (not reproducible).
+        locale (Optional[str], optional): Locale of RuleBooks (every DAO gets its own one). Defaults to "pl_PL".
+        pipeline_depth (int, optional): How many batches may wait for the writer thread of a DAO (0 -> no writer thread). Defaults to 2.
+        csv_compression (Optional[str], optional): Compression of csv snapshot files (gzip, zstd). Defaults to None (plain csv).
+        spill_path (Optional[str], optional): Folder that Tables kept in memory are spilled into. Defaults to None (they stay in memory).
+        batch_memory_mb (int, optional): Megabytes rows of one insert / fetch may take, their sizes are tuned while they run. Defaults to 0 (fixed sizes).
+
+    Returns:
+        Dict[str, DAO]: Name of the data structure and its DAO
+    """
+    data_storage = {}
+    key_pools = key_pools if key_pools is not None else {}
+    # Pools of values of expensive rules, shared by RuleBooks of all DAOs
+    pools = create_value_pools(config.get("Pools"), locale)
+    # Rows of Tables kept in memory, Sheets read their dependencies from them
+    stores = {}
+    for table_name, table_config in config["Tables"].items():
+        if engine is None:
+            data_storage[table_name] = MemoryDAO(table_name, create_table(table_name, table_config, metadata=metadata),
+                                                 list(table_config["foreign_key"]), stores=stores, spill_path=spill_path, batch_size=batch_size,
+                                                 metadata=metadata, key_pools=key_pools, snapshot_format=snapshot_format, compression=compression,
+                                                 rule_book=RuleBook(locale, pools), seed=seed, pipeline_depth=pipeline_depth,
+                                                 csv_compression=csv_compression)
+            continue
+        data_storage[table_name] = SQLDAO(table_name, create_table(table_name, table_config, metadata=metadata),
+                                          list(table_config["foreign_key"]), engine=engine, metadata=metadata, key_pools=key_pools,
+                                          loader=create_bulk_loader(engine, batch_size), snapshot_format=snapshot_format, compression=compression,
+                                          rule_book=RuleBook(locale, pools), seed=seed, pipeline_depth=pipeline_depth,
+                                          csv_compression=csv_compression)
+    for sheet_name, sheet_columns in config["Sheets"].items():
+        # Sheets marked with "keep" hold their rows in memory, in "store" pandas (default) or arrow
+        data_storage[sheet_name] = CSVDAO(sheet_name, None,
+                                          list(sheet_columns["foreign_key"]), sheet_columns["foreign_key"], engine=engine, metadata=metadata, snapshot=snapshot,
+                                          keep_object=sheet_columns.get("keep", False), store=sheet_columns.get("store", "pandas"),
+                                          snapshot_format=snapshot_format, compression=compression, rule_book=RuleBook(locale, pools), seed=seed,
+                                          columns=sheet_columns["columns"], pipeline_depth=pipeline_depth,
+                                          csv_compression=csv_compression, stores=stores)
+    for data_access in data_storage.values():
+        data_access.enable_adaptive_batches(batch_memory_mb)
+    return data_storage
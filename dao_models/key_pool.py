@@ -0,0 +1,117 @@
+from typing import Any, List, Sequence, Optional
+
+import numpy as np
+import sqlalchemy
+
+
+class KeyPool:
+    """Primary keys of one table kept in memory as a compact NumPy array,
+    so that foreign keys of child tables can be drawn without querying the database
+
+    Keys are kept sorted, so that drawn keys do not depend on the order in which rows were inserted (or read)
+    """
+    def __init__(self, keys: Optional[Sequence[Any]] = None):
+        # Keys are appended in chunks and concatenated only when sampled
+        self.chunks = []
+        self.keys = np.array([])
+        if keys is not None:
+            self.extend(keys)
+
+    @classmethod
+    def from_table(cls, connector: sqlalchemy.Connection, table: sqlalchemy.Table, chunk_size: int = 100000) -> "KeyPool":
+        """Streams primary keys of a table once (used for tables that were not generated nor loaded in this run)
+
+        Args:
+            connector (sqlalchemy.Connection): Connection to the database
+            table (sqlalchemy.Table): Table to read primary keys from
+            chunk_size (int, optional): How many keys are fetched at once. Defaults to 100000.
+
+        Returns:
+            KeyPool: Pool with all primary keys of the table
+        """
+        pool = cls()
+        stmt = sqlalchemy.select(table.primary_key.columns[0])
+        result = connector.execution_options(stream_results=True, yield_per=chunk_size).execute(stmt)
+        for partition in result.scalars().partitions(chunk_size):
+            pool.extend(partition)
+        return pool
+
+    def extend(self, keys: Sequence[Any]) -> None:
+        if len(keys):
+            self.chunks.append(np.asarray(keys))
+
+    def __len__(self) -> int:
+        return len(self.keys) + sum(len(chunk) for chunk in self.chunks)
+
+    def array(self) -> np.ndarray:
+        if self.chunks:
+            self.keys = np.sort(np.concatenate([self.keys, *self.chunks]) if len(self.keys) else np.concatenate(self.chunks))
+            self.chunks = []
+        return self.keys
+
+    def sample(self, n: int, rng: np.random.Generator) -> List[Any]:
+        """Draws n keys (with replacement) by random index
+
+        Args:
+            n (int): Amount of keys to draw
+            rng (np.random.Generator): Random generator used to draw indexes
+
+        Returns:
+            List[Any]: Drawn keys, or None values if the pool is empty
+        """
+        keys = self.array()
+        if not len(keys):
+            return [None] * n
+        return keys[rng.integers(0, len(keys), size=n)].tolist()
+
+
+class KeySet:
+    """Exact membership of keys with bounded memory: keys are kept in a sorted NumPy array
+    and new keys are buffered in a small set until they are merged into it
+    """
+    def __init__(self, merge_size: int = 100000):
+        self.keys = np.array([])
+        self.pending = set()
+        self.merge_size = merge_size
+
+    def merge(self) -> None:
+        if not self.pending:
+            return
+        pending = np.array(list(self.pending))
+        self.keys = np.union1d(self.keys, pending) if len(self.keys) else np.unique(pending)
+        self.pending = set()
+
+    def add(self, key: Any) -> None:
+        self.pending.add(key)
+        if len(self.pending) >= self.merge_size:
+            self.merge()
+
+    def update(self, keys: Sequence[Any]) -> None:
+        self.pending.update(keys)
+        if len(self.pending) >= self.merge_size:
+            self.merge()
+
+    def update_array(self, keys: np.ndarray) -> None:
+        """Adds many keys at once (e.g. read from a key pool file), straight into the sorted array
+        """
+        if len(keys):
+            self.keys = np.union1d(self.keys, keys) if len(self.keys) else np.unique(keys)
+
+    def contains(self, keys: Sequence[Any]) -> np.ndarray:
+        """Vectorized membership check
+
+        Returns:
+            np.ndarray: True for every key that is in the set
+        """
+        found = np.array([key in self.pending for key in keys], dtype=bool)
+        if len(self.keys) and len(keys):
+            keys = np.asarray(keys)
+            idx = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+            found |= self.keys[idx] == keys
+        return found
+
+    def __contains__(self, key: Any) -> bool:
+        return bool(self.contains([key])[0])
+
+    def __len__(self) -> int:
+        return len(self.keys) + len(self.pending)
@@ -0,0 +1,199 @@
+from typing import Any, Callable, Iterator, List, Optional
+
+import queue
+import threading
+
+from instrumentation import METRICS
+
+# Marks the end of items passed between stages
+_DONE = object()
+
+
+class BatchWriter:
+    """Consumes batches (inserts into the database, writes into files) in its own thread,
+    so that the next batch is generated while the previous one is being written
+
+    Queue between the producer and the writer is bounded, the producer waits once depth batches are waiting to be written (backpressure).
+    With depth 0 batches are written in the thread of the producer, one after another
+
+    Usage:
+        with BatchWriter(write, depth) as writer:
+            for batch in batches:
+                writer.put(batch)
+
+    Raises:
+        BaseException: Exception raised by write is raised again in the producer (by put or at the end of the block)
+    """
+    def __init__(self, write: Callable[[Any], None], depth: int = 2, name: str = "writer"):
+        self.write = write
+        self.depth = depth
+        self.name = name
+        self.queue = queue.Queue(maxsize=depth) if depth > 0 else None
+        self.thread = None
+        self.error = None
+        # Set when the producer failed, batches still in the queue are dropped
+        self.cancelled = False
+
+    def __enter__(self) -> "BatchWriter":
+        if self.queue is not None:
+            # Measurements of the writer belong to the data storage of the producer
+            self.thread = threading.Thread(target=self.run, args=(METRICS.current_scope(), ), name=self.name, daemon=True)
+            self.thread.start()
+        return self
+
+    def run(self, scope: str) -> None:
+        with METRICS.bind(scope):
+            # Queue is drained even after a failure, so that the producer never waits for a dead writer
+            while (batch := self.queue.get()) is not _DONE:
+                if self.error is None and not self.cancelled:
+                    try:
+                        self.write(batch)
+                    except BaseException as error:
+                        self.error = error
+
+    def put(self, batch: Any) -> None:
+        if self.queue is None:
+            self.write(batch)
+            return
+        if self.error is not None:
+            raise self.error
+        # Time the producer waits for a free slot in the queue
+        with METRICS.timer("backpressure"):
+            self.queue.put(batch)
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        if self.thread is None:
+            return
+        self.cancelled = exc_type is not None
+        self.queue.put(_DONE)
+        self.thread.join()
+        if self.error is not None and exc_type is None:
+            raise self.error
+
+
+def prefetch(make_iterator: Callable[[], Iterator[Any]], depth: int = 2, name: str = "prefetch") -> Iterator[Any]:
+    """Reads items of an iterator (e.g. rows of a dependency) in its own thread, at most depth items ahead of the consumer
+
+    Args:
+        make_iterator (Callable[[], Iterator[Any]]): Creates the iterator, called in the reading thread (so that it can open its own connection)
+        depth (int, optional): How many items are read ahead. Defaults to 2 (0 reads items in the thread of the consumer).
+        name (str, optional): Name of the reading thread. Defaults to "prefetch".
+
+    Yields:
+        Iterator[Any]: Items of the iterator in order
+    """
+    if depth <= 0:
+        yield from make_iterator()
+        return
+    items = queue.Queue(maxsize=depth)
+    stopped = threading.Event()
+    error: Optional[BaseException] = None
+
+    def read(scope: str) -> None:
+        nonlocal error
+        with METRICS.bind(scope):
+            try:
+                for item in make_iterator():
+                    # Consumer may stop before the iterator ends (e.g. a sheet needs fewer rows than a table has)
+                    while not stopped.is_set():
+                        try:
+                            items.put(item, timeout=0.1)
+                            break
+                        except queue.Full:
+                            pass
+                    if stopped.is_set():
+                        return
+            except BaseException as exception:
+                error = exception
+            finally:
+                while not stopped.is_set():
+                    try:
+                        items.put(_DONE, timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+
+    thread = threading.Thread(target=read, args=(METRICS.current_scope(), ), name=name, daemon=True)
+    thread.start()
+    try:
+        while (item := items.get()) is not _DONE:
+            yield item
+        if error is not None:
+            raise error
+    finally:
+        stopped.set()
+        thread.join()
+
+
+class StreamTee:
+    """Passes every batch of a producer to consumers running in their own threads (e.g. sheets built from rows of a table
+    while the table is generated), every consumer reads the batches as an iterator
+
+    Queues between the producer and consumers are bounded, the producer waits for the slowest consumer (backpressure).
+    A consumer may stop reading before the stream ends, batches are not passed to it anymore
+
+    Usage:
+        with StreamTee([consume, ...], depth) as tee:
+            for batch in batches:
+                tee.put(batch)
+
+    Raises:
+        BaseException: Exception raised by a consumer is raised again in the producer (by put or at the end of the block)
+    """
+    def __init__(self, consumers: List[Callable[[Iterator[Any]], None]], depth: int = 2, name: str = "tee"):
+        self.consumers = consumers
+        self.name = name
+        # Consumers always run in their own threads, so that they can iterate over the stream
+        self.queues = [queue.Queue(maxsize=max(depth, 1)) for _ in consumers]
+        self.finished = [threading.Event() for _ in consumers]
+        self.threads = []
+        self.error = None
+        # Set when the producer failed, consumers see the stream ending with an error
+        self.cancelled = False
+
+    def __enter__(self) -> "StreamTee":
+        for idx, consume in enumerate(self.consumers):
+            thread = threading.Thread(target=self.run, args=(idx, consume), name=f"{self.name}-{idx}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def stream(self, idx: int) -> Iterator[Any]:
+        while (batch := self.queues[idx].get()) is not _DONE:
+            yield batch
+        if self.cancelled:
+            raise RuntimeError(f"Stream {self.name} ended early, its producer failed")
+
+    def run(self, idx: int, consume: Callable[[Iterator[Any]], None]) -> None:
+        try:
+            consume(self.stream(idx))
+        except BaseException as error:
+            if self.error is None:
+                self.error = error
+        finally:
+            self.finished[idx].set()
+
+    def offer(self, idx: int, item: Any) -> None:
+        # Consumer that has finished does not take items anymore
+        while not self.finished[idx].is_set():
+            try:
+                self.queues[idx].put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def put(self, batch: Any) -> None:
+        if self.error is not None:
+            raise self.error
+        with METRICS.timer("backpressure"):
+            for idx in range(len(self.consumers)):
+                self.offer(idx, batch)
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        self.cancelled = exc_type is not None
+        for idx in range(len(self.consumers)):
+            self.offer(idx, _DONE)
+        for thread in self.threads:
+            thread.join()
+        if self.error is not None and exc_type is None:
+            raise self.error
@@ -0,0 +1,70 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+class RowPlan:
+    """Everything needed to build rows of one data storage, compiled once from its schema (and RuleBook)
+
+    Rows are built column by column for a whole batch, as {"column": [values]}, and emitted as tuples
+    in the order of columns, so that nothing is looked up (or allocated) per value of a row
+    """
+    def __init__(self, columns: List[str], generated: List[str], generate: Callable[[int], Dict[str, List[Any]]],
+                 dependencies: Optional[Dict[str, List[Tuple[str, Optional[str]]]]] = None,
+                 post_rules: Optional[Dict[str, Callable[[Dict[str, List[Any]]], List[Any]]]] = None,
+                 coercions: Optional[Dict[str, Callable[[List[Any]], List[Any]]]] = None,
+                 fallbacks: Optional[Dict[str, Callable[[], Any]]] = None):
+        """
+        Args:
+            columns (List[str]): Columns of emitted rows, in order
+            generated (List[str]): Columns generated by RuleBook
+            generate (Callable[[int], Dict[str, List[Any]]]): Rules of generated columns, resolved by RuleBook.compile_batch
+            dependencies (Optional[Dict[str, List[Tuple[str, Optional[str]]]]], optional): Slots filled from every dependency,
+            as (column, column of the dependency), None if the column holds primary key of the dependency. Defaults to None.
+            post_rules (Optional[Dict[str, Callable[[Dict[str, List[Any]]], List[Any]]]], optional): Rules computing values of a column
+            from the whole batch, applied once the batch is filled. Defaults to None.
+            coercions (Optional[Dict[str, Callable[[List[Any]], List[Any]]]], optional): Converters of whole columns read as strings (from csv). Defaults to None.
+            fallbacks (Optional[Dict[str, Callable[[], Any]]], optional): Single value rules of columns filled from dependencies,
+            used for values the dependency did not give. Defaults to None.
+        """
+        self.columns = columns
+        self.generated = generated
+        self.generate = generate
+        self.dependencies = dependencies or {}
+        self.post_rules = post_rules or {}
+        self.coercions = coercions or {}
+        self.fallbacks = fallbacks or {}
+
+    def fill_fallbacks(self, values: Dict[str, List[Any]]) -> None:
+        """Replaces missing values (None) of columns filled from dependencies by values of their single value rules,
+        values like 0 / False are kept
+
+        Values are generated row by row and, within a row, in the order of columns
+        """
+        columns = [(position, column) for position, column in enumerate(self.columns) if column in self.fallbacks]
+        empty = sorted((idx, position, column) for position, column in columns for idx, value in enumerate(values[column]) if value is None)
+        for idx, _, column in empty:
+            values[column][idx] = self.fallbacks[column]()
+
+    def coerce(self, values: Dict[str, List[Any]]) -> None:
+        """Converts columns read as strings into types of their columns, a whole column at once (columns that already have a type are kept)
+        """
+        for column, coerce in self.coercions.items():
+            if column in values:
+                values[column] = coerce(values[column])
+
+    def apply_post_rules(self, values: Dict[str, List[Any]]) -> None:
+        for column, rule in self.post_rules.items():
+            if column in values:
+                values[column] = rule(values)
+
+    def rows(self, values: Dict[str, List[Any]], columns: Optional[List[str]] = None) -> List[Tuple[Any, ...]]:
+        """Applies post rules and turns the batch into rows
+
+        Args:
+            values (Dict[str, List[Any]]): Values of every column
+            columns (Optional[List[str]], optional): Columns of rows in order. Defaults to None (columns of the plan).
+
+        Returns:
+            List[Tuple[Any, ...]]: Rows, values in the order of columns
+        """
+        self.apply_post_rules(values)
+        return list(zip(*[values[column] for column in (columns or self.columns)]))
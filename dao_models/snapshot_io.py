@@ -0,0 +1,539 @@
+from datetime import date, datetime, time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from itertools import islice
+
+import csv
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+
+# Supported formats of snapshot files and their extensions
+SNAPSHOT_FORMATS = {
+    "csv": ".csv",
+    "parquet": ".parquet",
+    "arrow": ".arrow",
+}
+
+# Compressions of csv snapshot files and their extensions (added after .csv), zstd requires pyarrow
+CSV_COMPRESSIONS = {
+    "gzip": ".gz",
+    "zstd": ".zst",
+}
+
+# File describing a complete snapshot folder, written after all of its files
+MANIFEST_FILENAME = "manifest.json"
+# Version 2 lists files of every data storage as parts, version 1 (one file per data storage) is still read
+MANIFEST_VERSION = 2
+
+# Folder (inside the snapshot folder) with checkpoints of a run that has not finished yet, removed once the manifest is written
+CHECKPOINTS_FOLDER = "checkpoints"
+# Checkpoint of the whole run (seed, amounts to generate), the other checkpoints are named after data storages
+RUN_CHECKPOINT = "_run"
+
+
+def snapshot_path(path: str, snapshot_format: str, csv_compression: Optional[str] = None) -> str:
+    """Adds extension of the format (and of the compression of csv files) to the path of a snapshot file (given without extension)
+    """
+    if snapshot_format not in SNAPSHOT_FORMATS:
+        raise ValueError(f"Snapshot format {snapshot_format} not supported, choose one of {list(SNAPSHOT_FORMATS)}")
+    if snapshot_format != "csv" or csv_compression in (None, "none"):
+        return path + SNAPSHOT_FORMATS[snapshot_format]
+    if csv_compression not in CSV_COMPRESSIONS:
+        raise ValueError(f"Compression {csv_compression} of csv files not supported, choose one of {list(CSV_COMPRESSIONS)}")
+    return path + SNAPSHOT_FORMATS[snapshot_format] + CSV_COMPRESSIONS[csv_compression]
+
+
+def csv_compression_of(path: str) -> Optional[str]:
+    """Recognizes the compression of a csv snapshot file by its extension (None if not compressed)
+    """
+    extension = os.path.splitext(path)[1]
+    return next((compression for compression, ext in CSV_COMPRESSIONS.items() if ext == extension), None)
+
+
+def snapshot_format_of(path: str) -> str:
+    """Recognizes the format of a snapshot file by its extension (csv if unknown)
+    """
+    if csv_compression_of(path) is not None:
+        return "csv"
+    extension = os.path.splitext(path)[1]
+    return next((snapshot_format for snapshot_format, ext in SNAPSHOT_FORMATS.items() if ext == extension), "csv")
+
+
+def open_csv(path: str, mode: str = "r") -> io.TextIOBase:
+    """Opens a csv snapshot file as text, compressed files are compressed / decompressed on the fly
+
+    Args:
+        path (str): Path of the file, compression is recognized by its extension
+        mode (str, optional): "r" or "w". Defaults to "r".
+    """
+    compression = csv_compression_of(path)
+    if compression is None:
+        return open(path, mode, newline="")
+    if compression == "gzip":
+        # Default level of zlib, level 9 of gzip is several times slower for a few percent smaller files
+        return gzip.open(path, mode + "t", compresslevel=6, encoding="utf-8", newline="")
+    pa = import_pyarrow()
+    stream = pa.CompressedOutputStream(path, compression) if mode == "w" else pa.CompressedInputStream(pa.OSFile(path), compression)
+    return io.TextIOWrapper(stream, encoding="utf-8", newline="")
+
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+        import pyarrow.ipc
+    except ImportError as error:
+        raise ImportError("Parquet and arrow snapshots require pyarrow, install it with: pip install pyarrow") from error
+    return pyarrow
+
+
+def value_converter(arrow_type) -> Callable[[Any], Any]:
+    """Returns function converting values (usually strings generated by RuleBook or read from csv) into python type matching arrow type
+    """
+    pa = import_pyarrow()
+    if pa.types.is_boolean(arrow_type):
+        parse = lambda value: value in ("True", "true", "1") if isinstance(value, str) else bool(value)
+    elif pa.types.is_integer(arrow_type):
+        parse = int
+    elif pa.types.is_floating(arrow_type):
+        parse = float
+    elif pa.types.is_date(arrow_type):
+        parse = date.fromisoformat
+    elif pa.types.is_time(arrow_type):
+        parse = time.fromisoformat
+    elif pa.types.is_timestamp(arrow_type):
+        parse = datetime.fromisoformat
+    else:
+        return lambda value: None if value is None else str(value)
+    is_boolean = pa.types.is_boolean(arrow_type)
+    def convert(value: Any) -> Any:
+        if value is None or value == "":
+            return None
+        # Values that already have a python type are passed as they are (apart from 0 / 1 for booleans)
+        if isinstance(value, str) or is_boolean:
+            return parse(value)
+        return value
+    return convert
+
+
+class SnapshotWriter:
+    """Writes rows of one data storage into a snapshot file in chosen format
+
+    csv files are written row by row, parquet files get one row group per row_group_size rows
+    and arrow (IPC) files one record batch per row_group_size rows
+
+    Rows are sequences (e.g. tuples) of values in the order of columns
+    """
+    def __init__(self, path: str, columns: List[str], snapshot_format: Optional[str] = "csv",
+                 column_types: Optional[Dict[str, Any]] = None, compression: Optional[str] = "zstd",
+                 row_group_size: Optional[int] = 100000, append: bool = False):
+        """
+        Args:
+            path (str): Path of the file (with extension)
+            columns (List[str]): Names of columns in order
+            snapshot_format (Optional[str], optional): One of SNAPSHOT_FORMATS. Defaults to "csv".
+            column_types (Optional[Dict[str, Any]], optional): Arrow type of every column (string if missing). Defaults to None.
+            compression (Optional[str], optional): Compression of parquet / arrow files. Defaults to "zstd".
+            row_group_size (Optional[int], optional): Rows buffered before a row group is written. Defaults to 100000.
+            append (bool, optional): Rows are added to an existing plain csv file, its header is kept (see resumable). Defaults to False.
+        """
+        self.path = path
+        self.columns = columns
+        self.format = snapshot_format
+        self.column_types = column_types or {}
+        # "none" (as given in the command line) means no compression
+        self.compression = None if compression in (None, "none") else compression
+        self.row_group_size = row_group_size
+        if append and not self.resumable:
+            raise ValueError(f"Rows can be appended only to plain csv files, not to {path}")
+        self.append = append
+        # Values of buffered rows, column by column
+        self.buffer = [[] for _ in columns]
+        self.buffered = 0
+        self.file = None
+        self.writer = None
+
+    def __enter__(self) -> "SnapshotWriter":
+        if self.format == "csv":
+            self.file = open_csv(self.path, "a" if self.append else "w")
+            self.writer = csv.writer(self.file)
+            if not self.append:
+                self.writer.writerow(self.columns)
+            return self
+        pa = import_pyarrow()
+        self.schema = pa.schema([(column, self.column_types.get(column, pa.string())) for column in self.columns])
+        self.converters = [value_converter(field.type) for field in self.schema]
+        if self.format == "parquet":
+            self.writer = pa.parquet.ParquetWriter(self.path, self.schema, compression=self.compression)
+        elif self.format == "arrow":
+            self.file = pa.OSFile(self.path, "wb")
+            self.writer = pa.ipc.new_file(self.file, self.schema, options=pa.ipc.IpcWriteOptions(compression=self.compression))
+        else:
+            raise ValueError(f"Snapshot format {self.format} not supported, choose one of {list(SNAPSHOT_FORMATS)}")
+        return self
+
+    @property
+    def resumable(self) -> bool:
+        """Whether writing of the file can be continued after a crash (only plain csv files end with complete rows that can be appended to)
+        """
+        return self.format == "csv" and csv_compression_of(self.path) is None
+
+    def sync(self) -> int:
+        """Flushes rows written so far to disk (only for resumable files)
+
+        Returns:
+            int: Size of the file, rows written later are cut off when writing is resumed
+        """
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return os.path.getsize(self.path)
+
+    def write(self, rows: List[Sequence[Any]]) -> None:
+        if self.format == "csv":
+            self.writer.writerows(rows)
+            return
+        if not rows:
+            return
+        for column_values, values in zip(self.buffer, zip(*rows)):
+            column_values.extend(values)
+        self.buffered += len(rows)
+        if self.buffered >= self.row_group_size:
+            self.flush()
+
+    def write_columns(self, values: Dict[str, List[Any]]) -> None:
+        """Writes a batch given column by column ({"column": [values]})
+        """
+        if self.format == "csv":
+            self.writer.writerows(zip(*[values[column] for column in self.columns]))
+            return
+        for column_values, column in zip(self.buffer, self.columns):
+            column_values.extend(values[column])
+        self.buffered = len(self.buffer[0]) if self.buffer else 0
+        if self.buffered >= self.row_group_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.buffered:
+            return
+        pa = import_pyarrow()
+        arrays = []
+        for field, convert, column_values in zip(self.schema, self.converters, self.buffer):
+            arrays.append(pa.array([convert(value) for value in column_values], type=field.type))
+        batch = pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+        if self.format == "parquet":
+            self.writer.write_batch(batch, row_group_size=self.row_group_size)
+        else:
+            self.writer.write_batch(batch)
+        self.buffer = [[] for _ in self.columns]
+        self.buffered = 0
+
+    def __exit__(self, *args) -> None:
+        if self.format != "csv":
+            self.flush()
+            self.writer.close()
+        if self.file is not None:
+            self.file.close()
+
+
+class SnapshotPartsWriter:
+    """Writes rows of one data storage into part files of at most max_part_rows rows
+    ({stem}.part0001.csv, {stem}.part0002.csv, ...), or into a single file {stem}.csv if max_part_rows is not given
+
+    Usage:
+        with SnapshotPartsWriter(stem, columns, ...) as writer:
+            writer.write(rows)
+        writer.paths -> [(path, rows), ...]
+    """
+    def __init__(self, stem: str, columns: List[str], snapshot_format: Optional[str] = "csv",
+                 column_types: Optional[Dict[str, Any]] = None, compression: Optional[str] = "zstd",
+                 csv_compression: Optional[str] = None, max_part_rows: Optional[int] = None):
+        """
+        Args:
+            stem (str): Path of the file without extension
+            columns (List[str]): Names of columns in order
+            snapshot_format (Optional[str], optional): One of SNAPSHOT_FORMATS. Defaults to "csv".
+            column_types (Optional[Dict[str, Any]], optional): Arrow type of every column (string if missing). Defaults to None.
+            compression (Optional[str], optional): Compression of parquet / arrow files. Defaults to "zstd".
+            csv_compression (Optional[str], optional): One of CSV_COMPRESSIONS. Defaults to None (plain csv).
+            max_part_rows (Optional[int], optional): Rows of one part file. Defaults to None (one file).
+        """
+        if max_part_rows is not None and max_part_rows <= 0:
+            raise ValueError(f"Maximum amount of rows of a part has to be positive, got {max_part_rows}")
+        self.stem = stem
+        self.writer_options = (columns, snapshot_format, column_types, compression)
+        self.snapshot_format = snapshot_format
+        self.csv_compression = csv_compression
+        self.max_part_rows = max_part_rows
+        # Written files and amounts of their rows
+        self.paths = []
+        self.writer = None
+
+    def open_part(self) -> None:
+        self.close_part()
+        stem = self.stem if self.max_part_rows is None else f"{self.stem}.part{len(self.paths) + 1:04d}"
+        path = snapshot_path(stem, self.snapshot_format, self.csv_compression)
+        self.writer = SnapshotWriter(path, *self.writer_options).__enter__()
+        self.paths.append((path, 0))
+
+    def close_part(self) -> None:
+        if self.writer is not None:
+            self.writer.__exit__(None, None, None)
+            self.writer = None
+
+    def __enter__(self) -> "SnapshotPartsWriter":
+        # First file is written even without rows, so that every data storage has a file with its header
+        self.open_part()
+        return self
+
+    def write(self, rows: List[Sequence[Any]]) -> None:
+        while rows:
+            path, written = self.paths[-1]
+            if self.max_part_rows is not None and written >= self.max_part_rows:
+                self.open_part()
+                path, written = self.paths[-1]
+            free = len(rows) if self.max_part_rows is None else self.max_part_rows - written
+            self.writer.write(rows[:free])
+            self.paths[-1] = (path, written + len(rows[:free]))
+            rows = rows[free:]
+
+    def __exit__(self, *args) -> None:
+        self.close_part()
+
+
+def read_snapshot_columns(path: str, batch_size: int = 5000) -> Iterator[Dict[str, List[Any]]]:
+    """Reads a snapshot file batch by batch, every batch column by column ({"column": [values]})
+
+    csv values are read as strings, parquet / arrow values keep their types
+
+    Args:
+        path (str): Path of the file
+        batch_size (int, optional): Maximum amount of rows in a batch. Defaults to 5000.
+
+    Yields:
+        Iterator[Dict[str, List[Any]]]: Batches of values
+    """
+    snapshot_format = snapshot_format_of(path)
+    if snapshot_format == "csv":
+        yield from read_csv_columns(path, batch_size)
+        return
+    pa = import_pyarrow()
+    if snapshot_format == "parquet":
+        for batch in pa.parquet.ParquetFile(path).iter_batches(batch_size=batch_size):
+            yield batch.to_pydict()
+        return
+    with pa.memory_map(path, "r") as source:
+        reader = pa.ipc.open_file(source)
+        for idx in range(reader.num_record_batches):
+            batch = reader.get_batch(idx)
+            for offset in range(0, batch.num_rows, batch_size):
+                yield batch.slice(offset, batch_size).to_pydict()
+
+
+def read_csv_columns(path: str, batch_size: int = 5000) -> Iterator[Dict[str, List[Any]]]:
+    """Reads a csv snapshot batch by batch like read_snapshot_columns, all values as strings
+
+    csv is parsed by pyarrow (in C++, a few times faster) if it is installed, by csv module otherwise
+    """
+    with open_csv(path) as file:
+        header = next(csv.reader(file), [])
+        try:
+            import pyarrow
+            import pyarrow.csv
+        except ImportError:
+            while batch := list(islice(csv.reader(file), batch_size)):
+                yield {column: list(values) for column, values in zip(header, zip(*batch))}
+            return
+    if not header:
+        return
+    # Every column is read as string (empty values stay empty strings), types are given to them by DAOs
+    reader = pyarrow.csv.open_csv(path, read_options=pyarrow.csv.ReadOptions(block_size=1 << 22),
+                                  parse_options=pyarrow.csv.ParseOptions(newlines_in_values=True),
+                                  convert_options=pyarrow.csv.ConvertOptions(column_types={column: pyarrow.string() for column in header}))
+    for block in reader:
+        for offset in range(0, block.num_rows, batch_size):
+            yield block.slice(offset, batch_size).to_pydict()
+
+
+def read_snapshot_frames(path: str, chunk_size: int = 100000, dtypes: Optional[Dict[str, str]] = None) -> Iterator[Any]:
+    """Reads a snapshot file into pandas DataFrames of at most chunk_size rows, so that memory used while reading
+    depends on chunk_size and not on the size of the file (format is recognized by the extension)
+
+    Args:
+        path (str): Path of the file
+        chunk_size (int, optional): Amount of rows of every DataFrame. Defaults to 100000.
+        dtypes (Optional[Dict[str, str]], optional): pandas dtypes of columns of csv files ("datetime64[ns]" columns are parsed as dates),
+        parquet and arrow files keep their own types. Defaults to None (types guessed by pandas).
+
+    Yields:
+        Iterator[pd.DataFrame]: Consecutive chunks of the file
+    """
+    import pandas as pd
+    snapshot_format = snapshot_format_of(path)
+    if snapshot_format == "csv":
+        dtypes = dtypes or {}
+        dates = [column for column, dtype in dtypes.items() if dtype.startswith("datetime64")]
+        # Booleans are written as True / False, but values generated by rules are 1 / 0
+        with open_csv(path) as file, pd.read_csv(file, chunksize=chunk_size, dtype={column: dtype for column, dtype in dtypes.items() if column not in dates},
+                         parse_dates=dates, true_values=["True", "true", "1"], false_values=["False", "false", "0"]) as reader:
+            yield from reader
+        return
+    pa = import_pyarrow()
+    if snapshot_format == "parquet":
+        with pa.parquet.ParquetFile(path) as file:
+            for batch in file.iter_batches(batch_size=chunk_size):
+                yield batch.to_pandas()
+        return
+    with pa.memory_map(path, "r") as source:
+        reader = pa.ipc.open_file(source)
+        for idx in range(reader.num_record_batches):
+            batch = reader.get_batch(idx)
+            for offset in range(0, batch.num_rows, chunk_size):
+                yield batch.slice(offset, chunk_size).to_pandas()
+
+
+def read_snapshot_store(path: str, chunk_size: int = 100000, dtypes: Optional[Dict[str, str]] = None, store: str = "pandas") -> Any:
+    """Reads a whole snapshot file chunk by chunk (see read_snapshot_frames) into an in-memory store
+
+    Args:
+        store (str, optional): "pandas" (DataFrame) or "arrow" (pyarrow Table, columnar and more compact than DataFrame of strings). Defaults to "pandas".
+
+    Raises:
+        ValueError: When the store is not supported
+    """
+    frames = read_snapshot_frames(path, chunk_size, dtypes)
+    if store == "arrow":
+        pa = import_pyarrow()
+        batches = [pa.RecordBatch.from_pandas(frame, preserve_index=False) for frame in frames]
+        return pa.Table.from_batches(batches) if batches else pa.table({})
+    if store == "pandas":
+        import pandas as pd
+        frames = list(frames)
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    raise ValueError(f"Store {store} not supported, choose pandas or arrow")
+
+
+def merge_snapshots(parts: List[str], path: str, columns: List[str], snapshot_format: Optional[str] = "csv",
+                    column_types: Optional[Dict[str, Any]] = None, compression: Optional[str] = "zstd") -> None:
+    """Concatenates snapshot files (in the given order) into one file and removes them
+
+    Args:
+        parts (List[str]): Paths of files to concatenate
+        path (str): Path of the resulting file
+        columns (List[str]): Names of columns in order
+        snapshot_format (Optional[str], optional): Format of all files. Defaults to "csv".
+        column_types (Optional[Dict[str, Any]], optional): Arrow type of every column. Defaults to None.
+        compression (Optional[str], optional): Compression of parquet / arrow files. Defaults to "zstd".
+    """
+    if snapshot_format == "csv":
+        with open_csv(path, "w") as file:
+            for idx, part in enumerate(parts):
+                with open_csv(part) as part_file:
+                    header = part_file.readline()
+                    if idx == 0:
+                        file.write(header)
+                    shutil.copyfileobj(part_file, file)
+                os.remove(part)
+        return
+    with SnapshotWriter(path, columns, snapshot_format, column_types, compression) as writer:
+        for part in parts:
+            for values in read_snapshot_columns(part):
+                writer.write_columns(values)
+            os.remove(part)
+
+
+def count_snapshot_rows(path: str) -> int:
+    """Counts rows of a snapshot file (without the header of csv files)
+    """
+    snapshot_format = snapshot_format_of(path)
+    if snapshot_format == "csv":
+        with open_csv(path) as file:
+            return max(sum(1 for _ in csv.reader(file)) - 1, 0)
+    pa = import_pyarrow()
+    if snapshot_format == "parquet":
+        return pa.parquet.ParquetFile(path).metadata.num_rows
+    with pa.memory_map(path, "r") as source:
+        reader = pa.ipc.open_file(source)
+        return sum(reader.get_batch(idx).num_rows for idx in range(reader.num_record_batches))
+
+
+def file_checksum(path: str, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        while chunk := file.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def keys_checksum(keys) -> str:
+    """Checksum of sorted primary keys (NumPy array), the same keys give the same checksum whether read from a file or a database
+    """
+    digest = hashlib.sha256(str(keys.dtype.kind).encode())
+    digest.update(keys.tobytes())
+    return digest.hexdigest()
+
+
+def write_manifest(folder: str, manifest: Dict[str, Any]) -> None:
+    """Writes manifest of a snapshot folder atomically, so that a folder with a manifest is always complete
+    """
+    path = os.path.join(folder, MANIFEST_FILENAME)
+    with open(path + ".tmp", "w") as file:
+        json.dump({"version": MANIFEST_VERSION, **manifest}, file, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def read_manifest(folder: str) -> Optional[Dict[str, Any]]:
+    """Reads manifest of a snapshot folder, None for folders written before manifests existed
+    """
+    path = os.path.join(folder, MANIFEST_FILENAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as file:
+        manifest = json.load(file)
+    if manifest.get("version") not in range(1, MANIFEST_VERSION + 1):
+        raise ValueError(f"Manifest {path} has version {manifest.get('version')}, versions up to {MANIFEST_VERSION} are supported")
+    return manifest
+
+
+def write_checkpoint(folder: str, name: str, state: Dict[str, Any]) -> None:
+    """Writes checkpoint of a data storage (or of the run) into the snapshot folder atomically, so that a crash never leaves a half written one
+    """
+    path = os.path.join(folder, CHECKPOINTS_FOLDER, f"{name}.json")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w") as file:
+        json.dump(state, file, indent=2, default=str)
+    os.replace(path + ".tmp", path)
+
+
+def read_checkpoint(folder: str, name: str) -> Optional[Dict[str, Any]]:
+    """Reads checkpoint of a data storage (or of the run), None if there is none
+    """
+    path = os.path.join(folder, CHECKPOINTS_FOLDER, f"{name}.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+def has_checkpoints(folder: str) -> bool:
+    """Whether the snapshot folder belongs to a run that has not finished (it can be resumed)
+    """
+    return os.path.exists(os.path.join(folder, CHECKPOINTS_FOLDER, f"{RUN_CHECKPOINT}.json"))
+
+
+def manifest_parts(entry: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Files of a data storage in a manifest, as {"file", "rows", "checksum"} in the order they were written
+    """
+    if "parts" in entry:
+        return entry["parts"]
+    # Manifests of version 1 have one file per data storage
+    return [{"file": entry["file"], "rows": entry["delta_rows"], "checksum": entry["checksum"]}]
+
+
+def describe_parts(paths: List[Tuple[str, int]]) -> List[Dict[str, Any]]:
+    """Entries of written files in a manifest: name, amount of rows and checksum of every file
+    """
+    return [{"file": os.path.basename(path), "rows": rows, "checksum": file_checksum(path)} for path, rows in paths]
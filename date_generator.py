@@ -1,34 +1,71 @@
 from datetime import date
+from statistics import NormalDist
 import calendar
-from typing import Optional
-import random
-from scipy.stats import norm
+from typing import Optional, List, Tuple
+import numpy as np
 
 
 class DateGenerator:
     @staticmethod
-    def generate_date(begin_year: int, end_year: int):
-        # Randomly choose year
-        year = random.randint(begin_year, end_year)
-        # Take one sample from normal distribution and check if it is within <1;12> range 
-        mean, std = 6, 3
-        while (month := int(norm(loc=mean, scale=std).rvs(1)[0])) < 1 or month > 12:
-            pass
-        # Get all days in month
-        days_in_month = calendar.monthrange(year, month)[1]
-        # Randomly choose a day until it is a working day
-        day = random.randint(1, days_in_month-1)
-        while (generated_date := date(year=year, month=month, day=day)).weekday() > 5:
-            day = random.randint(1, days_in_month-1)
-        return generated_date
-
-    def __init__(self, begin_year: Optional[int] = 2023, end_year: Optional[int] = 2025, format: Optional[str] = "%Y-%m-%d"):
+    def date_distribution(begin_year: int, end_year: int, until: date) -> Tuple[List[date], np.ndarray]:
+        """Computes probability of every date that __call__ can return
+
+        Month is int(x) of x ~ N(6, 3) accepted only within <1;13), day is uniform over days of the month
+        (apart from the last one) that are not sundays, and dates after until are rejected as a whole
+
+        Args:
+            begin_year (int): First year of generated dates
+            end_year (int): Last year of generated dates
+            until (date): Latest date that can be generated
+
+        Returns:
+            Tuple[List[date], np.ndarray]: All possible dates and their probabilities
+        """
+        months = np.arange(1, 13)
+        # Probability of the sample falling into <month;month+1) among accepted samples
+        distribution = NormalDist(mu=6, sigma=3)
+        month_probs = np.array([distribution.cdf(month + 1) - distribution.cdf(month) for month in months])
+        month_probs /= month_probs.sum()
+        dates, weights = [], []
+        for year in range(begin_year, end_year + 1):
+            for month, month_prob in zip(months, month_probs):
+                days_in_month = calendar.monthrange(year, month)[1]
+                allowed = [date(year=year, month=month, day=day) for day in range(1, days_in_month)]
+                allowed = [day for day in allowed if day.weekday() <= 5]
+                for day in allowed:
+                    if day <= until:
+                        dates.append(day)
+                        weights.append(month_prob / len(allowed))
+        if not dates:
+            raise ValueError(f"There is no date to generate between {begin_year} and {min(end_year, until.year)}")
+        weights = np.array(weights)
+        return dates, weights / weights.sum()
+
+    def __init__(self, begin_year: Optional[int] = 2023, end_year: Optional[int] = 2025, format: Optional[str] = "%Y-%m-%d",
+                 rng: Optional[np.random.Generator] = None):
         self.begin_year = begin_year
         self.end_year = end_year
         self.format = format
+        self.rng = rng if rng is not None else np.random.default_rng()
+        # Formatted dates and their probabilities, computed on first sample for a given day
+        self.distribution = None
+        self.distribution_day = None
+
+    def sample(self, n: int) -> List[str]:
+        """Generates n dates at once, following the same distribution as __call__ without any rejection loop
+
+        Args:
+            n (int): Amount of dates to generate
+
+        Returns:
+            List[str]: Formatted dates
+        """
+        if self.distribution_day != (today := date.today()):
+            dates, weights = DateGenerator.date_distribution(self.begin_year, self.end_year, today)
+            self.distribution = (np.array([generated.strftime(self.format) for generated in dates]), weights)
+            self.distribution_day = today
+        dates, weights = self.distribution
+        return dates[self.rng.choice(len(dates), size=n, p=weights)].tolist()
     
     def __call__(self):
-        # If generated date is in the future, regenerate it
-        while (generated := DateGenerator.generate_date(self.begin_year, self.end_year)) > date.today():
-            pass
-        return generated.strftime(self.format)
\ No newline at end of file
+        return self.sample(1)[0]
\ No newline at end of file
@@ -44,6 +44,48 @@ def return_datatype(datatype_string: str) -> sqlalchemy.types.TypeEngine:
 
     
 
+def return_arrow_type(datatype: sqlalchemy.types.TypeEngine):
+    """Converts a sqlalchemy datatype to a pyarrow datatype, used for typed (parquet / arrow) snapshots
+
+    Args:
+        datatype (sqlalchemy.types.TypeEngine): Datatype of a column
+
+    Returns:
+        pyarrow.DataType: pyarrow datatype corresponding to the sqlalchemy one (string if there is no better match)
+    """
+    import pyarrow as pa
+    # Order matters, DateTime has to be checked before Date and Boolean / Integer before more general types
+    arrow_types = [
+        (sqlalchemy.Boolean, pa.bool_()),
+        (sqlalchemy.Integer, pa.int64()),
+        (sqlalchemy.Float, pa.float64()),
+        (sqlalchemy.DateTime, pa.timestamp("us")),
+        (sqlalchemy.Date, pa.date32()),
+        (sqlalchemy.Time, pa.time64("us")),
+    ]
+    return next((arrow_type for sql_type, arrow_type in arrow_types if isinstance(datatype, sql_type)), pa.string())
+
+
+def return_pandas_dtype(datatype: sqlalchemy.types.TypeEngine) -> str:
+    """Converts a sqlalchemy datatype to a pandas dtype, used for reading sheets with types of their columns
+
+    Args:
+        datatype (sqlalchemy.types.TypeEngine): Datatype of a column
+
+    Returns:
+        str: Nullable pandas dtype corresponding to the sqlalchemy one, so that empty values stay missing (string if there is no better match)
+    """
+    # Order matters, Boolean / Integer have to be checked before more general types
+    pandas_dtypes = [
+        (sqlalchemy.Boolean, "boolean"),
+        (sqlalchemy.Integer, "Int64"),
+        (sqlalchemy.Float, "Float64"),
+        (sqlalchemy.DateTime, "datetime64[ns]"),
+        (sqlalchemy.Date, "datetime64[ns]"),
+    ]
+    return next((dtype for sql_type, dtype in pandas_dtypes if isinstance(datatype, sql_type)), "string")
+
+
 def create_table(table_name: str, table_contents: dict, /, metadata: sqlalchemy.MetaData) -> sqlalchemy.Table:
     """Function that creates a sqlalchemy table based on the provided configuration
 
@@ -0,0 +1,257 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import json
+import operator
+import os
+import re
+import tempfile
+
+import numpy as np
+
+from dao_models.dao import DAO
+from dao_models.dao_sql import SQLDAO
+from dao_models.dao_csv import CSVDAO
+from dao_models.dao_memory import MemoryDAO, ColumnStore
+from dao_models.batch_sizing import estimate_row_bytes
+from dao_models.snapshot_io import SnapshotWriter, snapshot_path
+from instrumentation import METRICS
+
+# Keys of a generation spec file: {"scale_factor": 10, "counts": {"Vehicle": 300}}
+SPEC_KEYS = ("scale_factor", "counts")
+# Comparisons allowed in "Constraints" of the json configuration, e.g. "Exam <= Reservations" or "Examiners >= 1.2 * Examiner"
+COMPARISONS = {"<=": operator.le, "<": operator.lt, ">=": operator.ge, ">": operator.gt, "==": operator.eq}
+TERM = r"\s*(?:(?:(?P<{0}factor>\d+(?:\.\d+)?)\s*\*\s*)?(?P<{0}name>[A-Za-z_]\w*)|(?P<{0}number>\d+(?:\.\d+)?))\s*"
+CONSTRAINT = re.compile(TERM.format("left") + r"(?P<comparison><=|>=|==|<|>)" + TERM.format("right"))
+# Stages of a data storage spent on storing rows (not on generating them), read from metrics of earlier runs
+# (once-per-run costs such as loading key pools do not grow with rows and are left out)
+STORAGE_STAGES = ("insert", "commit", "write", "fetch_dependencies", "checkpoint")
+
+
+def load_spec(path: str) -> Dict[str, Any]:
+    """Reads a generation spec: scale factor of ratios of the json configuration and / or amounts of rows of data storages
+
+    Raises:
+        ValueError: When the spec holds unknown keys
+    """
+    with open(path, "r") as file:
+        spec = json.load(file)
+    if unknown := set(spec) - set(SPEC_KEYS):
+        raise ValueError(f"Unknown keys {sorted(unknown)} in spec {path}, use {list(SPEC_KEYS)}")
+    return spec
+
+
+def resolve_counts(config: Dict[str, Any], scale_factor: Optional[float] = None, counts: Optional[Dict[str, int]] = None) -> Dict[str, int]:
+    """Amount of rows of every data storage of the configuration: given counts first, ratio of the data storage
+    (its "ratio" in the json configuration, rows at scale factor 1) multiplied by the scale factor otherwise
+
+    Raises:
+        ValueError: When counts name unknown data storages or a data storage gets no amount of rows
+
+    Returns:
+        Dict[str, int]: Name of the data storage and amount of rows, in the order of the configuration
+    """
+    counts = counts or {}
+    entries = {name: entry for section in ("Tables", "Sheets") for name, entry in config[section].items()}
+    if unknown := [name for name in counts if name not in entries]:
+        raise ValueError(f"Counts of {unknown} given, but they are not in the configuration")
+    resolved, missing = {}, []
+    for name, entry in entries.items():
+        if name in counts:
+            resolved[name] = int(counts[name])
+        elif scale_factor is not None and "ratio" in entry:
+            resolved[name] = int(round(entry["ratio"] * scale_factor))
+        else:
+            missing.append(name)
+    if missing:
+        raise ValueError(f"Amount of rows of {missing} is not given, add it to counts (or a ratio to the configuration and use a scale factor)")
+    return resolved
+
+
+def parse_constraint(text: str) -> Tuple[Tuple[float, Optional[str]], str, Tuple[float, Optional[str]]]:
+    """Parses "[factor *] name comparison [factor *] name" (either side may also be a number)
+
+    Raises:
+        ValueError: When the constraint is not written that way
+
+    Returns:
+        Tuple[Tuple[float, Optional[str]], str, Tuple[float, Optional[str]]]: (factor, name) of the left side, comparison, (factor, name) of the right side,
+        name is None for numbers
+    """
+    match = CONSTRAINT.fullmatch(text)
+    if match is None:
+        raise ValueError(f"Constraint {text!r} is not of the form 'A <= B', 'A >= 2 * B' or 'A > 0'")
+    def term(side: str) -> Tuple[float, Optional[str]]:
+        if match[f"{side}number"] is not None:
+            return float(match[f"{side}number"]), None
+        return float(match[f"{side}factor"] or 1), match[f"{side}name"]
+    return term("left"), match["comparison"], term("right")
+
+
+def check_constraints(constraints: List[Union[str, Dict[str, str]]], counts: Dict[str, int]) -> None:
+    """Checks cardinality constraints and that no amount of rows is negative
+
+    Constraint is a comparison (see parse_constraint), or {"check": comparison, "message": explanation shown when it is not met}
+
+    Raises:
+        ValueError: Listing every constraint that is not met
+    """
+    violated = [f"{name} = {count} is negative" for name, count in counts.items() if count < 0]
+    for constraint in constraints:
+        message = constraint.get("message") if isinstance(constraint, dict) else None
+        constraint = constraint["check"] if isinstance(constraint, dict) else constraint
+        (left_factor, left), comparison, (right_factor, right) = parse_constraint(constraint)
+        if unknown := [name for name in (left, right) if name is not None and name not in counts]:
+            raise ValueError(f"Constraint {constraint!r} names {unknown}, which are not generated")
+        left_value = left_factor * (counts[left] if left is not None else 1)
+        right_value = right_factor * (counts[right] if right is not None else 1)
+        if not COMPARISONS[comparison](left_value, right_value):
+            values = ", ".join(f"{name} = {counts[name]}" for name in (left, right) if name is not None)
+            violated.append(f"{constraint} ({values})" + (f": {message}" if message else ""))
+    if violated:
+        raise ValueError("Amounts of rows do not meet constraints of the configuration: " + "; ".join(violated))
+
+
+def dependency_levels(data_storages: List[DAO]) -> List[List[str]]:
+    """Names of data storages grouped by how deep they are in the dependency graph (given in topological order),
+    storages of one level can be generated at the same time
+    """
+    levels = {}
+    for data_storage in data_storages:
+        levels[data_storage.name] = 1 + max((levels[dep] for dep in data_storage.dependency), default=-1)
+    return [[name for name, level in levels.items() if level == depth] for depth in range(max(levels.values(), default=-1) + 1)]
+
+
+@dataclass
+class StorageEstimate:
+    """Estimated cost of generating one data storage, scaled from a sample of its rows
+    """
+    name: str
+    rows: int
+    # Seconds spent on generating rows (measured on the sample) and on storing them (from metrics of an earlier run, None if unknown)
+    generate_seconds: float
+    store_seconds: Optional[float]
+    # Bytes of snapshot files and of memory held until the end of the run (key pools, tables kept in memory, kept sheets)
+    output_bytes: int
+    memory_bytes: int
+    # Bytes of batches waiting for the writer while the data storage is generated
+    batch_bytes: int
+    # Seconds per row of every rule
+    rule_costs: Dict[str, float] = field(default_factory=dict)
+
+    def seconds(self, pipelined: bool = True) -> float:
+        """Time of the data storage, batches are stored while next ones are generated when pipelined
+        """
+        store = self.store_seconds or 0.0
+        return max(self.generate_seconds, store) if pipelined else self.generate_seconds + store
+
+
+def read_previous_metrics(folder: str) -> Dict[str, Dict[str, Any]]:
+    """Metrics (metrics.json) of the latest snapshot in folder that has them, empty if there are none
+    """
+    if not os.path.isdir(folder):
+        return {}
+    snapshots = sorted((entry for entry in os.scandir(folder) if os.path.exists(os.path.join(entry.path, "metrics.json"))),
+                       key=lambda entry: os.path.getmtime(os.path.join(entry.path, "metrics.json")))
+    if not snapshots:
+        return {}
+    with open(os.path.join(snapshots[-1].path, "metrics.json"), "r") as file:
+        return json.load(file)
+
+
+def file_bytes_per_row(folder: str, name: str, values: Dict[str, List[Any]], snapshot_format: str,
+                       compression: Optional[str], csv_compression: Optional[str]) -> float:
+    """Bytes one row takes in a snapshot file of the format, measured by writing the sample (and an empty file, to leave out headers)
+    """
+    columns = list(values)
+    rows = list(zip(*values.values()))
+    if snapshot_format != "csv":
+        # Values are written as text, typed files are smaller
+        rows = [tuple(None if value is None else str(value) for value in row) for row in rows]
+    sizes = []
+    for stem, written in ((f"{name}_empty", []), (name, rows)):
+        path = snapshot_path(os.path.join(folder, stem), snapshot_format, csv_compression)
+        with SnapshotWriter(path, columns, snapshot_format, {}, compression) as writer:
+            writer.write(written)
+        sizes.append(os.path.getsize(path))
+    return max(sizes[1] - sizes[0], 0) / max(len(rows), 1)
+
+
+def estimate_run(data_storages: List[DAO], counts: Dict[str, int], sample_rows: int = 1000,
+                 previous_metrics: Optional[Dict[str, Dict[str, Any]]] = None, snapshot_format: str = "csv",
+                 compression: Optional[str] = "zstd", csv_compression: Optional[str] = None, pipeline_depth: int = 2) -> List[StorageEstimate]:
+    """Estimates time, memory and size of snapshot files of a run from a sample of rows of every data storage
+
+    Every data storage generates sample_rows rows with its own rules (nothing is stored), costs of rules are measured
+    per row and scaled to the amount of rows of the run. Time of storing rows is taken from metrics of an earlier run, if there is one
+
+    Args:
+        data_storages (List[DAO]): Data storages in topological order
+        counts (Dict[str, int]): Amount of rows of every data storage
+        sample_rows (int, optional): Rows sampled per data storage. Defaults to 1000.
+        previous_metrics (Optional[Dict[str, Dict[str, Any]]], optional): Summary of metrics of an earlier run. Defaults to None.
+        snapshot_format (str, optional): Format of snapshot files. Defaults to "csv".
+        compression (Optional[str], optional): Compression of parquet / arrow files. Defaults to "zstd".
+        csv_compression (Optional[str], optional): Compression of csv files. Defaults to None.
+        pipeline_depth (int, optional): Batches waiting for the writer of a data storage. Defaults to 2.
+
+    Returns:
+        List[StorageEstimate]: Estimate of every data storage, in the given order
+    """
+    previous_metrics = previous_metrics or {}
+    samples, estimates = {}, []
+    with tempfile.TemporaryDirectory() as folder:
+        for data_access in data_storages:
+            rows = counts.get(data_access.name, 0)
+            # Rules create Faker / import modules on first use, which is not a cost per row
+            data_access.sample(min(sample_rows, 10), samples)
+            with METRICS.scope(data_access.name, "sample"):
+                values = data_access.sample(sample_rows, samples)
+            samples[data_access.name] = values
+            stages = METRICS.summary()[data_access.name]["stages"]
+            rule_costs = {stage[len("rule."):]: timer["seconds"] / sample_rows for stage, timer in stages.items() if stage.startswith("rule.")}
+            previous = previous_metrics.get(data_access.name)
+            store_seconds = None
+            if previous and previous["rows"]:
+                store_seconds = sum(previous["stages"].get(stage, {}).get("seconds", 0.0) for stage in STORAGE_STAGES) / previous["rows"] * rows
+            row_bytes = estimate_row_bytes(list(zip(*values.values())))
+            memory_bytes = 0
+            if isinstance(data_access, SQLDAO) and data_access.is_primary_key_generated():
+                # Key pool of the table, keys generated by rules that are not unique by construction are also kept in a KeySet
+                keys = np.asarray(values[data_access.data_object.primary_key.columns[0].name])
+                memory_bytes += rows * keys.itemsize * (1 if data_access.get_unique_key_rule() is not None else 2)
+            if isinstance(data_access, MemoryDAO) and data_access.store.spill_path is None:
+                # Columns left empty by the sample (autoincrement keys) are filled by the store
+                filled = {column: column_values for column, column_values in values.items() if any(value is not None for value in column_values)}
+                store = ColumnStore(data_access.data_object)
+                store.append(list(filled), list(zip(*filled.values())))
+                memory_bytes += int(store.table().nbytes / sample_rows * rows)
+            if isinstance(data_access, CSVDAO) and data_access.keep:
+                memory_bytes += rows * row_bytes
+            estimates.append(StorageEstimate(
+                data_access.name, rows, stages["sample"]["seconds"] / sample_rows * rows, store_seconds,
+                int(file_bytes_per_row(folder, data_access.name, values, snapshot_format, compression, csv_compression) * rows),
+                memory_bytes, min(rows, data_access.get_batch_size()) * (pipeline_depth + 2) * row_bytes, rule_costs))
+    return estimates
+
+
+def schedule_seconds(data_storages: List[DAO], estimates: List[StorageEstimate], max_workers: int = 1,
+                     shards: Optional[Dict[str, int]] = None, pipelined: bool = True) -> float:
+    """Time of the whole run: data storages start as soon as their dependencies are done and a worker is free
+    (like run_in_dependency_order), a data storage generated in shards takes its time divided between them
+    """
+    shards = shards or {}
+    seconds = {estimate.name: estimate.seconds(pipelined) / max(shards.get(estimate.name, 1), 1) for estimate in estimates}
+    dependencies = {data_storage.name: data_storage.dependency for data_storage in data_storages}
+    finished, workers = {}, [0.0] * max(max_workers, 1)
+    pending = [data_storage.name for data_storage in data_storages]
+    while pending:
+        # Next data storage is the one that can start first, in topological order among those starting at the same time
+        ready = [(max([finished[dep] for dep in dependencies[name]], default=0.0), idx, name) for idx, name in enumerate(pending)
+                 if all(dep in finished for dep in dependencies[name])]
+        ready_at, _, name = min(ready)
+        worker = min(range(len(workers)), key=workers.__getitem__)
+        finished[name] = max(ready_at, workers[worker]) + seconds[name]
+        workers[worker] = finished[name]
+        pending.remove(name)
+    return max(finished.values(), default=0.0)
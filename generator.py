@@ -1,20 +1,36 @@
-import pandas as pd
 import sqlalchemy
 import json
 import os
-import traceback
 import argparse
+import logging
+import re
+import secrets
+import shutil
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from typing import Optional, Dict, Self
+from typing import Optional, Dict, List, Self, Tuple, Any
 
-from db_model import create_table
-from dao_models.dao_csv import CSVDAO
 from dao_models.dao_sql import SQLDAO
+from dao_models.factory import create_data_storage
+from dao_models.bulk_loader import create_sql_engine
+from dao_models.key_pool import KeySet
+from dao_models.snapshot_io import SNAPSHOT_FORMATS, CSV_COMPRESSIONS, read_manifest, write_manifest, manifest_parts, file_checksum, keys_checksum, \
+    CHECKPOINTS_FOLDER, RUN_CHECKPOINT, write_checkpoint, read_checkpoint, has_checkpoints
+from scheduler import run_in_dependency_order, topological_order
+from generation_spec import load_spec, resolve_counts, check_constraints, dependency_levels, estimate_run, schedule_seconds, read_previous_metrics
+from sharding import generate_sharded
+from instrumentation import METRICS, MetricsSink, LogSink, JSONSummarySink, PrometheusTextfileSink
 
 load_dotenv()
 
 class DataGenerator:
-    def __init__(self, data_config_filepath: str, path: Optional[str] = "data/snapshots/"):
+    def __init__(self, data_config_filepath: str, path: Optional[str] = "data/snapshots/", batch_size: Optional[int] = None,
+                 snapshot_format: Optional[str] = "csv", compression: Optional[str] = "zstd",
+                 metrics_sinks: Optional[List[MetricsSink]] = None, profile_top: int = 0, seed: Optional[int] = None,
+                 pipeline_depth: int = 2, csv_compression: Optional[str] = None, backend: Optional[str] = None,
+                 spill_path: Optional[str] = None, checkpoint_every: int = 10, resume: bool = False,
+                 batch_memory_mb: int = 64, engine_options: Optional[Dict[str, Any]] = None, dry_run: bool = False):
         # This is intended to be a of such structure:
         # {'name_of_the_storage': object_representing_the_storage}
         # Such that it is possible to access the storage by name
@@ -25,7 +41,46 @@ class DataGenerator:
         path_cwd = os.path.join(os.getcwd(), path)
         self.current_version = len(os.listdir(path_cwd))
         self.path_to_save = os.path.join(path_cwd, f"T{self.current_version+1}")
+        # Checkpoint of the interrupted run that is resumed (see resume), its snapshot folder is written further
+        self.run_checkpoint = None
+        if resume:
+            unfinished = [folder for folder in self.list_snapshots(path_cwd) if has_checkpoints(os.path.join(path_cwd, folder))]
+            if not unfinished:
+                raise ValueError(f"There is no interrupted run in {path_cwd} to resume")
+            self.path_to_save = os.path.join(path_cwd, unfinished[-1])
+            self.run_checkpoint = read_checkpoint(self.path_to_save, RUN_CHECKPOINT)
+            seed = self.run_checkpoint["seed"]
         self.data_storage = {}
+        # Options of all DAOs: amount of rows inserted at once into database (None -> defaults of DAOs),
+        # format of snapshot files (csv, parquet or arrow), compression of parquet / arrow files and of csv files (gzip, zstd)
+        # Seed of the run, batches of every DAO get their own sub-seeds of it (random one is drawn and printed if not given,
+        # so that any run can be reproduced)
+        self.seed = seed if seed is not None else secrets.randbits(63)
+        print(f"Seed of this run: {self.seed}")
+        # How many generated batches of a DAO may wait for its writer thread (inserts / file writes overlap with generation), 0 -> no writer thread
+        # Megabytes rows of one insert / fetch of dependency rows may take, their sizes are tuned by measured latency and rows/s (0 -> fixed sizes)
+        self.storage_options = {"batch_size": batch_size, "snapshot_format": snapshot_format, "compression": compression, "seed": self.seed,
+                                "pipeline_depth": pipeline_depth, "csv_compression": None if csv_compression == "none" else csv_compression,
+                                "spill_path": spill_path, "batch_memory_mb": batch_memory_mb}
+        if self.run_checkpoint is not None:
+            # Options deciding about generated rows and file names are the ones of the interrupted run
+            self.storage_options.update({option: self.run_checkpoint["storage_options"][option]
+                                         for option in ("batch_size", "snapshot_format", "compression", "csv_compression")})
+        # Pool settings and other options of the engine (see create_sql_engine)
+        self.engine_options = engine_options or {}
+        # After how many batches every DAO writes its checkpoint, 0 -> no checkpoints
+        self.checkpoint_every = checkpoint_every
+        # Where tables are generated: "sql" (database of SQL_URL) or "memory" (Arrow batches, no database needed),
+        # by default the database if SQL_URL is set
+        self.backend = backend or ("sql" if os.getenv("SQL_URL") else "memory")
+        if self.backend not in ("sql", "memory"):
+            raise ValueError(f"Backend {self.backend} not supported, choose sql or memory")
+        # Where timers and counters of DAOs are reported, and how many hot functions are dumped per DAO (0 -> no profiling)
+        METRICS.configure(metrics_sinks, profile_top)
+        # Nothing is written (tables are not created in the database), the run is only estimated (see estimate)
+        self.dry_run = dry_run
+        # Snapshot whose rows are loaded in the database (set by load_from_folder), the next snapshot saves only rows added to it
+        self.base_snapshot = self.run_checkpoint["base"] if self.run_checkpoint is not None else None
         self.load_json_config(os.path.join(os.getcwd(), data_config_filepath))
     
     def load_json_config(self, filepath: str):
@@ -33,157 +88,446 @@ class DataGenerator:
         with open(filepath, "r") as file:
             file_content = json.load(file)
         # Iterate over the tables in the configuration
-        engine = sqlalchemy.create_engine(os.getenv("SQL_URL"))
+        if self.backend == "sql" and not os.getenv("SQL_URL"):
+            raise ValueError("SQL_URL is not set, set it or generate tables in memory (--backend memory)")
+        # Tables kept in memory need no engine
+        engine = create_sql_engine(os.getenv("SQL_URL"), **self.engine_options) if self.backend == "sql" else None
         metadata = sqlalchemy.MetaData()
-        for table_name, table_config in file_content["Tables"].items():
-            # print(f"Creating DAO for {table_name}")
-            self.data_storage[table_name] = SQLDAO(table_name, create_table(table_name, table_config, metadata=metadata), 
-                                                list(table_config["foreign_key"]), engine=engine, metadata=metadata)
-        metadata.create_all(engine)
-        for sheet_name, sheet_columns in file_content["Sheets"].items():
-            # print(f"Creating DAO for {sheet_name}")
-            self.data_storage[sheet_name] = CSVDAO(sheet_name, pd.DataFrame(columns=sheet_columns["columns"]), 
-                                                   list(sheet_columns["foreign_key"]), sheet_columns["foreign_key"], engine=engine, metadata=metadata, snapshot=self.path_to_save)
+        self.config = file_content
+        self.engine = engine
+        self.data_storage = create_data_storage(file_content, engine, metadata, self.path_to_save, **self.storage_options)
+        if engine is None and self.run_checkpoint is not None:
+            raise ValueError("Only runs generating into a database can be resumed, tables kept in memory are lost with the process")
+        if engine is not None and not self.dry_run:
+            metadata.create_all(engine)
+        # Progress of generation is saved only when it outlives the process (in the database and in files of sheets)
+        if engine is not None and self.checkpoint_every > 0 and not self.dry_run:
+            for data_access in self.data_storage.values():
+                data_access.enable_checkpoints(self.path_to_save, self.checkpoint_every)
     
     def create_loading_dict(self, path: str) -> Dict[str, str]:
-        return {file.split("_")[0]: os.path.join(path, file) for file in os.listdir(path)}
+        """Finds snapshot file of every data storage in path by its exact name (tables: NAME_insert, sheets: NAME_), in any snapshot format
+        (csv files also compressed)
 
-    # TODO check if this works properly with many time spaces
-    def load_from_folder(self, folder_path: str = "data/snapshots/") -> Self:
-        folder_path = os.path.join(os.getcwd(), folder_path)
-        # Iterate through all snapshots in folder
-        for timestamp in os.listdir(folder_path):
-            if not os.path.isdir(os.path.join(folder_path, timestamp)):
+        Raises:
+            ValueError: When a data storage is saved in more than one format
+        """
+        files = set(os.listdir(path))
+        extensions = list(SNAPSHOT_FORMATS.values()) + [SNAPSHOT_FORMATS["csv"] + extension for extension in CSV_COMPRESSIONS.values()]
+        loading_dict = {}
+        for name, data_access in self.data_storage.items():
+            stem = f"{name}_insert" if isinstance(data_access, SQLDAO) else f"{name}_"
+            found = [stem + extension for extension in extensions if stem + extension in files]
+            if len(found) > 1:
+                raise ValueError(f"Snapshot {path} holds {name} in more than one format: {found}")
+            if found:
+                loading_dict[name] = os.path.join(path, found[0])
+        return loading_dict
+
+    @staticmethod
+    def list_snapshots(folder_path: str) -> List[str]:
+        """Snapshot folders in the order they were created (T1, T2, ..., T10, other folders last)
+        """
+        folders = [folder for folder in os.listdir(folder_path) if os.path.isdir(os.path.join(folder_path, folder))]
+        return sorted(folders, key=lambda folder: (0, int(folder[1:]), folder) if re.fullmatch(r"T\d+", folder) else (1, 0, folder))
+
+    def find_loaded_snapshots(self, manifests: List[Optional[Dict]]) -> Dict[str, Tuple[int, np.ndarray]]:
+        """Finds for every table the latest snapshot that the database holds already: the same amount of rows and the same primary keys
+
+        Args:
+            manifests (List[Optional[Dict]]): Manifests of snapshots in order (None for snapshots without one)
+
+        Returns:
+            Dict[str, Tuple[int, np.ndarray]]: Name of the table, index of the snapshot and primary keys of the table
+        """
+        loaded = {}
+        for name, data_access in self.data_storage.items():
+            if not isinstance(data_access, SQLDAO):
                 continue
-            files = self.create_loading_dict(os.path.join(folder_path, timestamp))
-            # Sort the order of generation by the dependency
-            loading_order = sorted(list(self.data_storage.values()), key=lambda x: len(x.dependency))
-            idx = 0
-            # Keep track of how many storages have been loaded
-            loaded = 0
-            # Iterate through loading order until all data storages have been loaded
-            while loaded < len(loading_order):
-                data_access = loading_order[idx]
-                # Check if the data has already been loaded
-                # Check if this data storage is either:
-                #        not dependent on any other data storage
-                #        all dependencies have been already loaded
-                if not data_access.has_been_loaded() and (data_access.is_not_dependent() or data_access.is_dependency_fulfilled_for_loading(loading_order)):
-                    data_access.load(files[data_access.name])
-                    loaded += 1
-                idx += 1
-                # We are out of bounds
-                if idx >= len(loading_order):
-                    # Reset index to iterate through whole list again
-                    idx = 0
-            [ds.unload() for ds in loading_order]
+            with data_access.connect() as conn:
+                count = data_access.count_entries(conn)
+            candidates = [(idx, manifest["storages"][name]) for idx, manifest in enumerate(manifests)
+                          if manifest is not None and name in manifest["storages"] and manifest["storages"][name]["rows"] == count]
+            if not candidates:
+                continue
+            keys = data_access.get_table_keys()
+            checksum = keys_checksum(keys)
+            for idx, entry in reversed(candidates):
+                if entry["keys_checksum"] == checksum:
+                    loaded[name] = (idx, keys)
+                    break
+        return loaded
+
+    def load_from_folder(self, folder_path: str = "data/snapshots/", max_workers: int = 1) -> Self:
+        """Loads snapshots in the order they were created
+
+        Snapshots with a manifest are loaded incrementally: a table that holds all rows of a snapshot already skips it
+        (and every snapshot before it), only newer deltas are inserted, and sheets are not read again.
+        Snapshots written before manifests existed hold whole tables, rows that are loaded already are skipped.
+        Checksums of part files of a data storage are verified in parallel before any of its parts is loaded
+
+        Args:
+            folder_path (str, optional): Folder with snapshots. Defaults to "data/snapshots/".
+            max_workers (int, optional): How many data storages can be loaded at the same time. Defaults to 1.
+
+        Raises:
+            ValueError: When a file does not match the checksum in the manifest
+        """
+        folder_path = os.path.join(os.getcwd(), folder_path)
+        # Snapshots of interrupted runs are not complete, they are left until the runs are resumed
+        snapshots = [snapshot for snapshot in self.list_snapshots(folder_path)
+                     if os.path.join(folder_path, snapshot) != self.path_to_save and not has_checkpoints(os.path.join(folder_path, snapshot))]
+        manifests = [read_manifest(os.path.join(folder_path, snapshot)) for snapshot in snapshots]
+        loaded = self.find_loaded_snapshots(manifests)
+        # Tables holding rows that are in no snapshot, rows of snapshots already among them are skipped
+        unknown = set()
+        for name, data_access in self.data_storage.items():
+            if isinstance(data_access, SQLDAO) and name not in loaded:
+                with data_access.connect() as conn:
+                    if data_access.count_entries(conn):
+                        unknown.add(name)
+        for idx, snapshot in enumerate(snapshots):
+            path, manifest = os.path.join(folder_path, snapshot), manifests[idx]
+            files = self.create_loading_dict(path) if manifest is None else {}
+            # Deltas of a snapshot based on the previous one never overlap with rows loaded before
+            chained = manifest is not None and idx > 0 and manifest.get("base") == snapshots[idx - 1]
+            def load(data_access, idx=idx, path=path, manifest=manifest, files=files, chained=chained) -> None:
+                name, is_table = data_access.name, isinstance(data_access, SQLDAO)
+                if manifest is None:
+                    if name in files:
+                        data_access.load(files[name], **({"skip_existing": True} if is_table else {}))
+                    return
+                if (entry := manifest["storages"].get(name)) is None:
+                    return
+                if name in loaded and idx <= loaded[name][0]:
+                    if idx == loaded[name][0]:
+                        data_access.restore(loaded[name][1], entry.get("key_high_water"))
+                    return
+                if not is_table and not data_access.keep:
+                    data_access.restore()
+                    return
+                parts = manifest_parts(entry)
+                filepaths = [os.path.join(path, part["file"]) for part in parts]
+                with ThreadPoolExecutor(max_workers=min(len(filepaths), os.cpu_count() or 1)) as executor:
+                    checksums = list(executor.map(file_checksum, filepaths))
+                for filepath, part, checksum in zip(filepaths, parts, checksums):
+                    if checksum != part["checksum"]:
+                        raise ValueError(f"{filepath} does not match the manifest of {snapshot}, the snapshot is corrupted")
+                # Parts are disjoint, they are inserted one after another in the order they were written
+                for filepath in filepaths:
+                    if is_table:
+                        data_access.load(filepath, skip_existing=name in unknown or not (chained or idx == 0))
+                    else:
+                        data_access.load(filepath)
+            # Load every data storage as soon as all of its dependencies have been loaded
+            run_in_dependency_order(list(self.data_storage.values()), load, max_workers)
+            [ds.unload() for ds in self.data_storage.values()]
+        # Next snapshot saves only rows that are not in the latest one
+        self.base_snapshot = snapshots[-1] if snapshots and manifests[-1] is not None else None
         return self
 
-    def save_to_file(self, sql_filename: Optional[str] = "data/create.sql") -> None:
+    def get_base_keys(self, name: str) -> Optional[KeySet]:
+        """Primary keys of a table in the snapshot this run is based on, None if there is no such snapshot
+        """
+        if self.base_snapshot is None:
+            return None
+        folder = os.path.join(os.path.dirname(self.path_to_save), self.base_snapshot)
+        if (entry := read_manifest(folder)["storages"].get(name)) is None:
+            return None
+        keys = KeySet()
+        keys.update_array(np.load(os.path.join(folder, entry["keys"]), allow_pickle=False))
+        return keys
+
+    def save_to_file(self, sql_filename: Optional[str] = "data/create.sql", max_workers: int = 1,
+                     fetch_size: int = 10000, max_part_rows: Optional[int] = None) -> None:
         """Function to save all data sources to files
 
         Args:
             sql_filename (Optional[str], optional): Filename for all creates of tables from .json. Defaults to "DataGenerator/data/create.sql".
+            max_workers (int, optional): How many tables are exported at the same time (each one over its own connection). Defaults to 1.
+            fetch_size (int, optional): Amount of rows fetched from the database at once. Defaults to 10000.
+            max_part_rows (Optional[int], optional): Tables are split into part files of at most this many rows. Defaults to None (one file per table).
         """
         sql_filename = os.path.join(os.getcwd(), sql_filename)
         # Save Tables into Create SQL statements        
         with open(sql_filename, "w") as file:
             for table_name, table in self.data_storage.items():
                 if isinstance(table, SQLDAO):
-                    print(f"Saving {table_name} to file")
+                    METRICS.progress(table_name, "create statement saved")
                     file.write(str(sqlalchemy.schema.CreateTable(table.data_object).compile()))
         os.makedirs(self.path_to_save, exist_ok=True)
-        # Save Sheets into .csv and Insert values into .csv
-        for data in self.data_storage.values():
-            data.save(self.path_to_save)
+        # Save Sheets into .csv and Insert values into .csv (tables only with rows missing in the base snapshot)
+        def save(data) -> Optional[Dict[str, Any]]:
+            if isinstance(data, SQLDAO):
+                return data.save(self.path_to_save, fetch_size, self.get_base_keys(data.name), max_part_rows)
+            return data.save(self.path_to_save)
+        # Tables do not depend on each other once generated, manifest keeps the order of the configuration
+        with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as executor:
+            entries = list(executor.map(save, self.data_storage.values()))
+        storages = {data.name: entry for data, entry in zip(self.data_storage.values(), entries) if entry is not None}
+        # Manifest is written last, so that only complete snapshots have one
+        write_manifest(self.path_to_save, {"base": self.base_snapshot, "seed": self.seed,
+                                           "snapshot_format": self.storage_options["snapshot_format"], "storages": storages})
+        # Run is complete, there is nothing to resume
+        shutil.rmtree(os.path.join(self.path_to_save, CHECKPOINTS_FOLDER), ignore_errors=True)
+        # Timers and counters of the whole run are exported next to the snapshot
+        METRICS.export(self.path_to_save)
     
     def validate_dict(self, generate_dict: Dict[str, int]) -> None:
-        """This function should be modified by any one who wants to use the DataGenerator.
-        Here should be the validation of the amount of data that should be generated for each table.
-        We want this validation to ensure that all data is synchronized.
-
-        In this case it is suited for my purposes.
+        """Validates the amount of data that should be generated for each data structure against cardinality constraints
+        declared in "Constraints" of the json configuration (e.g. "Exam <= Reservations"), to ensure that all data is synchronized
 
         Args:
             generate_dict (Dict[str, int]): Dictionary with the amount of data to be generated for each
             table.
+
+        Raises:
+            ValueError: When a constraint is not met
+        """
+        check_constraints(self.config.get("Constraints", []), generate_dict)
+
+    def resolve_generate_dict(self, scale_factor: Optional[float] = None, counts: Optional[Dict[str, int]] = None) -> Dict[str, int]:
+        """Amount of data of every data structure: given counts, or ratios of the json configuration multiplied by the scale factor
+        (see generation_spec.resolve_counts)
         """
-        if generate_dict["Examiner"] > generate_dict["Examiners"]:
-            raise ValueError("There cannot be more current Examiners (db) than all Examiners (csv)")
-        if generate_dict["Candidate"] > generate_dict["Reservations"]:
-            raise ValueError("There cannot be more Candidates than Reservations")
-        if generate_dict["Exam"] > generate_dict["Reservations"]:
-            raise ValueError("There cannot be more Exams than Reservations")
+        return resolve_counts(self.config, scale_factor, counts)
 
-    def generate_data(self, generate_dict: Dict[str, int]) -> Self:
-        """Function to queue DAOs in a correct way (sorted by dependency)
+    def estimate(self, generate_dict: Dict[str, int], max_workers: int = 1, shards: Optional[Dict[str, int]] = None, sample_rows: int = 1000) -> None:
+        """Prints what a run would do without running it: amounts of data, order of generation and estimated time, memory
+        and size of the snapshot. Costs of rules are measured on sample_rows rows of every data structure (nothing is stored),
+        costs of storing rows are taken from metrics of the latest snapshot that has them
+
+        Raises:
+            ValueError: When amounts of data do not meet constraints of the configuration
+        """
+        self.validate_dict(generate_dict)
+        order = topological_order(list(self.data_storage.values()))
+        print("===============================")
+        print("Amounts of data")
+        for name, count in generate_dict.items():
+            print(f"  {name:<20} {count:>14,}" + (f"   in {shards[name]} shards" if shards and shards.get(name, 1) > 1 else ""))
+        print(f"Order of generation (at most {max_workers} at once)")
+        for depth, names in enumerate(dependency_levels(order), start=1):
+            print(f"  {depth}. {', '.join(names)}")
+        previous = read_previous_metrics(os.path.dirname(self.path_to_save))
+        estimates = estimate_run(order, generate_dict, sample_rows, previous, self.storage_options["snapshot_format"],
+                                 self.storage_options["compression"], self.storage_options["csv_compression"], self.storage_options["pipeline_depth"])
+        pipelined = self.storage_options["pipeline_depth"] > 0
+        print(f"Estimates (rules measured on {sample_rows} rows" + (", storing taken from the latest metrics.json)" if previous else ", time of storing unknown: no metrics.json of earlier runs)"))
+        print(f"  {'name':<20} {'generate s':>10} {'store s':>10} {'output MB':>10} {'memory MB':>10}   costliest rule")
+        for estimate in estimates:
+            rule, cost = max(estimate.rule_costs.items(), key=lambda item: item[1], default=("-", 0.0))
+            store = "unknown" if estimate.store_seconds is None else f"{estimate.store_seconds:.1f}"
+            print(f"  {estimate.name:<20} {estimate.generate_seconds:>10.1f} {store:>10} {estimate.output_bytes / 2 ** 20:>10.1f} "
+                  f"{estimate.memory_bytes / 2 ** 20:>10.1f}   {rule} ({cost * 1e6:.1f} us/row)")
+        # Memory held until the end of the run and batches of the data structures generated at the same time
+        batches = sorted((estimate.batch_bytes for estimate in estimates), reverse=True)[:max(max_workers, 1)]
+        print(f"Total: ~{schedule_seconds(order, estimates, max_workers, shards, pipelined):.1f} s, "
+              f"peak memory ~{(sum(estimate.memory_bytes for estimate in estimates) + sum(batches)) / 2 ** 20:.1f} MB, "
+              f"output ~{sum(estimate.output_bytes for estimate in estimates) / 2 ** 20:.1f} MB ({self.storage_options['snapshot_format']})")
+        print("===============================")
+
+    def fuse_sheets(self, generate_dict: Dict[str, int], shards: Dict[str, int]) -> None:
+        """Sheets marked with "fused" in the configuration are generated together with the only table they are built from,
+        from its batches as they are generated (see SQLDAO.fuse). Other sheets read rows of their dependencies back from storage
+
+        A sheet can be fused if its only dependency is a table generated in this run, neither of them is generated in shards
+        and the sheet maps only columns generated by the table (not assigned by the database). Resumed runs fuse nothing
+        (rows of tables generated before the crash are read back from storage)
+        """
+        if self.run_checkpoint is not None:
+            return
+        for name, sheet_config in self.config["Sheets"].items():
+            if not sheet_config.get("fused") or name not in generate_dict:
+                continue
+            sheet = self.data_storage[name]
+            parent = self.data_storage.get(sheet.dependency[0]) if len(sheet.dependency) == 1 else None
+            if (not isinstance(parent, SQLDAO) or parent.name not in generate_dict or parent.has_been_generated()
+                    or shards.get(name, 1) > 1 or shards.get(parent.name, 1) > 1
+                    or not set(sheet.mapping[parent.name].values()) <= set(parent.get_row_plan().columns)):
+                METRICS.progress(name, "not fused, rows of its dependency are read back from storage")
+                continue
+            parent.fuse(sheet, generate_dict[name])
+
+    def generate_data(self, generate_dict: Dict[str, int], max_workers: int = 1, shards: Optional[Dict[str, int]] = None) -> Self:
+        """Function to queue DAOs in a correct way (each one starts as soon as all of its dependencies are generated)
 
         Args:
             generate_dict (Dict[str, int]): Dict consisting of DAOs names and number of entries to generate for them
+            max_workers (int, optional): How many DAOs can be generated at the same time. Defaults to 1.
+            shards (Optional[Dict[str, int]], optional): DAOs names and number of processes generating each of them. Defaults to None.
+
+        Raises:
+            ValueError: When amounts of data do not meet constraints, the run cannot be sharded / resumed
+            DependencyError: When a dependency is missing or dependencies form a cycle
+        """
+        shards = shards or {}
+        if any(count > 1 for count in shards.values()) and self.engine is None:
+            # Processes of shards share rows only through the database
+            raise ValueError("Generation in shards needs a database (SQL_URL), tables kept in memory are generated in one process")
+        if self.run_checkpoint is not None and any(count > 1 for count in shards.values()):
+            raise ValueError("Generation in shards cannot be resumed, resume the run without shards")
+        for name, count in shards.items():
+            data_access = self.data_storage.get(name)
+            # Processes of shards do not share used keys, only keys unique by construction (counters of rows) never collide
+            if count > 1 and isinstance(data_access, SQLDAO) and data_access.is_primary_key_generated() and data_access.get_unique_key_rule() is None:
+                raise ValueError(f"{name} cannot be generated in shards, its primary key is not generated by a unique key rule")
+        # Validate the data to be generated
+        self.validate_dict(generate_dict)
+        if self.run_checkpoint is not None:
+            self.prepare_resume()
+        elif self.checkpoint_every > 0 and self.engine is not None and not any(count > 1 for count in shards.values()):
+            # What is needed to continue the run if it crashes (processes of shards write no checkpoints, so such runs cannot be resumed)
+            key_offsets = {name: data.key_offset for name, data in self.data_storage.items() if getattr(data, "key_offset", None) is not None}
+            write_checkpoint(self.path_to_save, RUN_CHECKPOINT, {"seed": self.seed, "base": self.base_snapshot, "generate_dict": generate_dict,
+                                                                 "storage_options": self.storage_options, "key_offsets": key_offsets})
+        # Fused sheets are generated by their tables, the scheduler finds them generated already
+        self.fuse_sheets(generate_dict, shards)
+        def generate(data_access) -> None:
+            # Data storages generated earlier still count as fulfilled dependencies
+            if data_access.has_been_generated():
+                return
+            checkpoint = read_checkpoint(self.path_to_save, data_access.name) if self.run_checkpoint is not None else None
+            if checkpoint is not None:
+                data_access.resume(checkpoint)
+            elif shards.get(data_access.name, 1) > 1:
+                generate_sharded(data_access, generate_dict[data_access.name], shards[data_access.name], self.config, self.engine, self.path_to_save,
+                                 storage_options=self.storage_options, engine_options=self.engine_options)
+            else:
+                data_access.generate(generate_dict[data_access.name])
+        run_in_dependency_order(list(self.data_storage.values()), generate, max_workers)
+        return self
+
+    def prepare_resume(self) -> None:
+        """Restores state of the interrupted run that data storages do not keep in their own checkpoints: key offsets of tables
+        and keys of rows in the database (used by tables not generated before the crash)
         """
-        try:
-            # Validate the data to be generated
-            self.validate_dict(generate_dict)
-            # Sort the order of generation by the dependency
-            generation_order = sorted(list(self.data_storage.values()), key=lambda x: len(x.dependency))
-            idx = 0
-            # Keep track of how many storages have been generated
-            generated = 0
-            # Iterate through generation order until all data storages have been generated
-            while generated < len(generation_order):
-                data_access = generation_order[idx]
-                # Check if the data has already been generated
-                # Check if this data storage is either:
-                #        not dependent on any other data storage
-                #        all dependencies have been already generated
-                if not data_access.has_been_generated() and (data_access.is_not_dependent() or data_access.is_dependency_fulfilled(generation_order)):
-                    data_access.generate(generate_dict[data_access.name])
-                    generated += 1
-                idx += 1
-                # We are out of bounds
-                if idx >= len(generation_order):
-                    # Reset index to iterate through whole list again
-                    idx = 0
-            return self
-        except ValueError:
-            traceback.print_exc()
-
-
-def from_nothing(path_to_config: str) -> None:
-    generation_dict = {}
+        for name, offset in self.run_checkpoint["key_offsets"].items():
+            self.data_storage[name].key_offset = offset
+        for name, data_access in self.data_storage.items():
+            if isinstance(data_access, SQLDAO) and read_checkpoint(self.path_to_save, name) is None:
+                data_access.load_primary_keys()
+
+
+def ask_generation_dict(names: List[str], message: str = "Provide amount of data to be generated") -> Dict[str, int]:
+    """Asks for the amount of data of every data structure (in the order of the json configuration)
+    """
     print("===============================")
-    print("Provide amount of data to be generated")
-    generation_dict["Examiner"] = int(input("Examiner : "))
-    generation_dict["Candidate"] = int(input("Candidate : "))
-    generation_dict["Vehicle"] = int(input("Vehicle : "))
-    generation_dict["Exam"] = int(input("Exam : "))
-    generation_dict["Reservations"] = int(input("Reservations : "))
-    generation_dict["Examiners"] = int(input("Examiners : "))
+    print(message)
+    generation_dict = {name: int(input(f"{name} : ")) for name in names}
     print("===============================")
-    DataGenerator(path_to_config).generate_data(generation_dict).save_to_file()
+    return generation_dict
+
+
+def from_nothing(path_to_config: str, max_workers: int = 1, shards: Optional[Dict[str, int]] = None,
+                 export_options: Optional[Dict[str, Any]] = None, generation_dict: Optional[Dict[str, int]] = None, **generator_options) -> None:
+    generator = DataGenerator(path_to_config, **generator_options)
+    generation_dict = generation_dict or ask_generation_dict(list(generator.data_storage))
+    generator.generate_data(generation_dict, max_workers, shards) \
+        .save_to_file(max_workers=max_workers, **(export_options or {}))
+
+
+def preloaded(path_to_config: str, max_workers: int = 1, shards: Optional[Dict[str, int]] = None,
+              export_options: Optional[Dict[str, Any]] = None, generation_dict: Optional[Dict[str, int]] = None, **generator_options) -> None:
+    generator = DataGenerator(path_to_config, **generator_options)
+    generation_dict = generation_dict or ask_generation_dict(list(generator.data_storage), "Provide amount of data to be generated on top of previous data")
+    generator.load_from_folder(max_workers=max_workers).generate_data(generation_dict, max_workers, shards) \
+        .save_to_file(max_workers=max_workers, **(export_options or {}))
+
+
+def estimated(path_to_config: str, max_workers: int = 1, shards: Optional[Dict[str, int]] = None,
+              generation_dict: Optional[Dict[str, int]] = None, sample_rows: int = 1000, **generator_options) -> None:
+    generator = DataGenerator(path_to_config, dry_run=True, **generator_options)
+    generator.estimate(generation_dict or ask_generation_dict(list(generator.data_storage)), max_workers, shards, sample_rows)
+
+
+def parse_engine_option(option: str) -> Tuple[str, Any]:
+    """Splits KEY=VALUE of --engine-option, value is read as json (numbers, booleans) or kept as a string
+    """
+    key, value = option.split("=", 1)
+    try:
+        return key, json.loads(value)
+    except json.JSONDecodeError:
+        return key, value
 
 
-def preloaded(path_to_config: str) -> None:
-    generation_dict = {}
+def resumed(path_to_config: str, max_workers: int = 1, shards: Optional[Dict[str, int]] = None,
+            export_options: Optional[Dict[str, Any]] = None, **generator_options) -> None:
     print("===============================")
-    print("Provide amount of data to be generated on top of previous data")
-    generation_dict["Examiner"] = int(input("Examiner : "))
-    generation_dict["Candidate"] = int(input("Candidate : "))
-    generation_dict["Vehicle"] = int(input("Vehicle : "))
-    generation_dict["Exam"] = int(input("Exam : "))
-    generation_dict["Reservations"] = int(input("Reservations : "))
-    generation_dict["Examiners"] = int(input("Examiners : "))
+    print("Resuming the last interrupted run")
     print("===============================")
-    DataGenerator(path_to_config).load_from_folder().generate_data(generation_dict).save_to_file()
+    generator = DataGenerator(path_to_config, resume=True, **generator_options)
+    generator.generate_data(generator.run_checkpoint["generate_dict"], max_workers, shards) \
+        .save_to_file(max_workers=max_workers, **(export_options or {}))
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generation of data for provided structures specified in .json file")
     parser.add_argument("--config", type=str, default="tables.json", help="Path to .json file with all configuration, for more information on structure, please refer to README")
     parser.add_argument("--load", action="store_true", help="Boolean value that specifies if you want to generate from nothing or load already generated data. Data to be loaded should be in DataGenerator/data/snapshot/")
+    parser.add_argument("--max-workers", type=int, default=1, help="How many independent data structures can be generated / loaded at the same time")
+    parser.add_argument("--shards", type=str, action="append", default=[], help="NAME=N, generate data structure NAME in N processes (can be repeated)")
+    parser.add_argument("--batch-size", type=int, default=None, help="Amount of rows inserted at once into the database")
+    parser.add_argument("--snapshot-format", type=str, default="csv", choices=list(SNAPSHOT_FORMATS), help="Format of snapshot files, parquet and arrow keep column types from the .json schema (require pyarrow)")
+    parser.add_argument("--compression", type=str, default="zstd", help="Compression of parquet / arrow snapshot files (e.g. zstd, lz4, none)")
+    parser.add_argument("--backend", type=str, default=None, choices=["sql", "memory"], help="Where tables are generated: database of SQL_URL or memory (no database, files are written straight from generated batches, requires pyarrow). Defaults to sql if SQL_URL is set, memory otherwise")
+    parser.add_argument("--spill-path", type=str, default=None, help="Folder that tables generated in memory are spilled into (as memory-mapped Arrow files)")
+    parser.add_argument("--csv-compression", type=str, default="none", choices=["none"] + list(CSV_COMPRESSIONS), help="Compression of csv snapshot files (zstd requires pyarrow)")
+    parser.add_argument("--export-fetch-size", type=int, default=10000, help="Amount of rows fetched at once from the database while tables are saved into the snapshot")
+    parser.add_argument("--max-part-rows", type=int, default=None, help="Split saved tables into part files of at most N rows (one file per table by default)")
+    parser.add_argument("--resume", action="store_true", help="Continue the last interrupted run (in its snapshot folder, with its seed and amounts of data) from its checkpoints")
+    parser.add_argument("--checkpoint-every", type=int, default=10, help="Every data structure saves its progress after N batches, so that a crashed run can be resumed (0 -> no checkpoints)")
+    parser.add_argument("--batch-memory-mb", type=int, default=64, help="Amounts of rows inserted / fetched at once are tuned while they run by measured latency and rows/s, within this memory per batch (0 -> fixed sizes, batches of generation and their seeds never change)")
+    parser.add_argument("--pool-size", type=int, default=None, help="Connections kept by the pool of the engine (defaults to 2 per worker, at least 5)")
+    parser.add_argument("--max-overflow", type=int, default=None, help="Connections opened over the pool size when all are used (default of sqlalchemy, 10)")
+    parser.add_argument("--pool-pre-ping", action="store_true", help="Check connections before they are used (servers that close idle connections)")
+    parser.add_argument("--engine-option", type=str, action="append", default=[], help="KEY=VALUE, other option of sqlalchemy.create_engine (value read as json if possible), e.g. insertmanyvalues_page_size=5000 (can be repeated)")
+    parser.add_argument("--seed", type=int, default=None, help="Seed of the run, the same seed (and batch size) generates the same data, also in parallel and in shards")
+    parser.add_argument("--metrics", type=str, nargs="*", default=["log"], choices=["log", "json", "prometheus"], help="Where progress, timers and counters of every data structure are reported: structured log (default), metrics.json next to the snapshot, Prometheus textfile. Data structures print nothing themselves, --metrics without a value silences them")
+    parser.add_argument("--prometheus-textfile", type=str, default=None, help="Path of the Prometheus textfile (metrics.prom next to the snapshot by default)")
+    parser.add_argument("--pipeline-depth", type=int, default=2, help="How many generated batches of a data structure may wait while previous ones are inserted / written (0 -> generate and write one after another)")
+    parser.add_argument("--spec", type=str, default=None, help="Path to .json generation spec: scale_factor and / or counts of data structures (see README), the run asks for nothing")
+    parser.add_argument("--scale-factor", type=float, default=None, help="Amount of every data structure is its ratio in the .json configuration times F (overrides scale_factor of the spec), the run asks for nothing")
+    parser.add_argument("--dry-run", action="store_true", help="Only print amounts of data, order of generation and estimated time, memory and size of the run (rules are measured on sample rows, nothing is stored)")
+    parser.add_argument("--sample-rows", type=int, default=1000, help="Rows of every data structure generated to measure costs of rules by --dry-run")
+    parser.add_argument("--profile", type=int, default=0, help="Profile every data structure with cProfile and report N hottest functions of each")
 
     args = parser.parse_args()
-    if args.load:
-        preloaded(args.config)
+    shards = {name: int(count) for name, count in (shard.split("=") for shard in args.shards)}
+    sinks = {"log": LogSink, "json": JSONSummarySink, "prometheus": lambda: PrometheusTextfileSink(args.prometheus_textfile)}
+    if "log" in args.metrics:
+        logging.basicConfig(level=logging.INFO, format="%(message)s")
+    generator_options = {
+        "batch_size": args.batch_size,
+        "snapshot_format": args.snapshot_format,
+        "compression": args.compression,
+        # Profiles are reported through sinks, json summary is used if none was chosen
+        "metrics_sinks": [sinks[sink]() for sink in args.metrics] or ([JSONSummarySink()] if args.profile else []),
+        "profile_top": args.profile,
+        "seed": args.seed,
+        "pipeline_depth": args.pipeline_depth,
+        "csv_compression": args.csv_compression,
+        "backend": args.backend,
+        "spill_path": args.spill_path,
+        "checkpoint_every": args.checkpoint_every,
+        "batch_memory_mb": args.batch_memory_mb,
+        # Every DAO worker holds a connection, sheets one more per dependency they read
+        "engine_options": {"pool_size": args.pool_size or max(5, 2 * args.max_workers), "max_overflow": args.max_overflow,
+                           "pool_pre_ping": args.pool_pre_ping, **dict(parse_engine_option(option) for option in args.engine_option)},
+    }
+    export_options = {"fetch_size": args.export_fetch_size, "max_part_rows": args.max_part_rows}
+    # Amounts of data given by the spec / scale factor, None -> they are asked for
+    generation_dict = None
+    if args.spec is not None or args.scale_factor is not None:
+        spec = load_spec(args.spec) if args.spec is not None else {}
+        with open(args.config, "r") as file:
+            config = json.load(file)
+        generation_dict = resolve_counts(config, args.scale_factor if args.scale_factor is not None else spec.get("scale_factor"), spec.get("counts"))
+    if args.dry_run:
+        estimated(args.config, args.max_workers, shards, generation_dict, args.sample_rows, **generator_options)
+    elif args.resume:
+        resumed(args.config, args.max_workers, shards, export_options, **generator_options)
+    elif args.load:
+        preloaded(args.config, args.max_workers, shards, export_options, generation_dict, **generator_options)
     else:
-        from_nothing(args.config)
\ No newline at end of file
+        from_nothing(args.config, args.max_workers, shards, export_options, generation_dict, **generator_options)
@@ -1,38 +1,78 @@
 from datetime import datetime, time, timedelta
-from scipy.stats import norm
-from typing import Optional
+from statistics import NormalDist
+from typing import Optional, List
+import numpy as np
 
 
 class HourGenerator:
     @staticmethod
-    def generate_hours(begin: int, end: int, format: str):
+    def generate_hours(begin: int, end: int, format: str, rng: Optional[np.random.Generator] = None):
         """Function generating hours (tailored to yield 2 hour variables that are some time apart)
         It is important that when you want to generate 2 columns with hours, you place them in such order (earlier hour, later hour)
         """
-        while (begin_h := norm(loc=13, scale=3).rvs(1)[0]) < begin or begin_h > end:
+        rng = rng if rng is not None else np.random.default_rng()
+        while (begin_h := rng.normal(loc=13, scale=3)) < begin or begin_h > end:
             pass
         hours = int(begin_h)
         minutes = int((begin_h - hours) * 60)
         begin_time = time(hour=hours, minute=minutes)
         while True:
             yield begin_time.strftime(format)
-            duration = norm(loc=45, scale=10).rvs(1)[0]
+            duration = rng.normal(loc=45, scale=10)
             end_time = timedelta(minutes=int(duration))
             begin_time = (datetime.combine(datetime.today(), begin_time) + end_time).time()
 
-    def __init__(self, /, reset_limit: Optional[int] = 2, begin: Optional[int] = 8, end: Optional[int] = 18, format: Optional[str] = "%H:%M"):
+    def __init__(self, /, reset_limit: Optional[int] = 2, begin: Optional[int] = 8, end: Optional[int] = 18, format: Optional[str] = "%H:%M",
+                 rng: Optional[np.random.Generator] = None):
         self.limit = reset_limit
         self.count = 0
         self.func = HourGenerator.generate_hours
         self.begin_arg = begin
         self.end_arg = end
         self.format = format
-        self.func_gen = self.func(self.begin_arg, self.end_arg, self.format)
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.func_gen = self.func(self.begin_arg, self.end_arg, self.format, self.rng)
+        # Every minute of a day formatted, so that sampled times only need to be looked up
+        self.formatted_minutes = np.array([time(hour=minute // 60, minute=minute % 60).strftime(self.format) for minute in range(24 * 60)])
+
+    def set_rng(self, rng: np.random.Generator) -> None:
+        """Replaces the random generator and starts a new sequence of hours, so that the next hours depend only on rng
+        """
+        self.rng = rng
+        self.count = 0
+        self.func_gen = self.func(self.begin_arg, self.end_arg, self.format, self.rng)
+
+    def sample(self, n: int) -> List[List[str]]:
+        """Generates n sequences of reset_limit hours at once (e.g. n pairs of begin and end hour),
+        following the same distribution as consecutive calls without any rejection loop
+
+        Args:
+            n (int): Amount of sequences to generate
+
+        Returns:
+            List[List[str]]: reset_limit lists of n formatted hours, ith list holds ith hour of every sequence
+        """
+        # scipy is slow to import, so it is imported only once hours are sampled
+        from scipy.special import ndtri
+        # Begin hour from N(13, 3) truncated to <begin;end>, drawn through the inverse of its CDF
+        distribution = NormalDist(mu=13, sigma=3)
+        low, high = distribution.cdf(self.begin_arg), distribution.cdf(self.end_arg)
+        begin_h = 13 + 3 * ndtri(self.rng.uniform(low, high, size=n))
+        hours = begin_h.astype(int)
+        minutes = ((begin_h - hours) * 60).astype(int)
+        minute_of_day = hours * 60 + minutes
+        sequences = [minute_of_day]
+        for _ in range(self.limit - 1):
+            # Each next hour is shifted by int(N(45, 10)) minutes, wrapping around midnight
+            duration = self.rng.normal(loc=45, scale=10, size=n).astype(int)
+            minute_of_day = (minute_of_day + duration) % (24 * 60)
+            sequences.append(minute_of_day)
+        return [self.formatted_minutes[sequence].tolist() for sequence in sequences]
 
     def __next__(self):
         if self.count == self.limit:
             self.count = 0
-            self.func_gen = self.func(self.begin_arg, self.end_arg, self.format)
+            self.func_gen = self.func(self.begin_arg, self.end_arg, self.format, self.rng)
         self.count += 1
         return next(self.func_gen)
         
@@ -0,0 +1,255 @@
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+
+logger = logging.getLogger("data_generator.metrics")
+
+
+class Metrics:
+    """Timers and counters of every data storage (and of every column generated by RuleBook)
+
+    Measurements are attributed to the data storage whose scope is open in the current thread,
+    so that code shared by all DAOs (like RuleBook) does not have to know which DAO it works for
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        # {"dao_name": {"stage": [seconds, calls]}}
+        self.timers = {}
+        # {"dao_name": {"counter": value}}
+        self.counters = {}
+        # {"dao_name": {"action": [{"function": ..., "calls": ..., "tottime": ..., "cumtime": ...}]}}
+        self.profiles = {}
+        self.sinks = []
+        # Amount of hot functions dumped per data storage, 0 disables profiling
+        self.profile_top = 0
+
+    def configure(self, sinks: Optional[List["MetricsSink"]] = None, profile_top: int = 0) -> None:
+        self.sinks = sinks or []
+        self.profile_top = profile_top
+
+    def reset(self) -> None:
+        with self.lock:
+            self.timers, self.counters, self.profiles = {}, {}, {}
+
+    def current_scope(self) -> str:
+        return getattr(self.local, "scope", None) or "global"
+
+    @contextmanager
+    def scope(self, name: str, action: str) -> Iterator[None]:
+        """Attributes all measurements of the block to the data storage name, and measures the block itself as action
+
+        Args:
+            name (str): Name of the data storage
+            action (str): What is done with it (generate, load, save)
+        """
+        previous = getattr(self.local, "scope", None)
+        self.local.scope = name
+        profiler = self.start_profiler()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, action, time.perf_counter() - start)
+            self.stop_profiler(name, action, profiler)
+            self.local.scope = previous
+            if self.sinks:
+                self.emit({"event": "finished", "storage": name, "action": action, **self.summary().get(name, {})})
+
+    @contextmanager
+    def bind(self, name: str) -> Iterator[None]:
+        """Attributes measurements of the block to the data storage name without measuring the block
+        (used by threads working for a data storage whose scope is open in another thread)
+        """
+        previous = getattr(self.local, "scope", None)
+        self.local.scope = name
+        try:
+            yield
+        finally:
+            self.local.scope = previous
+
+    @contextmanager
+    def timer(self, stage: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(self.current_scope(), stage, time.perf_counter() - start)
+
+    def add_time(self, name: str, stage: str, seconds: float, calls: int = 1) -> None:
+        with self.lock:
+            timer = self.timers.setdefault(name, {}).setdefault(stage, [0.0, 0])
+            timer[0] += seconds
+            timer[1] += calls
+
+    def count(self, counter: str, value: int = 1, name: Optional[str] = None) -> None:
+        name = name or self.current_scope()
+        with self.lock:
+            counters = self.counters.setdefault(name, {})
+            counters[counter] = counters.get(counter, 0) + value
+
+    def batch_done(self, rows: int, total: int) -> None:
+        """Counts rows of a finished batch and reports progress of the current data storage
+        """
+        self.count("rows", rows)
+        self.count("batches")
+        self.emit({"event": "batch", "storage": self.current_scope(), "rows": rows, "total": total})
+
+    def progress(self, name: str, message: str, **fields: Any) -> None:
+        """Reports what happened to the data storage name (resumed, loaded, ...) through the sinks, which are the only
+        output of data storages (workers generating at the same time never print over each other)
+        """
+        self.emit({"event": "progress", "storage": name, "message": message, **fields})
+
+    def start_profiler(self) -> Optional[cProfile.Profile]:
+        if not self.profile_top:
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already active (data storages profiled at the same time)
+            return None
+        return profiler
+
+    def stop_profiler(self, name: str, action: str, profiler: Optional[cProfile.Profile]) -> None:
+        if profiler is None:
+            return
+        profiler.disable()
+        stats = pstats.Stats(profiler, stream=io.StringIO()).sort_stats("cumulative")
+        top = []
+        for (filename, line, function) in stats.fcn_list[:self.profile_top]:
+            calls, _, tottime, cumtime, _ = stats.stats[(filename, line, function)]
+            top.append({"function": f"{os.path.basename(filename)}:{line}({function})", "calls": calls,
+                        "tottime": round(tottime, 6), "cumtime": round(cumtime, 6)})
+        with self.lock:
+            self.profiles.setdefault(name, {})[action] = top
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """Measurements of every data storage, with rows/s counted over the time of its generate / load actions
+        """
+        with self.lock:
+            summary = {}
+            for name in sorted(set(self.timers) | set(self.counters)):
+                stages = {stage: {"seconds": round(seconds, 6), "calls": calls} for stage, (seconds, calls) in self.timers.get(name, {}).items()}
+                counters = dict(self.counters.get(name, {}))
+                seconds = sum(stages.get(action, {}).get("seconds", 0.0) for action in ("generate", "load"))
+                summary[name] = {
+                    "rows": counters.get("rows", 0),
+                    "rows_per_second": round(counters.get("rows", 0) / seconds, 2) if seconds else None,
+                    "stages": stages,
+                    "counters": counters,
+                }
+                if name in self.profiles:
+                    summary[name]["profile"] = dict(self.profiles[name])
+            return summary
+
+    def merge(self, summary: Dict[str, Dict[str, Any]]) -> None:
+        """Adds measurements made in another process (e.g. by a shard worker)
+        """
+        for name, content in summary.items():
+            for stage, timer in content["stages"].items():
+                self.add_time(name, stage, timer["seconds"], timer["calls"])
+            for counter, value in content["counters"].items():
+                self.count(counter, value, name)
+
+    def emit(self, event: Dict[str, Any]) -> None:
+        for sink in self.sinks:
+            sink.event(event)
+
+    def export(self, snapshot: Optional[str] = None) -> None:
+        """Passes the summary to every sink
+
+        Args:
+            snapshot (Optional[str], optional): Folder of the snapshot, sinks write their files there. Defaults to None.
+        """
+        summary = self.summary()
+        for sink in self.sinks:
+            sink.export(summary, snapshot)
+
+
+class MetricsSink:
+    """Receives live events (finished batches / actions) and the final summary
+    """
+    def event(self, event: Dict[str, Any]) -> None:
+        pass
+
+    def export(self, summary: Dict[str, Dict[str, Any]], snapshot: Optional[str] = None) -> None:
+        pass
+
+
+class LogSink(MetricsSink):
+    """Structured log: every event and summary of every data storage is logged as one JSON line
+    """
+    def __init__(self, log: Optional[logging.Logger] = None, level: int = logging.INFO):
+        self.log = log or logger
+        self.level = level
+
+    def event(self, event: Dict[str, Any]) -> None:
+        # Progress of batches is only interesting while debugging
+        self.log.log(logging.DEBUG if event["event"] == "batch" else self.level, json.dumps(event, default=str))
+
+    def export(self, summary: Dict[str, Dict[str, Any]], snapshot: Optional[str] = None) -> None:
+        for name, content in summary.items():
+            self.log.log(self.level, json.dumps({"event": "summary", "storage": name, **content}, default=str))
+
+
+class JSONSummarySink(MetricsSink):
+    """JSON file with the whole summary, written into the folder of the snapshot
+    """
+    def __init__(self, filename: str = "metrics.json"):
+        self.filename = filename
+
+    def export(self, summary: Dict[str, Dict[str, Any]], snapshot: Optional[str] = None) -> None:
+        path = os.path.join(snapshot or os.getcwd(), self.filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as file:
+            json.dump(summary, file, indent=2)
+
+
+class PrometheusTextfileSink(MetricsSink):
+    """File in the format of the textfile collector of Prometheus node exporter
+    """
+    def __init__(self, path: Optional[str] = None, prefix: str = "data_generator"):
+        """
+        Args:
+            path (Optional[str], optional): Path of the .prom file. Defaults to None (metrics.prom in the folder of the snapshot).
+            prefix (str, optional): Prefix of metric names. Defaults to "data_generator".
+        """
+        self.path = path
+        self.prefix = prefix
+
+    def export(self, summary: Dict[str, Dict[str, Any]], snapshot: Optional[str] = None) -> None:
+        path = self.path or os.path.join(snapshot or os.getcwd(), "metrics.prom")
+        lines = [
+            f"# HELP {self.prefix}_stage_seconds Time spent in a stage of a data storage",
+            f"# TYPE {self.prefix}_stage_seconds gauge",
+        ]
+        for name, content in summary.items():
+            for stage, timer in content["stages"].items():
+                lines.append(f'{self.prefix}_stage_seconds{{storage="{name}",stage="{stage}"}} {timer["seconds"]}')
+        lines += [f"# HELP {self.prefix}_counter Counters of a data storage (rows, batches, ...)", f"# TYPE {self.prefix}_counter gauge"]
+        for name, content in summary.items():
+            for counter, value in content["counters"].items():
+                lines.append(f'{self.prefix}_counter{{storage="{name}",counter="{counter}"}} {value}')
+        lines += [f"# HELP {self.prefix}_rows_per_second Rows generated / loaded per second", f"# TYPE {self.prefix}_rows_per_second gauge"]
+        for name, content in summary.items():
+            if content["rows_per_second"] is not None:
+                lines.append(f'{self.prefix}_rows_per_second{{storage="{name}"}} {content["rows_per_second"]}')
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Written atomically, so that the collector never reads a half written file
+        with open(path + ".tmp", "w") as file:
+            file.write("\n".join(lines) + "\n")
+        os.replace(path + ".tmp", path)
+
+
+# Shared by all DAOs of the process
+METRICS = Metrics()
@@ -0,0 +1,120 @@
+from abc import ABC, abstractmethod
+from datetime import date
+from typing import List
+
+import math
+import numpy as np
+
+
+class PermutedCounter:
+    """Bijective permutation of <0;size), counter -> (multiplier * counter + offset) mod size
+
+    Multiplier is coprime with size, so no two counters are ever mapped onto the same value
+    """
+    def __init__(self, size: int, seed: int = 0):
+        rng = np.random.default_rng(seed)
+        self.size = size
+        self.offset = int(rng.integers(0, size))
+        # Multiplier far from 1 and size, so that consecutive counters are spread over the whole range
+        self.multiplier = int(rng.integers(size // 3, 2 * size // 3))
+        while math.gcd(self.multiplier, size) != 1:
+            self.multiplier += 1
+
+    def __call__(self, counters: np.ndarray) -> np.ndarray:
+        # Multiplication is split so that it never overflows int64
+        counters = np.asarray(counters, dtype=np.int64) % self.size
+        high, low = divmod(self.multiplier, 1 << 20)
+        return ((counters * high % self.size) * (1 << 20) % self.size + counters * low + self.offset) % self.size
+
+
+class UniqueKeyGenerator(ABC):
+    """Generator of keys that are unique by construction: every counter from <0;size) is mapped
+    through a permutation onto a different, valid key
+    """
+    size: int
+
+    def __init__(self, seed: int = 0):
+        self.permutation = PermutedCounter(self.size, seed)
+
+    @staticmethod
+    def to_strings(codes: np.ndarray) -> List[str]:
+        # Each row of ascii codes becomes one fixed width string
+        codes = np.ascontiguousarray(codes, dtype=np.uint8)
+        return codes.view(f"S{codes.shape[1]}").ravel().astype(f"U{codes.shape[1]}").tolist()
+
+    @staticmethod
+    def to_digits(numbers: np.ndarray, width: int) -> np.ndarray:
+        return (numbers[:, None] // 10 ** np.arange(width - 1, -1, -1, dtype=np.int64)) % 10
+
+    @abstractmethod
+    def encode(self, values: np.ndarray) -> List[str]:
+        """Maps values from <0;size) onto keys, different values always give different keys
+        """
+        pass
+
+    def generate(self, counters: np.ndarray) -> List[str]:
+        """Generates keys for given counters, different counters always give different keys
+
+        Args:
+            counters (np.ndarray): Counters from <0;size)
+
+        Raises:
+            ValueError: When a counter is out of the key space
+
+        Returns:
+            List[str]: Generated keys
+        """
+        counters = np.asarray(counters, dtype=np.int64)
+        if len(counters) and (counters.min() < 0 or counters.max() >= self.size):
+            raise ValueError(f"{type(self).__name__} can generate only {self.size} unique keys")
+        return self.encode(self.permutation(counters))
+
+
+class PeselKeyGenerator(UniqueKeyGenerator):
+    """PESEL: YYMMDD (century encoded in month) + 4 digit serial + check digit
+    """
+    first_day = date(1910, 1, 1)
+    days = (date(2024, 12, 31) - first_day).days + 1
+    size = days * 10000
+
+    def __init__(self, seed: int = 0):
+        super().__init__(seed)
+        # YYMMDD code of every date of birth (computed on arrays, RuleBooks are created often)
+        birth_dates = np.datetime64(self.first_day, "D") + np.arange(self.days)
+        months = birth_dates.astype("datetime64[M]")
+        year = months.astype("datetime64[Y]").astype(np.int64) + 1970
+        month = months.astype(np.int64) % 12 + 1
+        day = (birth_dates - months.astype("datetime64[D]")).astype(np.int64) + 1
+        self.date_codes = (year % 100) * 10000 + (month + np.where(year >= 2000, 20, 0)) * 100 + day
+
+    def encode(self, values: np.ndarray) -> List[str]:
+        day, serial = np.divmod(values, 10000)
+        digits = UniqueKeyGenerator.to_digits(self.date_codes[day] * 10000 + serial, 10)
+        check = (digits @ np.array([9, 7, 3, 1, 9, 7, 3, 1, 9, 7])) % 10
+        return UniqueKeyGenerator.to_strings(np.column_stack([digits, check]) + ord("0"))
+
+
+class IdentityCardKeyGenerator(UniqueKeyGenerator):
+    """Polish identity card number: 3 letters + check digit + 5 digits
+    """
+    size = 26 ** 3 * 10 ** 5
+
+    def encode(self, values: np.ndarray) -> List[str]:
+        letters, number = np.divmod(values, 10 ** 5)
+        letters = np.column_stack([letters // 676, letters // 26 % 26, letters % 26])
+        digits = UniqueKeyGenerator.to_digits(number, 5)
+        # Letters count as 10 (A) to 35 (Z) in the checksum
+        check = (letters + 10) @ np.array([7, 3, 1]) + digits @ np.array([7, 3, 1, 7, 3])
+        return UniqueKeyGenerator.to_strings(np.column_stack([letters + ord("A"), check % 10 + ord("0"), digits + ord("0")]))
+
+
+class RegistrationKeyGenerator(UniqueKeyGenerator):
+    """Registration number: 2 letters + 6 digits
+    """
+    size = 26 ** 2 * 10 ** 6
+
+    def encode(self, values: np.ndarray) -> List[str]:
+        letters, number = np.divmod(values, 10 ** 6)
+        letters = np.column_stack([letters // 26, letters % 26])
+        digits = UniqueKeyGenerator.to_digits(number, 6)
+        return UniqueKeyGenerator.to_strings(np.column_stack([letters + ord("A"), digits + ord("0")]))
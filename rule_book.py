@@ -1,85 +1,341 @@
-from typing import Any, Optional
-from faker import Faker
-import random
-from scipy.stats import norm
+from typing import Any, Optional, List, Dict, Callable
+import numpy as np
 from datetime import time, datetime, timedelta
 
 import re
+import threading
 import warnings
+import zlib
 
 from hours_generator import HourGenerator
 from date_generator import DateGenerator
+from key_generators import UniqueKeyGenerator, PeselKeyGenerator, IdentityCardKeyGenerator, RegistrationKeyGenerator
+from instrumentation import METRICS
+
+# Whitespace removed from values of single value rules
+WHITESPACE = re.compile(r"[\s]+")
+
+def derive_seed(seed: int, *keys: Any) -> int:
+    """Derives a stable sub-seed (e.g. of one batch of one table) from the seed of the run
+
+    Keys are hashed with crc32 (hash() of strings changes between processes), so the same keys give the same sub-seed in every run and process
+
+    Args:
+        seed (int): Seed of the run
+        keys (Any): Path of the sub-seed, e.g. name of the table and index of the first row of the batch
+
+    Returns:
+        int: Sub-seed, usable by Faker and NumPy
+    """
+    spawn_key = tuple(key if isinstance(key, int) else zlib.crc32(str(key).encode()) for key in keys)
+    return int(np.random.SeedSequence(seed, spawn_key=spawn_key).generate_state(1, np.uint64)[0])
+
 
 class RuleBook:
     """Class that implements all rules for generation of values
     """
-    def __init__(self, localization: str = "en_US"):
-        fake = Faker(locale=localization)
+    def __init__(self, localization: str = "en_US", pools: Optional[Dict[str, Any]] = None):
+        self.localization = localization
+        # Pools of values of expensive rules {"rule": ValuePool}, values of these rules are drawn from their pools (see value_pools)
+        self.pools = pools or {}
+        # Faker (and its providers) is created on first use of a rule that needs it, see fake
+        self._fake = None
+        self.fake_seed = None
+        # Random generator used by batch (vectorized) rules
+        self.rng = np.random.default_rng()
 
         self.config = {
             "date_format": "%Y-%m-%d",
             "time_format": "%H:%M:%S"
         }
         # Generators to apply a kind of a trend into data
-        self.hour_generator = HourGenerator(reset_limit=2, begin=8, end=18, format=self.config["time_format"])
-        self.date_generator = DateGenerator(begin_year=2022, end_year=2025, format=self.config["date_format"])
+        self.hour_generator = HourGenerator(reset_limit=2, begin=8, end=18, format=self.config["time_format"], rng=self.rng)
+        self.date_generator = DateGenerator(begin_year=2022, end_year=2025, format=self.config["date_format"], rng=self.rng)
+        # Elements shared by single value rules and their batch counterparts
+        brands = ["Toyota", "Suzuki", "Renault", "Ford", "Opel", "Skoda", "Kia", "Volkswagen"]
+        car_types = ["car", "truck", "motorcycle"]
+        categories = ["AM", "A1", "A2", "B1", "B", "B+E" , "C", "C+E"]
         # TODO pomyslec jak zmienic to na cos ładniejszego
         # Each column name have a certain value presented by a tuple (value generator, index)
         # if index = -1 -> we want the whole output
         # if index = 0/1/2/... -> we want to split the output by spaces and retrieve only the ith element
         self.rules = {
-        "name": (fake.first_name, -1), 
-        "secondname": (fake.last_name, -1),
-        "surname": (fake.last_name, -1), 
-        "lastname": (fake.last_name, 1),
-        "pesel": (fake.pesel, -1),
-        "address": (fake.address, -1),
-        "telephonenumber": (fake.phone_number, -1), 
-        "telephonenum": (fake.phone_number, -1), 
-        "phonenumber": (fake.phone_number, -1), 
-        "phonenum": (fake.phone_number, -1),
-        "licensenumber": (fake.identity_card_number, -1),
-        "gearbox": (lambda : int(fake.boolean(70)), -1),
-        "brand": (lambda : fake.random_element(elements = ["Toyota", "Suzuki", "Renault", "Ford", "Opel", "Skoda", "Kia", "Volkswagen"]), -1),
-        "cartype": (lambda : fake.random_element(elements = ["car", "truck", "motorcycle"]), -1),
-        "inspectiondate": (lambda : fake.date_between(start_date="-1y", end_date="-1w").strftime(self.config["date_format"]), -1),
+        "name": (self.provider("first_name"), -1), 
+        "secondname": (self.provider("last_name"), -1),
+        "surname": (self.provider("last_name"), -1), 
+        "lastname": (self.provider("last_name"), 1),
+        "pesel": (self.provider("pesel"), -1),
+        "address": (self.provider("address"), -1),
+        "telephonenumber": (self.provider("phone_number"), -1), 
+        "telephonenum": (self.provider("phone_number"), -1), 
+        "phonenumber": (self.provider("phone_number"), -1), 
+        "phonenum": (self.provider("phone_number"), -1),
+        "licensenumber": (self.provider("identity_card_number"), -1),
+        "gearbox": (lambda : int(self.fake.boolean(70)), -1),
+        "brand": (lambda : self.fake.random_element(elements = brands), -1),
+        "cartype": (lambda : self.fake.random_element(elements = car_types), -1),
+        "inspectiondate": (lambda : self.fake.date_between(start_date="-1y", end_date="-1w").strftime(self.config["date_format"]), -1),
         "examdate": (self.date_generator, -1),
         "beginhour": (self.hour_generator, -1),
         "endhour": (self.hour_generator, -1),
-        "result": (lambda : int(fake.boolean(70)), -1),
-        "category": (lambda : fake.random_element(elements= ["AM", "A1", "A2", "B1", "B", "B+E" , "C", "C+E"]), -1),
-        "type": (lambda : int(fake.boolean(60)), -1),
-        "examcomment": (lambda : fake.text(max_nb_chars=200), -1),
-        "registrationnumber": (lambda : fake.bothify(text='??######', letters='ABCDEFGHIJKLMNOPQRSTUVWXYZ'), -1),
-        "dateofendofwork": (lambda : fake.date_between(start_date="+1w", end_date="+1y").strftime(self.config["date_format"]), -1),
-        "dateofacceptance": (lambda : fake.date_between(start_date="-5y", end_date="-1w").strftime(self.config["date_format"]), -1),
-        "comments": (lambda : fake.text(20), -1),
-        "examid": (lambda : fake.random_int(min=1, max=10000000), -1),
-        "reservationdate": (lambda : fake.date_between(start_date="-3w").strftime(self.config["date_format"]), -1),
-        "reservationhour": (lambda : fake.time(pattern=self.config["time_format"]), -1),
-        "examtype": (lambda : int(fake.boolean(50)), -1), 
-        "assignedexaminerid": (fake.identity_card_number, -1)
+        "result": (lambda : int(self.fake.boolean(70)), -1),
+        "category": (lambda : self.fake.random_element(elements = categories), -1),
+        "type": (lambda : int(self.fake.boolean(60)), -1),
+        "examcomment": (lambda : self.fake.text(max_nb_chars=200), -1),
+        "registrationnumber": (lambda : self.fake.bothify(text='??######', letters='ABCDEFGHIJKLMNOPQRSTUVWXYZ'), -1),
+        "dateofendofwork": (lambda : self.fake.date_between(start_date="+1w", end_date="+1y").strftime(self.config["date_format"]), -1),
+        "dateofacceptance": (lambda : self.fake.date_between(start_date="-5y", end_date="-1w").strftime(self.config["date_format"]), -1),
+        "comments": (lambda : self.fake.text(20), -1),
+        "examid": (lambda : self.fake.random_int(min=1, max=10000000), -1),
+        "reservationdate": (lambda : self.fake.date_between(start_date="-3w").strftime(self.config["date_format"]), -1),
+        "reservationhour": (lambda : self.fake.time(pattern=self.config["time_format"]), -1),
+        "examtype": (lambda : int(self.fake.boolean(50)), -1), 
+        "assignedexaminerid": (self.provider("identity_card_number"), -1)
     }   
+        # Rules that can be generated for a whole batch at once
+        # Each column name has a function taking amount of values and returning a list of them
+        # They must follow the same distribution as their counterparts in self.rules
+        self.batch_rules = {
+        "gearbox": lambda n: self.boolean_batch(70, n),
+        "brand": lambda n: self.element_batch(brands, n),
+        "cartype": lambda n: self.element_batch(car_types, n),
+        "result": lambda n: self.boolean_batch(70, n),
+        "category": lambda n: self.element_batch(categories, n),
+        "type": lambda n: self.boolean_batch(60, n),
+        "registrationnumber": lambda n: self.bothify_batch("??######", "ABCDEFGHIJKLMNOPQRSTUVWXYZ", n),
+        "examid": lambda n: self.rng.integers(1, 10000000, size=n, endpoint=True).tolist(),
+        "examtype": lambda n: self.boolean_batch(50, n),
+    }
+        # Rules of key columns that can generate unique values by construction (from counters)
+        self.seed_keys(0)
 
-    def generate_column_value(self, column_name_: str) -> Any:
-        # Lowercase whole string
-        column_name = column_name_.lower()
-        # Delete all spaces, _, -, ...
-        column_name = re.sub(r"[\_\-\s]+", "", column_name)
-        try:
-            value = self.rules[column_name]
-            if value[1] == -1:
-                res = value[0]()
-                if isinstance(res, str):
-                    res = re.sub(r"[\s]+", "", res)
-                    return res
-                return res
+    @property
+    def fake(self):
+        if self._fake is None:
+            from faker import Faker
+            self._fake = Faker(locale=self.localization)
+            if self.fake_seed is not None:
+                self._fake.seed_instance(self.fake_seed)
+        return self._fake
+
+    def provider(self, name: str) -> Callable[[], Any]:
+        """Returns function calling Faker provider name, without creating Faker before the rule is used
+        """
+        return lambda: getattr(self.fake, name)()
+
+    def seed_keys(self, key_seed: int) -> None:
+        """Creates unique key generators, generators with the same key seed map counters onto the same keys
+
+        Args:
+            key_seed (int): Seed of permutations of counters
+        """
+        self.key_rules = {
+        "pesel": PeselKeyGenerator(key_seed),
+        "licensenumber": IdentityCardKeyGenerator(key_seed),
+        "registrationnumber": RegistrationKeyGenerator(key_seed),
+    }
+
+    def seed(self, seed: int) -> None:
+        """Seeds every source of randomness used by rules, so that generated values can be reproduced
+
+        Args:
+            seed (int): Seed for Faker and NumPy
+        """
+        self.fake_seed = seed
+        if self._fake is not None:
+            self.fake.seed_instance(seed)
+        self.rng = np.random.default_rng(seed)
+        # Sequence of hours started with the previous generator is dropped as well
+        self.hour_generator.set_rng(self.rng)
+        self.date_generator.rng = self.rng
+
+    @staticmethod
+    def normalize_column_name(column_name: str) -> str:
+        # Lowercase whole string and delete all spaces, _, -, ...
+        return re.sub(r"[\_\-\s]+", "", column_name.lower())
+
+    def boolean_batch(self, chance_of_getting_true: int, n: int) -> List[int]:
+        # Same as int(self.fake.boolean(chance)) -> random integer from <1;100> compared with chance
+        return (self.rng.integers(1, 100, size=n, endpoint=True) <= chance_of_getting_true).astype(int).tolist()
+
+    def element_batch(self, elements: List[Any], n: int) -> List[Any]:
+        return self.rng.choice(elements, size=n).tolist()
+
+    def bothify_batch(self, text: str, letters: str, n: int) -> List[str]:
+        """Vectorized version of fake.bothify, '#' is replaced by a digit and '?' by one of letters
+
+        Args:
+            text (str): Pattern of the value
+            letters (str): Letters to choose from in place of '?'
+            n (int): Amount of values to generate
+
+        Returns:
+            List[str]: Generated values
+        """
+        letter_codes = np.frombuffer(letters.encode("ascii"), dtype=np.uint8)
+        codes = np.empty((n, len(text)), dtype=np.uint8)
+        for position, char in enumerate(text):
+            if char == "#":
+                codes[:, position] = self.rng.integers(ord("0"), ord("9"), size=n, endpoint=True)
+            elif char == "?":
+                codes[:, position] = letter_codes[self.rng.integers(0, len(letter_codes), size=n)]
             else:
-                return value[0]().split(" ")[value[1]]
-        except KeyError:
+                codes[:, position] = ord(char)
+        # Each row of ascii codes becomes one fixed width string
+        return codes.view(f"S{len(text)}").ravel().astype(f"U{len(text)}").tolist()
+
+    def resolve_value_rule(self, column_name_: str) -> Optional[Callable[[], Any]]:
+        """Resolves the single value rule of a column once, so that it can be called for many values
+
+        Args:
+            column_name_ (str): Name of the column
+
+        Returns:
+            Optional[Callable[[], Any]]: Function returning one value, None if there is no rule for the column
+        """
+        column_name = RuleBook.normalize_column_name(column_name_)
+        if column_name in self.pools:
+            pool = self.pools[column_name]
+            return lambda: pool.sample(1, self.rng)[0]
+        if column_name not in self.rules:
+            return None
+        func, index = self.rules[column_name]
+        if index != -1:
+            return lambda: func().split(" ")[index]
+        def generate() -> Any:
+            value = func()
+            return WHITESPACE.sub("", value) if isinstance(value, str) else value
+        return generate
+
+    def generate_column_value(self, column_name_: str) -> Any:
+        if (rule := self.resolve_value_rule(column_name_)) is None:
             warnings.warn(f"{column_name_} not in rules. Change column name or add new rule")
             return None
+        return rule()
+
+    def resolve_rule(self, column_name_: str) -> Optional[Callable[[int], List[Any]]]:
+        """Resolves the rule of a column once, so that it can be applied for many values
+
+        Args:
+            column_name_ (str): Name of the column
+
+        Returns:
+            Optional[Callable[[int], List[Any]]]: Function taking amount of values and returning a list of them,
+            None if there is no rule for the column
+        """
+        column_name = RuleBook.normalize_column_name(column_name_)
+        if column_name in self.pools:
+            pool = self.pools[column_name]
+            return lambda n: pool.sample(n, self.rng)
+        if column_name in self.batch_rules:
+            return self.batch_rules[column_name]
+        if column_name not in self.rules:
+            return None
+        func, index = self.rules[column_name]
+        if isinstance(func, DateGenerator) and index == -1:
+            return func.sample
+        value_rule = self.resolve_value_rule(column_name_)
+        return lambda n: [value_rule() for _ in range(n)]
+
+    def resolve_unique_rule(self, column_name_: str) -> Optional[UniqueKeyGenerator]:
+        """Returns generator of unique keys of a column, None if values of the column can not be generated uniquely by construction
+        """
+        return self.key_rules.get(RuleBook.normalize_column_name(column_name_))
+
+    def generate_column_batch(self, column_name_: str, n: int) -> List[Any]:
+        """Generates n values for a column, resolving its rule only once
+
+        Args:
+            column_name_ (str): Name of the column
+            n (int): Amount of values to generate
+
+        Returns:
+            List[Any]: Generated values (list of None if there is no rule for the column)
+        """
+        if (rule := self.resolve_rule(column_name_)) is None:
+            warnings.warn(f"{column_name_} not in rules. Change column name or add new rule")
+            return [None] * n
+        return rule(n)
+
+    def compile_batch(self, column_names: List[str]) -> Callable[[int], Dict[str, List[Any]]]:
+        """Resolves rules of the columns once, so that batches of them can be generated without looking rules up again
+
+        Columns sharing one stateful generator (e.g. begin and end hour) are generated row by row,
+        in the order of column_names, so that values of one row stay paired like in generate_column_value
+
+        Args:
+            column_names (List[str]): Names of the columns
+
+        Returns:
+            Callable[[int], Dict[str, List[Any]]]: Function taking amount of values and returning column name and its generated values
+        """
+        # Group columns that are generated by the same object
+        shared = {}
+        for column in column_names:
+            column_name = RuleBook.normalize_column_name(column)
+            if column_name in self.rules and column_name not in self.batch_rules and column_name not in self.pools:
+                func = self.rules[column_name][0]
+                shared.setdefault(id(func), (func, []))[1].append(column)
+        # (name of the timer, columns, function taking amount of values and returning values of every column)
+        steps, planned = [], set()
+        for column in column_names:
+            if column in planned:
+                continue
+            func, group = next(((func, group) for func, group in shared.values() if column in group and len(group) > 1), (None, None))
+            if group is None:
+                group = [column]
+                if (rule := self.resolve_rule(column)) is None:
+                    warnings.warn(f"{column} not in rules. Change column name or add new rule")
+                    rule = lambda n: [None] * n
+                produce = lambda n, rule=rule: [rule(n)]
+            elif isinstance(func, HourGenerator) and len(group) == func.limit:
+                # Whole sequence of hours (e.g. begin and end hour) is drawn at once
+                produce = func.sample
+            else:
+                def produce(n: int, value_rules: List[Callable[[], Any]] = [self.resolve_value_rule(grouped_column) for grouped_column in group]) -> List[List[Any]]:
+                    columns = [[] for _ in value_rules]
+                    for _ in range(n):
+                        for values, rule in zip(columns, value_rules):
+                            values.append(rule())
+                    return columns
+            steps.append((f"rule.{'+'.join(group)}", group, produce))
+            planned.update(group)
+        def generate(n: int) -> Dict[str, List[Any]]:
+            result = {}
+            for timer, group, produce in steps:
+                with METRICS.timer(timer):
+                    result.update(zip(group, produce(n)))
+            return result
+        return generate
+
+    def generate_batch(self, column_names: List[str], n: int) -> Dict[str, List[Any]]:
+        """Generates n values for each of the columns (see compile_batch)
+
+        Args:
+            column_names (List[str]): Names of the columns
+            n (int): Amount of values to generate for each column
+
+        Returns:
+            Dict[str, List[Any]]: Column name and its generated values
+        """
+        return self.compile_batch(column_names)(n)
+
+# RuleBooks shared by everything that does not have its own one, created on first use
+_rule_books: Dict[str, RuleBook] = {}
+_rule_books_lock = threading.Lock()
+
+
+def get_rule_book(localization: str = "pl_PL") -> RuleBook:
+    """Returns RuleBook of the locale shared by the whole process, creating it on first call
+    """
+    with _rule_books_lock:
+        if localization not in _rule_books:
+            _rule_books[localization] = RuleBook(localization)
+        return _rule_books[localization]
 
 
-BasicRuleBook = RuleBook("pl_PL")
-PolishRuleBook = RuleBook("pl_PL")
+def __getattr__(name: str) -> Any:
+    # BasicRuleBook and PolishRuleBook are kept for compatibility, but are not created on import
+    if name in ("BasicRuleBook", "PolishRuleBook"):
+        return get_rule_book("pl_PL")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,83 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Dict, List
+
+from dao_models.dao import DAO
+
+
+class DependencyError(ValueError):
+    """Raised when dependencies between data storages can not be resolved (missing or cyclic)
+    """
+    pass
+
+
+def topological_order(data_storages: List[DAO]) -> List[DAO]:
+    """Sorts data storages so that every one of them is placed after all of its dependencies
+
+    Args:
+        data_storages (List[DAO]): Data storages to sort
+
+    Raises:
+        DependencyError: When a dependency is not among data storages or dependencies form a cycle
+
+    Returns:
+        List[DAO]: Data storages in order in which they can be processed one after another
+    """
+    names = {data_storage.name for data_storage in data_storages}
+    for data_storage in data_storages:
+        if missing := [dep for dep in data_storage.dependency if dep not in names]:
+            raise DependencyError(f"{data_storage.name} depends on {missing}, which are not defined")
+    # Kahn's algorithm, keeping the original order among storages that are ready at the same time
+    remaining = {data_storage.name: len(set(data_storage.dependency)) for data_storage in data_storages}
+    ready = [data_storage for data_storage in data_storages if remaining[data_storage.name] == 0]
+    order = []
+    while ready:
+        data_storage = ready.pop(0)
+        order.append(data_storage)
+        for child in data_storages:
+            if data_storage.name in child.dependency:
+                remaining[child.name] -= 1
+                if remaining[child.name] == 0:
+                    ready.append(child)
+    if len(order) < len(data_storages):
+        cyclic = [name for name, count in remaining.items() if count > 0]
+        raise DependencyError(f"Dependencies of {cyclic} form a cycle")
+    return order
+
+
+def run_in_dependency_order(data_storages: List[DAO], action: Callable[[DAO], None], max_workers: int = 1) -> None:
+    """Applies action (e.g. generate or load) to every data storage, starting each one as soon as all of its dependencies are done
+
+    Data storages hold database engines and open files, so they are run in threads of one process
+
+    Args:
+        data_storages (List[DAO]): Data storages to process
+        action (Callable[[DAO], None]): Function applied to each data storage
+        max_workers (int, optional): How many data storages can be processed at the same time. Defaults to 1.
+
+    Raises:
+        DependencyError: When a dependency is missing or dependencies form a cycle
+    """
+    order = topological_order(data_storages)
+    if max_workers <= 1:
+        for data_storage in order:
+            action(data_storage)
+        return
+    remaining = {data_storage.name: len(set(data_storage.dependency)) for data_storage in order}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        running: Dict = {executor.submit(action, data_storage): data_storage for data_storage in order if remaining[data_storage.name] == 0}
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                finished = running.pop(future)
+                try:
+                    future.result()
+                except BaseException:
+                    for pending in running:
+                        pending.cancel()
+                    raise
+                # Start every storage whose last dependency has just finished
+                for child in order:
+                    if finished.name in child.dependency:
+                        remaining[child.name] -= 1
+                        if remaining[child.name] == 0:
+                            running[executor.submit(action, child)] = child
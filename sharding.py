@@ -0,0 +1,130 @@
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from itertools import repeat
+from typing import Dict, Any, List, Optional, Tuple
+
+import multiprocessing
+import numpy as np
+import sqlalchemy
+
+from dao_models.dao import DAO
+from dao_models.dao_csv import CSVDAO
+from dao_models.dao_sql import SQLDAO
+from dao_models.factory import create_data_storage
+from dao_models.bulk_loader import create_sql_engine
+from instrumentation import METRICS
+
+
+@dataclass
+class Shard:
+    """Part of entries of one data storage generated by a single worker process
+    """
+    index: int
+    count: int
+    # Index of the first entry of the shard among all entries
+    start: int
+    size: int
+
+
+def plan_shards(number_of_entries: int, shards: int, align: int = 1) -> List[Shard]:
+    """Splits entries into (at most) shards parts of nearly equal size
+
+    Args:
+        number_of_entries (int): Amount of entries to generate
+        shards (int): Amount of parts
+        align (int, optional): Parts begin at multiples of align (batch size), so that they consist of the same batches
+        as generation in a single process. Defaults to 1.
+
+    Returns:
+        List[Shard]: Parts covering all entries, in order
+    """
+    units = -(-number_of_entries // align)
+    shards = max(1, min(shards, units))
+    size, rest = divmod(units, shards)
+    plan, start = [], 0
+    for index in range(shards):
+        end = min(start + (size + (1 if index < rest else 0)) * align, number_of_entries)
+        plan.append(Shard(index, shards, start, end - start))
+        start = end
+    return plan
+
+
+def generate_shard(config: Dict[str, Any], sql_url: str, snapshot: str, name: str, shard: Shard, seed: int,
+                   key_offset: Optional[int] = None, storage_options: Optional[Dict[str, Any]] = None,
+                   engine_options: Optional[Dict[str, Any]] = None) -> Tuple[Optional[str], Dict[str, Any]]:
+    """Generates one shard of a data storage, run inside a worker process
+
+    Args:
+        config (Dict[str, Any]): Content of the json configuration file
+        sql_url (str): Url of the database
+        snapshot (str): Path to the folder that Sheets are generated into
+        name (str): Name of the data storage
+        shard (Shard): Part of entries to generate
+        seed (int): Seed of the RuleBook used by this worker when the DAO has no seed of the run
+        key_offset (Optional[int], optional): First counter of unique key rules, the same for all shards. Defaults to None.
+        storage_options (Optional[Dict[str, Any]], optional): Keyword arguments of create_data_storage (batch_size, snapshot_format, ...). Defaults to None.
+        engine_options (Optional[Dict[str, Any]], optional): Keyword arguments of create_sql_engine (pool settings, ...). Defaults to None.
+
+    Returns:
+        Tuple[Optional[str], Dict[str, Any]]: Path of the generated part file for Sheets (None for Tables) and metrics of the worker
+    """
+    # Forked workers inherit measurements of the parent, only their own ones are sent back
+    METRICS.reset()
+    engine = create_sql_engine(sql_url, **(engine_options or {}))
+    data_access = create_data_storage(config, engine, sqlalchemy.MetaData(), snapshot, **(storage_options or {}))[name]
+    if data_access.seed is None:
+        # Without seed of the run forked workers would otherwise share the state of their random generators
+        data_access.rule_book.seed(seed)
+    try:
+        if isinstance(data_access, CSVDAO):
+            data_access.generate(shard.size, start=shard.start, part=shard.index)
+            return data_access.output_path(shard.index), METRICS.summary()
+        # Keys of sharded tables come from counters of rows (or from the database), shards never have to know each other's keys
+        data_access.key_offset = key_offset
+        data_access.generate(shard.size, start=shard.start)
+        return None, METRICS.summary()
+    finally:
+        engine.dispose()
+
+
+def generate_sharded(data_access: DAO, number_of_entries: int, shards: int, config: Dict[str, Any], engine: sqlalchemy.Engine,
+                     snapshot: str, storage_options: Optional[Dict[str, Any]] = None, engine_options: Optional[Dict[str, Any]] = None) -> None:
+    """Generates entries of one data storage in shards, each one in its own process with its own seeded RuleBook
+
+    Tables are inserted by every worker straight into the database, Sheets are written into part files
+    that are concatenated afterwards. Shards consist of whole batches, so with a seed of the run (in storage_options)
+    they generate the same rows as a single process would
+
+    Args:
+        data_access (DAO): Data storage to generate
+        number_of_entries (int): Amount of entries to generate
+        shards (int): Amount of worker processes
+        config (Dict[str, Any]): Content of the json configuration file
+        engine (sqlalchemy.Engine): Engine of the database
+        snapshot (str): Path to the folder that Sheets are generated into
+        storage_options (Optional[Dict[str, Any]], optional): Keyword arguments of create_data_storage (batch_size, snapshot_format, ...). Defaults to None.
+        engine_options (Optional[Dict[str, Any]], optional): Keyword arguments of create_sql_engine (pool settings, ...). Defaults to None.
+    """
+    plan = plan_shards(number_of_entries, shards, data_access.get_batch_size())
+    seeds = [int(child.generate_state(1)[0]) for child in np.random.SeedSequence().spawn(len(plan))]
+    sql_url = engine.url.render_as_string(hide_password=False)
+    key_offset = None
+    if isinstance(data_access, SQLDAO) and data_access.get_unique_key_rule() is not None:
+        # Counted once, before any shard inserts, so that all shards share counters of unique keys
+        with engine.connect() as conn:
+            key_offset = data_access.count_entries(conn)
+    # Workers are spawned, not forked: other threads may be importing modules (RuleBook imports Faker / scipy lazily)
+    # and a forked child would inherit their locks
+    with ProcessPoolExecutor(max_workers=len(plan), mp_context=multiprocessing.get_context("spawn")) as executor:
+        results = list(executor.map(generate_shard, repeat(config), repeat(sql_url), repeat(snapshot), repeat(data_access.name), plan, seeds,
+                                    repeat(key_offset), repeat(storage_options), repeat(engine_options)))
+    parts = [part for part, _ in results]
+    for _, summary in results:
+        METRICS.merge(summary)
+    if isinstance(data_access, CSVDAO):
+        with METRICS.scope(data_access.name, "merge_parts"):
+            data_access.merge_parts(parts)
+    else:
+        # Workers inserted keys that this process does not know about, children have to read them from the database
+        data_access.key_pools.pop(data_access.name, None)
+    data_access.generated = True
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Modules of the generator are imported from the root of the repository (like benchmarks and generator.py do)
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
@@ -0,0 +1,34 @@
+from typing import Optional
+
+from benchmarks.harness import BenchmarkResult, compare, missing_from_baseline
+
+BASELINE = {
+    "steady": {"rows_per_second": 1000.0, "peak_rss_mb": 100.0, "error": None},
+    "broken": {"rows_per_second": 0.0, "peak_rss_mb": 100.0, "error": "ValueError: broken"},
+}
+
+
+def result(name: str, rows_per_second: float = 1000.0, peak_rss_mb: float = 100.0, error: Optional[str] = None) -> BenchmarkResult:
+    return BenchmarkResult(name, 1000, 1000 / rows_per_second if rows_per_second else 0.0, rows_per_second, peak_rss_mb, error)
+
+
+def test_compare_within_tolerance():
+    assert compare([result("steady", 850.0, 115.0)], BASELINE) == []
+
+
+def test_compare_slower_and_hungrier():
+    regressions = compare([result("steady", 700.0, 130.0)], BASELINE)
+    assert len(regressions) == 2
+    assert "700 rows/s" in regressions[0] and "peak RSS 130.0 MB" in regressions[1]
+
+
+def test_failed_cases_are_regressions_regardless_of_baseline():
+    failed = [result(name, 0.0, error="AssertionError: over budget") for name in ("steady", "broken", "new")]
+    assert compare(failed, BASELINE) == [f"{name}: fails with AssertionError: over budget" for name in ("steady", "broken", "new")]
+    assert compare(failed, {}) == compare(failed, BASELINE)
+
+
+def test_cases_without_baseline_are_listed():
+    results = [result("steady"), result("broken"), result("new"), result("new_failed", 0.0, error="ValueError: new")]
+    assert compare(results[:3], BASELINE) == []
+    assert missing_from_baseline(results, BASELINE) == ["broken", "new"]
@@ -0,0 +1,81 @@
+import json
+
+import pytest
+
+from generation_spec import check_constraints, load_spec, parse_constraint, resolve_counts
+
+COUNTS = {"Examiner": 100, "Examiners": 120, "Candidate": 1000, "Exam": 2000, "Reservations": 2000}
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Exam <= Reservations", ((1.0, "Exam"), "<=", (1.0, "Reservations"))),
+    ("Examiners >= 1.2 * Examiner", ((1.0, "Examiners"), ">=", (1.2, "Examiner"))),
+    ("2*Exam==Reservations", ((2.0, "Exam"), "==", (1.0, "Reservations"))),
+    ("  Candidate < Exam ", ((1.0, "Candidate"), "<", (1.0, "Exam"))),
+    ("Exam > 0", ((1.0, "Exam"), ">", (0.0, None))),
+    ("10 <= Exam_2", ((10.0, None), "<=", (1.0, "Exam_2"))),
+])
+def test_parse_constraint(text, expected):
+    assert parse_constraint(text) == expected
+
+
+@pytest.mark.parametrize("text", ["Exam => Reservations", "Exam <= ", "Exam + Candidate <= Reservations", "Exam * 2 <= Reservations", "Exam != Reservations", ""])
+def test_parse_constraint_rejects(text):
+    with pytest.raises(ValueError, match="is not of the form"):
+        parse_constraint(text)
+
+
+def test_check_constraints_met():
+    check_constraints(["Exam <= Reservations", "Examiners >= 1.2 * Examiner", {"check": "Candidate > 0", "message": "No candidates"}], COUNTS)
+
+
+def test_check_constraints_lists_every_violation():
+    with pytest.raises(ValueError) as error:
+        check_constraints(["Candidate <= Examiner", {"check": "Exam < Reservations", "message": "Too many exams"}, "Exam <= Reservations"], COUNTS)
+    message = str(error.value)
+    assert "Candidate <= Examiner (Candidate = 1000, Examiner = 100)" in message
+    assert "Exam < Reservations (Exam = 2000, Reservations = 2000): Too many exams" in message
+    assert "Exam <= Reservations (" not in message
+
+
+def test_check_constraints_factor_boundary():
+    check_constraints(["Examiners >= 1.2 * Examiner"], {"Examiners": 120, "Examiner": 100})
+    with pytest.raises(ValueError, match="Examiners = 119"):
+        check_constraints(["Examiners >= 1.2 * Examiner"], {"Examiners": 119, "Examiner": 100})
+
+
+def test_check_constraints_negative_counts():
+    with pytest.raises(ValueError, match="Exam = -1 is negative"):
+        check_constraints([], {"Exam": -1})
+
+
+def test_check_constraints_unknown_name():
+    with pytest.raises(ValueError, match="not generated"):
+        check_constraints(["Vehicle <= Exam"], COUNTS)
+
+
+def test_resolve_counts():
+    config = {"Tables": {"Exam": {"ratio": 2000}, "Vehicle": {"ratio": 50}}, "Sheets": {"Reservations": {"ratio": 2000}, "Examiners": {}}}
+    assert resolve_counts(config, 0.5, {"Examiners": 7}) == {"Exam": 1000, "Vehicle": 25, "Reservations": 1000, "Examiners": 7}
+    with pytest.raises(ValueError, match="Examiners"):
+        resolve_counts(config, 1)
+    with pytest.raises(ValueError, match="Unknown"):
+        resolve_counts(config, 1, {"Unknown": 1, "Examiners": 1})
+
+
+def test_tables_json_constraints_are_valid():
+    """Every constraint of the shipped configuration parses and holds at every scale factor"""
+    from conftest import ROOT
+    with open(f"{ROOT}/tables.json") as file:
+        config = json.load(file)
+    for scale_factor in (0.1, 1, 10):
+        check_constraints(config["Constraints"], resolve_counts(config, scale_factor))
+
+
+def test_load_spec_rejects_unknown_keys(tmp_path):
+    path = tmp_path / "spec.json"
+    path.write_text(json.dumps({"scale_factor": 2, "count": {}}))
+    with pytest.raises(ValueError, match="Unknown keys"):
+        load_spec(str(path))
+    path.write_text(json.dumps({"scale_factor": 2, "counts": {"Exam": 3}}))
+    assert load_spec(str(path)) == {"scale_factor": 2, "counts": {"Exam": 3}}
@@ -0,0 +1,74 @@
+from datetime import date
+
+import re
+
+import numpy as np
+import pytest
+
+from key_generators import IdentityCardKeyGenerator, PeselKeyGenerator, PermutedCounter, RegistrationKeyGenerator
+
+SAMPLE = 200000
+
+
+def counters(generator_class) -> np.ndarray:
+    """Random counters of the whole key space, with its first and last ones"""
+    size = generator_class.size
+    return np.concatenate([[0, 1, size - 2, size - 1], np.random.default_rng(0).choice(size, SAMPLE, replace=False)])
+
+
+def pesel_is_valid(pesel: str) -> bool:
+    """Checksum and date of birth (century encoded in the month) of a PESEL"""
+    if not re.fullmatch(r"\d{11}", pesel):
+        return False
+    digits = [int(digit) for digit in pesel]
+    if (10 - sum(weight * digit for weight, digit in zip([1, 3, 7, 9, 1, 3, 7, 9, 1, 3], digits)) % 10) % 10 != digits[10]:
+        return False
+    year, month, day = int(pesel[:2]), int(pesel[2:4]), int(pesel[4:6])
+    century = 1900 if month <= 12 else 2000
+    try:
+        born = date(century + year, month - (century - 1900) // 5, day)
+    except ValueError:
+        return False
+    return PeselKeyGenerator.first_day <= born <= date(2024, 12, 31)
+
+
+def identity_card_is_valid(number: str) -> bool:
+    """Checksum of a Polish identity card number, letters count as 10 (A) to 35 (Z), the 4th character is the check digit"""
+    if not re.fullmatch(r"[A-Z]{3}\d{6}", number):
+        return False
+    values = [ord(letter) - ord("A") + 10 for letter in number[:3]] + [int(digit) for digit in number[3:]]
+    return sum(weight * value for weight, value in zip([7, 3, 1, 9, 7, 3, 1, 7, 3], values)) % 10 == 0
+
+
+@pytest.mark.parametrize("generator_class, is_valid", [
+    (PeselKeyGenerator, pesel_is_valid),
+    (IdentityCardKeyGenerator, identity_card_is_valid),
+    (RegistrationKeyGenerator, lambda number: re.fullmatch(r"[A-Z]{2}\d{6}", number) is not None),
+], ids=["pesel", "identity_card", "registration"])
+def test_keys_are_unique_and_valid(generator_class, is_valid):
+    keys = generator_class(seed=3).generate(counters(generator_class))
+    assert len(set(keys)) == len(keys)
+    assert [key for key in keys if not is_valid(key)] == []
+
+
+@pytest.mark.parametrize("generator_class", [PeselKeyGenerator, IdentityCardKeyGenerator, RegistrationKeyGenerator])
+def test_keys_depend_only_on_seed_and_counter(generator_class):
+    sample = np.arange(1000, 2000)
+    assert generator_class(seed=5).generate(sample) == generator_class(seed=5).generate(sample)
+    # Keys of one counter are the same whichever batch it is generated in
+    assert generator_class(seed=5).generate(sample)[10:20] == generator_class(seed=5).generate(sample[10:20])
+    assert generator_class(seed=5).generate(sample) != generator_class(seed=6).generate(sample)
+
+
+@pytest.mark.parametrize("generator_class", [PeselKeyGenerator, IdentityCardKeyGenerator, RegistrationKeyGenerator])
+def test_counters_out_of_key_space(generator_class):
+    with pytest.raises(ValueError, match="unique keys"):
+        generator_class().generate(np.array([generator_class.size]))
+    with pytest.raises(ValueError, match="unique keys"):
+        generator_class().generate(np.array([-1]))
+
+
+@pytest.mark.parametrize("size", [2, 3, 97, 1000, 26 ** 3])
+def test_permuted_counter_is_bijective(size):
+    permutation = PermutedCounter(size, seed=size)
+    assert sorted(permutation(np.arange(size)).tolist()) == list(range(size))
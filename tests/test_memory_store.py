@@ -0,0 +1,25 @@
+import sqlalchemy
+
+from dao_models.dao_memory import ColumnStore
+
+
+def identity_table() -> sqlalchemy.Table:
+    return sqlalchemy.Table("Exam", sqlalchemy.MetaData(),
+                            sqlalchemy.Column("Exam_ID", sqlalchemy.Integer, sqlalchemy.Identity(), primary_key=True),
+                            sqlalchemy.Column("Result", sqlalchemy.String(10)))
+
+
+def test_identity_is_numbered_when_batch_has_only_none():
+    store = ColumnStore(identity_table())
+    store.append(["Exam_ID", "Result"], [(None, "passed"), (None, "failed")])
+    store.append(["Result"], [("passed",)])
+    assert store.keys().tolist() == [1, 2, 3]
+
+
+def test_identity_continues_after_given_values():
+    store = ColumnStore(identity_table())
+    store.append(["Exam_ID", "Result"], [(None, "passed"), (5, "failed"), (None, "passed")])
+    store.append(["Exam_ID", "Result"], [(None, "failed")])
+    keys = store.keys().tolist()
+    assert len(set(keys)) == len(keys) == 4
+    assert keys[1] == 5 and all(key > 5 for key in keys[2:])
@@ -0,0 +1,104 @@
+from typing import Dict, Optional
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ROOT
+from dao_models.snapshot_io import CHECKPOINTS_FOLDER
+
+GENERATOR = os.path.join(ROOT, "generator.py")
+CONFIG = os.path.join(ROOT, "tables.json")
+# Several batches of tables and of a sheet (batches decide about seeds, sheets write 5000 rows at once), small enough to run in seconds.
+# With one worker batches are stored in the order Examiner (1), Vehicle (1), Candidate (3), Examiners (3), Exam (6), Reservations (1, fused with Exam)
+COUNTS = {"Examiner": 150, "Candidate": 1500, "Vehicle": 80, "Exam": 3000, "Reservations": 3000, "Examiners": 11000}
+ARGUMENTS = ["--config", CONFIG, "--seed", "42", "--batch-size", "500", "--metrics"]
+# Runs generator.py (as the CLI does) in a process that dies once the given amount of batches is stored
+CRASH_SCRIPT = """import os, runpy, sys, threading
+sys.path.insert(0, {root!r})
+sys.argv = [{generator!r}] + {arguments!r}
+from instrumentation import METRICS
+original, done, lock = METRICS.batch_done, [0], threading.Lock()
+def batch_done(rows, total):
+    original(rows, total)
+    with lock:
+        done[0] += 1
+        if done[0] == {crash}:
+            os._exit(3)
+METRICS.batch_done = batch_done
+runpy.run_path({generator!r}, run_name="__main__")
+"""
+
+
+def run_generator(folder: str, *arguments: str, database: Optional[str] = "test.db", script: Optional[str] = None) -> subprocess.CompletedProcess:
+    """Runs generator.py with COUNTS (typed in the order they are asked for) in folder (snapshots are written
+    into folder/data/snapshots), into SQLite database of folder or in memory if database is None
+    """
+    os.makedirs(os.path.join(folder, "data", "snapshots"), exist_ok=True)
+    env = {key: value for key, value in os.environ.items() if key != "SQL_URL"}
+    if database is not None:
+        env["SQL_URL"] = f"sqlite:///{os.path.join(folder, database)}"
+    amounts = "".join(f"{count}\n" for count in COUNTS.values())
+    arguments = [*ARGUMENTS, *arguments]
+    command = [sys.executable, GENERATOR, *arguments] if script is None else \
+        [sys.executable, "-c", script.format(root=ROOT, generator=GENERATOR, arguments=arguments)]
+    return subprocess.run(command, cwd=folder, env=env, input=amounts, capture_output=True, text=True)
+
+
+def snapshot_files(folder: str, snapshot: str = "T1") -> Dict[str, bytes]:
+    path = os.path.join(folder, "data", "snapshots", snapshot)
+    return {name: open(os.path.join(path, name), "rb").read() for name in sorted(os.listdir(path)) if os.path.isfile(os.path.join(path, name))}
+
+
+@pytest.fixture(scope="module")
+def sequential(tmp_path_factory) -> Dict[str, bytes]:
+    folder = str(tmp_path_factory.mktemp("sequential"))
+    result = run_generator(folder)
+    assert result.returncode == 0, result.stderr
+    return snapshot_files(folder)
+
+
+@pytest.mark.parametrize("arguments, database", [
+    (["--max-workers", "3"], "test.db"),
+    (["--backend", "memory"], None),
+    (["--backend", "memory", "--max-workers", "3"], None),
+    (["--shards", "Candidate=2", "--shards", "Examiners=2"], "test.db"),
+], ids=["max_workers", "memory", "memory_max_workers", "shards"])
+def test_seed_gives_identical_files(tmp_path, sequential, arguments, database):
+    result = run_generator(str(tmp_path), *arguments, database=database)
+    assert result.returncode == 0, result.stderr
+    files = snapshot_files(str(tmp_path))
+    assert files.keys() == sequential.keys()
+    assert [name for name in files if files[name] != sequential[name]] == []
+
+
+def test_shards_need_unique_key_rule(tmp_path):
+    """Shards do not share used keys, so a table whose primary key may be drawn twice is not generated in shards"""
+    with open(CONFIG) as file:
+        config = json.load(file)
+    config["Tables"]["Vehicle"]["primary_key"] = ["Brand"]
+    config["Tables"]["Exam"]["foreign_key"]["Vehicle"] = ["Varchar(30)", "Vehicle.Brand"]
+    path = tmp_path / "tables.json"
+    path.write_text(json.dumps(config))
+    result = run_generator(str(tmp_path), "--config", str(path), "--shards", "Vehicle=2")
+    assert result.returncode != 0
+    assert "Vehicle cannot be generated in shards" in result.stderr
+
+
+@pytest.mark.parametrize("crash", [12, 8], ids=["in_table", "in_sheet"])
+def test_resumed_run_gives_identical_files(tmp_path, sequential, crash):
+    """Run dies after its 4th batch of Exam (rows of 2 batches stored after the last checkpoint) or 3rd batch of Examiners,
+    the resumed run writes the same files as a run that never crashed
+    """
+    folder = str(tmp_path)
+    crashed = run_generator(folder, "--checkpoint-every", "2", script=CRASH_SCRIPT.replace("{crash}", str(crash)))
+    assert crashed.returncode == 3, crashed.stderr
+    assert os.path.isdir(os.path.join(folder, "data", "snapshots", "T1", CHECKPOINTS_FOLDER))
+    resumed = run_generator(folder, "--resume", "--checkpoint-every", "2")
+    assert resumed.returncode == 0, resumed.stderr
+    files = snapshot_files(folder)
+    assert files.keys() == sequential.keys()
+    assert [name for name in files if files[name] != sequential[name]] == []
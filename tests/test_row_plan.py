@@ -0,0 +1,61 @@
+from datetime import date, time
+
+import json
+import os
+
+import pytest
+import sqlalchemy
+
+from conftest import ROOT
+from dao_models.factory import create_data_storage
+
+# Rows of Exam read by Reservations: false values are kept, missing ones (None) are generated
+EXAMS = [
+    {"Candidate": "02211012345", "Exam_date": date(2024, 1, 2), "Begin_hour": time(8), "Type": False, "Examiner": "ABC123456"},
+    {"Candidate": "02211012346", "Exam_date": date(2024, 1, 3), "Begin_hour": time(9), "Type": True, "Examiner": "ABC123457"},
+    {"Candidate": "02211012347", "Exam_date": date(2024, 1, 4), "Begin_hour": time(10), "Type": None, "Examiner": "ABC123458"},
+    {"Candidate": "02211012348", "Exam_date": date(2024, 1, 5), "Begin_hour": time(11), "Type": 0, "Examiner": "ABC123459"},
+]
+
+
+@pytest.fixture
+def storage(tmp_path):
+    with open(os.path.join(ROOT, "tables.json")) as file:
+        config = json.load(file)
+    return create_data_storage(config, sqlalchemy.create_engine("sqlite://"), sqlalchemy.MetaData(), str(tmp_path), seed=7)
+
+
+def test_plan_keeps_false_values_of_dependencies(storage):
+    """Rows built for a whole batch hold the same values of the dependency as rows built one by one,
+    rows the dependency does not have (one more than it has) are generated
+    """
+    reservations = storage["Reservations"]
+    plan = reservations.get_row_plan()
+    size = len(EXAMS) + 1
+    values = plan.generate(size)
+    reservations.fill_dependencies(values, {"Exam": iter(EXAMS)}, size)
+    batch = [dict(zip(plan.columns, row)) for row in plan.rows(values)]
+    rows = iter(EXAMS)
+    entries = [reservations.generate_entry({"Exam": rows}) for _ in range(size)]
+    for exam, row, entry in zip(EXAMS, batch, entries):
+        given = {column: exam[source] for column, source in reservations.mapping["Exam"].items() if exam[source] is not None}
+        assert {column: row[column] for column in given} == given
+        assert {column: entry[column] for column in given} == given
+    assert [row["Exam_type"] for row in batch[:2]] + [batch[3]["Exam_type"]] == [False, True, 0]
+    # Generated values take the form of values of the database (booleans of Exam.Type)
+    assert isinstance(batch[2]["Exam_type"], bool) and isinstance(entries[2]["Exam_type"], bool)
+    assert all(value is not None for value in batch[4].values()) and isinstance(batch[4]["Exam_type"], bool)
+
+
+def test_vehicle_is_dropped_for_theory_exams(storage):
+    plan = storage["Exam"].get_row_plan()
+    types = [0, 1, False, True, None]
+    vehicles = ["WA00001", "WA00002", "WA00003", "WA00004", "WA00005"]
+    values = {"Type": list(types), "Vehicle": list(vehicles)}
+    plan.apply_post_rules(values)
+    assert values["Vehicle"] == [None, "WA00002", None, "WA00004", "WA00005"]
+    # The same row by row
+    for exam_type, vehicle, expected in zip(types, vehicles, values["Vehicle"]):
+        row = {"Type": [exam_type], "Vehicle": [vehicle]}
+        plan.apply_post_rules(row)
+        assert row["Vehicle"] == [expected]
@@ -0,0 +1,124 @@
+from typing import Any, Dict, List, Optional
+
+import os
+import threading
+import numpy as np
+
+from rule_book import RuleBook, derive_seed
+from instrumentation import METRICS
+
+
+class ValuePool:
+    """Values of one (expensive) rule generated once, every batch draws from them by index instead of calling the rule per value
+
+    Pool is built from a seed derived only from the locale and the rule, so the first k values of a pool are always the same.
+    Thanks to that a pool saved into a file can be reused by every run and every process (it is memory-mapped, not copied),
+    and a smaller pool is a prefix of a bigger one
+    """
+    # Values generated at once while the pool is built
+    chunk_size = 10000
+
+    def __init__(self, rule_name: str, localization: str, size: int, memory_budget: Optional[int] = None, path: Optional[str] = None):
+        """
+        Args:
+            rule_name (str): Name of the rule (normalized name of the column)
+            localization (str): Locale of Faker generating the values
+            size (int): Amount of values in the pool
+            memory_budget (Optional[int], optional): Bytes the values may take, the pool is made smaller if they do not fit. Defaults to None (no limit).
+            path (Optional[str], optional): Folder of pool files, pools are kept only in memory if not given. Defaults to None.
+        """
+        self.rule_name = rule_name
+        self.localization = localization
+        self.size = size
+        self.memory_budget = memory_budget
+        self.path = path
+        # Built (or read) on first use, see values
+        self._values = None
+        self.lock = threading.Lock()
+
+    @property
+    def filepath(self) -> Optional[str]:
+        return os.path.join(self.path, f"{self.localization}_{self.rule_name}.npy") if self.path else None
+
+    @property
+    def values(self) -> np.ndarray:
+        with self.lock:
+            if self._values is None:
+                self._values = self.load()
+        return self._values
+
+    def fitting(self, values: np.ndarray) -> int:
+        """Amount of first values of the pool that fit into its memory budget (strings take 4 bytes per char of the longest one)
+        """
+        values = values[:self.size]
+        if self.memory_budget is None or not len(values):
+            return len(values)
+        if values.dtype.kind == "U":
+            widths = np.maximum.accumulate(np.char.str_len(values)) * 4
+        else:
+            widths = np.full(len(values), values.dtype.itemsize)
+        return int(np.count_nonzero(widths * np.arange(1, len(values) + 1) <= self.memory_budget))
+
+    def load(self) -> np.ndarray:
+        """Reads values of the pool from its file if it holds enough of them, builds (and saves) the pool otherwise
+        """
+        filepath = self.filepath
+        if filepath is not None and os.path.exists(filepath):
+            values = np.load(filepath, mmap_mode="r", allow_pickle=False)
+            # File of a bigger pool (or of one cut by the budget) holds every value needed
+            if len(values) >= self.size or self.fitting(values) < len(values):
+                return values[:self.fitting(values)]
+        with METRICS.timer(f"pool.{self.rule_name}"):
+            values = self.build()
+        if filepath is None:
+            return values
+        os.makedirs(self.path, exist_ok=True)
+        # Pool is written under a temporary name, so that other processes never read a half written file
+        temporary = f"{filepath}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary, "wb") as file:
+            np.save(file, values, allow_pickle=False)
+        os.replace(temporary, filepath)
+        return np.load(filepath, mmap_mode="r", allow_pickle=False)
+
+    def build(self) -> np.ndarray:
+        """Generates values of the pool chunk by chunk, until there are size of them or they stop fitting into the budget
+
+        Raises:
+            ValueError: When there is no rule of the pool
+        """
+        rule_book = RuleBook(self.localization)
+        rule_book.seed(derive_seed(0, "pool", self.localization, self.rule_name))
+        if (rule := rule_book.resolve_rule(self.rule_name)) is None:
+            raise ValueError(f"There is no rule {self.rule_name} to build a pool of")
+        values = np.array(rule(min(self.chunk_size, self.size)))
+        while len(values) < self.size and self.fitting(values) == len(values):
+            values = np.concatenate([values, np.array(rule(min(self.chunk_size, self.size - len(values))))])
+        return values[:self.fitting(values)]
+
+    def sample(self, n: int, rng: np.random.Generator) -> List[Any]:
+        values = self.values
+        return values[rng.integers(0, len(values), size=n)].tolist()
+
+
+def create_value_pools(config: Optional[Dict[str, Any]], localization: str) -> Dict[str, ValuePool]:
+    """Creates pools described in "Pools" of the json configuration (nothing is generated before a pool is used)
+
+    {"columns": {"column_name": size_of_the_pool}, "memory_budget_mb": 256, "path": "data/pools"}
+
+    Memory budget (optional) is split between pools in proportion to their sizes, path (optional) is the folder pools are saved into
+
+    Args:
+        config (Optional[Dict[str, Any]]): "Pools" of the json configuration, None if there are no pools
+        localization (str): Locale of the values
+
+    Returns:
+        Dict[str, ValuePool]: Name of the rule and its pool
+    """
+    if not config:
+        return {}
+    sizes = {RuleBook.normalize_column_name(column): int(size) for column, size in config["columns"].items()}
+    budget = config.get("memory_budget_mb")
+    total = sum(sizes.values())
+    return {rule_name: ValuePool(rule_name, localization, size,
+                                 None if budget is None else int(budget * 2 ** 20 * size / total), config.get("path"))
+            for rule_name, size in sizes.items()}